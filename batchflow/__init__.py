@@ -1,22 +1,57 @@
 """ BatchFlow enables a fast processing of large dataset using flexible pipelines """
 
 import sys
+import importlib
+import importlib.util
 
 if sys.version_info < (3, 5):
     raise ImportError("BatchFlow module requires Python 3.5 or higher")
 
-from .base import Baseset
-from .batch import Batch
-from .batch_image import ImagesBatch
-from .config import Config
-from .dataset import Dataset
-from .pipeline import Pipeline
-from .named_expr import NamedExpression, B, C, F, L, V, M, D, R, W, P, I
-from .dsindex import DatasetIndex, FilesIndex
-from .decorators import action, inbatch_parallel, parallel, any_action_failed, mjit, deprecated, apply_parallel
-from .exceptions import SkipBatchException, EmptyBatchSequence
-from .sampler import Sampler, ConstantSampler, NumpySampler, HistoSampler, ScipySampler
-from .utils import save_data_to
+
+# public names and modules they come from
+# modules are imported on the first access to their names, so that heavy dependencies
+# (e.g. scipy, PIL or numba) are not imported until the feature which needs them is used
+_LAZY_NAMES = {
+    'base': ['Baseset'],
+    'batch': ['Batch'],
+    'batch_image': ['ImagesBatch'],
+    'config': ['Config'],
+    'dataset': ['Dataset'],
+    'pipeline': ['Pipeline'],
+    'named_expr': ['NamedExpression', 'B', 'C', 'F', 'L', 'V', 'M', 'D', 'R', 'W', 'P', 'I'],
+    'dsindex': ['DatasetIndex', 'FilesIndex'],
+    'decorators': ['action', 'inbatch_parallel', 'parallel', 'any_action_failed', 'mjit', 'deprecated',
+                   'apply_parallel'],
+    'exceptions': ['SkipBatchException', 'EmptyBatchSequence'],
+    'sampler': ['Sampler', 'ConstantSampler', 'NumpySampler', 'HistoSampler', 'ScipySampler'],
+    'utils': ['save_data_to'],
+}
+_MODULES = {name: module for module, names in _LAZY_NAMES.items() for name in names}
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(name):
+    """ Import a public name on the first access (PEP 562) """
+    module = _MODULES.get(name)
+    if module is None:
+        # submodules were available as attributes when everything was imported at once
+        if name.startswith('_') or importlib.util.find_spec('.' + name, __name__) is None:
+            raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+        return importlib.import_module('.' + name, __name__)
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES))
+
+
+if sys.version_info < (3, 7):
+    # module-level __getattr__ is not supported, so everything is imported at once
+    for _name in _MODULES:
+        globals()[_name] = __getattr__(_name)
 
 
 __version__ = '0.3.0'
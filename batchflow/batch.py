@@ -16,14 +16,6 @@ try:
     import pandas as pd
 except ImportError:
     import _fake as pd
-try:
-    import feather
-except ImportError:
-    pass
-try:
-    import dask.dataframe as dd
-except ImportError:
-    import _fake as dd
 
 from .dsindex import DatasetIndex, FilesIndex
 # renaming apply_parallel decorator is needed as Batch.apply_parallel method is also in the same namespace
@@ -31,6 +23,9 @@ from .dsindex import DatasetIndex, FilesIndex
 from .decorators import action, inbatch_parallel, any_action_failed, apply_parallel as apply_parallel_
 from .components import create_item_class, BaseComponents
 from .named_expr import P, R
+from .rng import random_streams
+from .store import ColumnStore, open_store
+from .table import open_table, TableWriter
 
 
 class MethodsTransformingMeta(type):
@@ -101,6 +96,8 @@ class Batch(metaclass=MethodsTransformingMeta):
         self._dataset = dataset
         self._pipeline = pipeline
         self._attrs = None
+        self.random_key = None
+        self._random_streams = {}
         self.create_attrs(**kwargs)
 
     def create_attrs(self, **kwargs):
@@ -156,6 +153,44 @@ class Batch(metaclass=MethodsTransformingMeta):
             self._local.pipeline = val
         self._pipeline = val
 
+    @property
+    def random(self):
+        """: np.random.Generator - a random stream of the batch
+
+        Within a pipeline run each batch draws from its own stream (see `seed` in :meth:`.Pipeline.gen_batch`),
+        so random values do not depend on prefetching or on the order batches are processed in.
+        Outside of a pipeline it is a stream of the current thread.
+        """
+        return self.get_random_stream()
+
+    def get_random_stream(self, streams=None):
+        """ Return a random stream of the batch
+
+        Parameters
+        ----------
+        streams : RandomStreams
+            streams to take the batch stream from (default is the pipeline streams).
+
+        Returns
+        -------
+        np.random.Generator
+            a stream for the batch :attr:`random_key` which is created once for each `streams`,
+            or a stream of the current thread if the batch has no key.
+        """
+        if streams is None:
+            streams = getattr(self.pipeline, 'random_streams', None)
+        if streams is None or self.random_key is None:
+            return random_streams.local
+        rng = self._random_streams.get(id(streams))
+        if rng is None:
+            rng = self._random_streams.setdefault(id(streams), streams.get(self.random_key))
+        return rng
+
+    def inherit_random_streams(self, batch):
+        """ Continue drawing from random streams of another batch (e.g. the one this batch was created from) """
+        self.random_key = batch.random_key
+        self._random_streams = batch._random_streams      # pylint: disable=protected-access
+
     def __copy__(self):
         pipeline = self.pipeline
         self.pipeline = None
@@ -497,6 +532,20 @@ class Batch(metaclass=MethodsTransformingMeta):
         p : float or None
             probability of applying func to an element in the batch
 
+        vectorized : bool, str or callable
+            whether to process the whole component at once instead of calling ``func`` for each item:
+
+            - False - apply ``func`` to each item (default)
+            - True - ``func`` is applied to the whole component array (so it should process all items at once)
+            - str - a name of the batch method to apply to the whole component array
+            - callable - a function to apply to the whole component array
+
+            The vectorized mode is used only when `src` is a single component which is a homogeneous
+            numeric array. Parameters wrapped with ``P`` are passed as arrays with one value per item,
+            and numeric values are reshaped to broadcast against the component array
+            (e.g. per-item multipliers of shape `(N,)` become `(N, 1, 1, 1)` for images of shape `(N, H, W, C)`).
+            Ragged and object arrays always fall back to per-item processing.
+
         args, kwargs
             other parameters passed to ``func``
 
@@ -529,21 +578,23 @@ class Batch(metaclass=MethodsTransformingMeta):
             apply_parallel(rotate, src=['images', 'masks'], dst=['images', 'masks'], p=.2)
             apply_parallel(MyBatch.some_static_method, p=.5)
             apply_parallel(B.some_method, src='features', p=.5)
+            apply_parallel(np.clip, src='features', a_min=0, a_max=1, vectorized=True)
         """
         kwargs = {**self.apply_defaults, **kwargs}
 
         src, dst = [kwargs.pop(name, None) for name in ('src', 'dst')]
+        vectorized = kwargs.pop('vectorized', False)
 
         if isinstance(src, list) and (dst is None or isinstance(dst, list) and len(src) == len(dst)):
             if dst is None:
                 dst = src
             if isinstance(p, float):
-                p = P(np.random.binomial(1, p, size=len(self)))
+                p = P(self.random.binomial(1, p, size=len(self)))
 
             for ones, oned in zip(src, dst):
                 kwargs['src'] = ones
                 kwargs['dst'] = oned
-                self.apply_parallel(func, *args, p=p, **kwargs)
+                self.apply_parallel(func, *args, p=p, vectorized=vectorized, **kwargs)
             return self
 
         if isinstance(src, str):
@@ -558,11 +609,127 @@ class Batch(metaclass=MethodsTransformingMeta):
 
         post, target = [kwargs.pop(name, None) for name in ('post', 'target')]
 
+        if vectorized and isinstance(src, str) and post == '_assemble' and self._is_vectorizable(init):
+            args, kwargs, p, params = self._get_items_values(args, kwargs, p, init.ndim)
+            if params is not None:
+                if vectorized is not True:
+                    func = getattr(self, vectorized) if isinstance(vectorized, str) else vectorized
+                kwargs.pop('n_workers', None)
+                return self._apply_vectorized(func, init, *args, p=p, src=src, dst=dst or src, params=params,
+                                              **kwargs)
+
         parallel = inbatch_parallel(init=init, post=post, target=target, src=src, dst=dst)
         # unbind the method to pass self explicitly
         transform = parallel(type(self)._apply_once)
         return transform(self, *args, func=func, p=p, **kwargs)
 
+    def _is_vectorizable(self, data):
+        """ Check whether component data can be processed all at once """
+        return isinstance(data, np.ndarray) and data.dtype != object and data.ndim > 0 and len(data) == len(self)
+
+    def _get_items_values(self, args, kwargs, p, ndim):
+        """ Evaluate per-item parameters (wrapped with ``P``) for the vectorized mode of :meth:`.apply_parallel`.
+
+        Returns
+        -------
+        args, kwargs, p, params
+            `params` contains positions and names of per-item parameters.
+            If some per-item values cannot be stacked into a homogeneous array, `params` is None and
+            evaluated values are wrapped with ``P`` again, so that the per-item mode gets exactly the same values.
+        """
+        params, ragged = [], []
+        values = {}
+
+        def _get_value(value, key):
+            if not isinstance(value, P):
+                return value
+            value = value.get(batch=self, parallel=True)
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', np.VisibleDeprecationWarning)
+                    items = np.asarray(value)[:len(self)]
+            except ValueError:
+                items = np.empty(0, dtype=object)
+            params.append(key)
+            values[key] = value
+            if items.dtype == object:
+                ragged.append(key)
+            elif items.dtype.kind in 'biufc':
+                # per-item values should broadcast against the component array
+                new_shape = items.shape[:1] + (1,) * max(0, ndim - items.ndim) + items.shape[1:]
+                items = items.reshape(new_shape)
+            return items
+
+        args = [_get_value(value, i) for i, value in enumerate(args)]
+        kwargs = {name: _get_value(value, name) for name, value in kwargs.items()}
+        p = _get_value(p, 'p')
+
+        if ragged:
+            # restore P-wrapped values for the per-item mode
+            args = [P(values[i]) if i in values else value for i, value in enumerate(args)]
+            kwargs = {name: P(values[name]) if name in values else value for name, value in kwargs.items()}
+            p = P(values['p']) if 'p' in values else p
+            return args, kwargs, p, None
+        return args, kwargs, p, params
+
+    def _apply_vectorized(self, func, data, *args, p=None, src=None, dst=None, params=None, **kwargs):
+        """ Apply a function to the whole component array at once.
+
+        Parameters
+        ----------
+        func : callable
+            a function which takes an array with all the items and returns an array of the same length
+        data : np.ndarray
+            component data
+        p : None, int or np.ndarray
+            whether to apply func to each item in the batch
+        src : str
+            a component `data` is taken from
+        dst : str
+            a component to put the result into
+        params : list
+            positions and names of per-item parameters (arrays with one value per item)
+        args, kwargs
+            other parameters passed to ``func``
+        """
+        params = params or []
+        if isinstance(p, np.ndarray):
+            mask = p.reshape(len(self), -1)[:, 0].astype(bool)
+        elif p is None or p == 1:
+            mask = None
+        else:
+            mask = np.zeros(len(self), dtype=bool)
+
+        if mask is None or mask.all():
+            result = func(data, *args, **kwargs)
+        elif not mask.any():
+            # another component should not share memory with the source one
+            result = data if dst == src else data.copy()
+        else:
+            pos = np.flatnonzero(mask)
+            take = lambda value, key: value[pos] if key in params else value
+            items_result = func(data[pos], *[take(value, i) for i, value in enumerate(args)],
+                                **{name: take(value, name) for name, value in kwargs.items()})
+            if isinstance(items_result, np.ndarray) and items_result.shape[1:] == data.shape[1:]:
+                result = data.astype(np.result_type(data, items_result))
+                result[pos] = items_result
+            else:
+                result = list(data)
+                for i, item in zip(pos, items_result):
+                    result[i] = item
+                self._assemble_component(result, component=dst)
+                return self
+
+        if not isinstance(result, np.ndarray) or len(result) != len(data):
+            raise ValueError("Vectorized function should return an array with one item per batch item, "
+                             "but returned %s" % type(result))
+
+        if hasattr(self, dst):
+            setattr(self, dst, result)
+        else:
+            self.add_components(dst, result)
+        return self
+
     def _apply_once(self, item, *args, func=None, p=None, **kwargs):
         """ Apply a function to each item in the batch.
 
@@ -749,21 +916,27 @@ class Batch(metaclass=MethodsTransformingMeta):
             data = dict(zip(components, item))
             f.write(blosc.compress(dill.dumps(data)))
 
+    def _load_store(self, src, dst=None):
+        """ Load components from a chunked columnar store (see :class:`~.store.ColumnStore`) """
+        store = open_store(src)
+        dst = (dst,) if isinstance(dst, str) else tuple(dst or self.components)
+        for comp in dst:
+            setattr(self, comp, store.read(comp, keys=self.indices))
+
+    def _dump_store(self, dst, components=None, **kwargs):
+        """ Append components to a chunked columnar store (see :class:`~.store.ColumnStore`) """
+        components = tuple(components or self.components)
+        data = {comp: self.get(component=comp) for comp in components}
+        store = dst if isinstance(dst, ColumnStore) else ColumnStore(dst, mode='a')
+        store.append(self.indices, data, **kwargs)
+
     def _load_table(self, src, fmt, dst=None, post=None, *args, **kwargs):
-        """ Load a data frame from table formats: csv, hdf5, feather """
-        if fmt == 'csv':
-            _data = pd.read_csv(src, *args, **kwargs)
-        elif fmt == 'feather':
-            _data = feather.read_dataframe(src, *args, **kwargs)
-        elif fmt == 'hdf5':
-            _data = pd.read_hdf(src, *args, **kwargs)
-
-        # Put into this batch only part of it (defined by index)
-        if isinstance(_data, pd.DataFrame):
-            _data = _data.loc[self.indices]
-        elif isinstance(_data, dd.DataFrame):
-            # dask.DataFrame.loc supports advanced indexing only with lists
-            _data = _data.loc[list(self.indices)].compute()
+        """ Load a data frame from table formats: csv, hdf5, feather, parquet
+
+        A file is opened once per process and only rows for the batch are taken from it
+        (see :class:`~.table.TableSource`).
+        """
+        _data = open_table(src, fmt, *args, **kwargs).loc[self.indices]
 
         if callable(post):
             _data = post(_data, src=src, fmt=fmt, dst=dst, **kwargs)
@@ -771,17 +944,17 @@ class Batch(metaclass=MethodsTransformingMeta):
         self.load(src=_data, dst=dst)
 
 
-    @action(use_lock='__dump_table_lock')
     def _dump_table(self, dst, fmt='feather', components=None, *args, **kwargs):
         """ Save batch data to table formats
 
+        Within a pipeline run rows of all batches are appended to the same file by a background writer
+        (see :meth:`.Pipeline.get_table_writer`), otherwise the file is overwritten with the batch rows.
+
         Args:
           dst: str - a path to dump into
-          fmt: str - format: feather, hdf5, csv
+          fmt: str - format: feather, parquet, hdf5, csv
           components: str or tuple - one or several component names
         """
-        filename = dst
-
         components = tuple(components or self.components)
         data_dict = {}
         for comp in components:
@@ -791,35 +964,36 @@ class Batch(metaclass=MethodsTransformingMeta):
             elif isinstance(comp_data, np.ndarray):
                 if comp_data.ndim > 1:
                     columns = [comp + str(i) for i in range(comp_data.shape[1])]
-                    comp_dict = zip(columns, (comp_data[:, i] for i in range(comp_data.shape[1])))
-                    data_dict.update({comp: comp_dict})
+                    data_dict.update(zip(columns, (comp_data[:, i] for i in range(comp_data.shape[1]))))
                 else:
                     data_dict.update({comp: comp_data})
             else:
                 data_dict.update({comp: comp_data})
         _data = pd.DataFrame(data_dict)
 
-        if fmt == 'feather':
-            feather.write_dataframe(_data, filename, *args, **kwargs)
-        elif fmt == 'hdf5':
-            _data.to_hdf(filename, *args, **kwargs)   # pylint:disable=no-member
-        elif fmt == 'csv':
-            _data.to_csv(filename, *args, **kwargs)   # pylint:disable=no-member
+        if fmt == 'hdf5' and args:
+            kwargs['key'] = args[0]
+        if self.pipeline is not None:
+            self.pipeline.get_table_writer(dst, fmt, **kwargs).write(_data)
         else:
-            raise ValueError('Unknown format %s' % fmt)
+            writer = TableWriter(dst, fmt, **kwargs)
+            writer.write(_data)
+            writer.close()
 
         return self
 
     def _load_from_source(self, dst, src):
         """ Load data from a memory object (tuple, ndarray, pd.DataFrame, etc) """
+        # reuse positions from the batch index to find items in the cropped data
+        pos = self.index._pos if isinstance(self.index, DatasetIndex) else None # pylint:disable=protected-access
         if dst is None:
             self._data = create_item_class(self.components, source=src, indices=self.indices,
-                                           crop=True, copy=self._copy)
+                                           crop=True, copy=self._copy, pos=pos)
         else:
             if isinstance(dst, str):
                 dst = (dst,)
                 src = (src,)
-            source = create_item_class(dst, source=src, indices=self.indices, crop=True, copy=self._copy)
+            source = create_item_class(dst, source=src, indices=self.indices, crop=True, copy=self._copy, pos=pos)
             for comp in dst:
                 setattr(self, comp, getattr(source, comp))
 
@@ -833,7 +1007,9 @@ class Batch(metaclass=MethodsTransformingMeta):
             a source (e.g. an array or a file name)
 
         fmt : str
-            a source format, one of None, 'blosc', 'csv', 'hdf5', 'feather'
+            a source format, one of None, 'blosc', 'store', 'csv', 'hdf5', 'feather', 'parquet'.
+            'store' is a chunked columnar store (see :class:`~.store.ColumnStore`), where `src` is
+            a path to it or the store itself.
 
         dst : None or str or tuple of str
             components to load `src` to
@@ -884,7 +1060,9 @@ class Batch(metaclass=MethodsTransformingMeta):
             self._load_from_source(src=src, dst=dst)
         elif fmt == 'blosc':
             self._load_blosc(src=src, dst=dst, **kwargs)
-        elif fmt in ['csv', 'hdf5', 'feather']:
+        elif fmt == 'store':
+            self._load_store(src=src, dst=dst)
+        elif fmt in ['csv', 'hdf5', 'feather', 'parquet']:
             self._load_table(src=src, fmt=fmt, dst=dst, **kwargs)
         else:
             raise ValueError("Unknown format " + fmt)
@@ -900,7 +1078,11 @@ class Batch(metaclass=MethodsTransformingMeta):
             a destination (e.g. an array or a file name)
 
         fmt : str
-            a destination format, one of None, 'blosc', 'csv', 'hdf5', 'feather'
+            a destination format, one of None, 'blosc', 'store', 'csv', 'hdf5', 'feather', 'parquet'.
+            With 'store' items are appended to a chunked columnar store (see :class:`~.store.ColumnStore`)
+            and `compression`, `chunk_size` and `clevel` can be passed for new components.
+            Within a pipeline run rows of all batches are appended to one 'feather', 'parquet', 'hdf5'
+            or 'csv' file (see :class:`~.table.TableWriter`).
 
         components : None or str or tuple of str
             components to load
@@ -919,7 +1101,9 @@ class Batch(metaclass=MethodsTransformingMeta):
             dst[self.indices] = self.get(component=components)
         elif fmt == 'blosc':
             self._dump_blosc(dst, components=components)
-        elif fmt in ['csv', 'hdf5', 'feather']:
+        elif fmt == 'store':
+            self._dump_store(dst, components=components, **kwargs)
+        elif fmt in ['csv', 'hdf5', 'feather', 'parquet']:
             self._dump_table(dst, fmt, components, *args, **kwargs)
         else:
             raise ValueError("Unknown format " + fmt)
@@ -930,7 +1114,7 @@ class Batch(metaclass=MethodsTransformingMeta):
         """ Save batch data to a file (an alias for dump method)"""
         return self.dump(*args, **kwargs)
 
-    @apply_parallel_
+    @apply_parallel_(vectorized='_to_array_all')
     def to_array(self, comp, dtype=np.float32, channels='last'):
         """ Converts batch components to np.ndarray format
 
@@ -963,3 +1147,21 @@ class Batch(metaclass=MethodsTransformingMeta):
             comp = comp.astype(dtype)
 
         return comp
+
+    def _to_array_all(self, data, dtype=np.float32, channels='last'):
+        """ Convert the whole component array at once (a vectorized version of :meth:`~.Batch.to_array`).
+
+        An array which already has a proper dtype and channels layout is returned as is, without copying.
+        """
+        _ = self
+        if data.ndim == 3:
+            # 2d items get a new dimension for channels
+            if channels == 'first':
+                data = data[:, np.newaxis]
+            elif channels == 'last':
+                data = data[..., np.newaxis]
+        elif channels == 'first' and data.ndim > 3:
+            data = np.ascontiguousarray(np.moveaxis(data, -1, 1))
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
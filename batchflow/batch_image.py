@@ -1,10 +1,11 @@
 """ Contains Batch classes for images """
 import os
+import inspect
 import warnings
+import threading
 from numbers import Number
 
 import numpy as np
-from skimage.transform import resize
 import scipy.ndimage
 
 import PIL
@@ -14,8 +15,12 @@ import PIL.ImageFilter
 import PIL.ImageEnhance
 
 from .batch import Batch
-from .decorators import action, apply_parallel, inbatch_parallel
+from .named_expr import P, R
+from .decorators import action, inbatch_parallel, apply_parallel as apply_parallel_
 from .dsindex import FilesIndex
+from .image_cache import decode_image
+from .image_warp import translation, scaling, flipping, rotation, image_size, warp_image
+from .image_patches import extract_patches, assemble_patches
 
 
 def get_scipy_transforms():
@@ -49,6 +54,12 @@ def get_scipy_transforms():
     return scipy_transformations
 
 
+def _skimage_resize(image, *args, **kwargs):
+    """ Resize an image with ``skimage.transform.resize``, which is imported on the first call """
+    from skimage.transform import resize  # pylint: disable=import-outside-toplevel
+    return resize(image, *args, **kwargs)
+
+
 def add_methods(transformations=None, prefix='_', suffix='_'):
     """ Bounds given functions to a decorated class
 
@@ -113,7 +124,7 @@ class BaseImagesBatch(Batch):
             path = os.path.join(src, str(ix))
         return path
 
-    def _load_image(self, ix, src=None, fmt=None, dst="images"):
+    def _load_image(self, ix, src=None, fmt=None, dst="images", cache=None):
         """ Loads image.
 
         .. note:: Please note that ``dst`` must be ``str`` only, sequence is not allowed here.
@@ -126,13 +137,15 @@ class BaseImagesBatch(Batch):
             Component to write images to.
         fmt : str
             Format of the an image
+        cache : ImageCache, None
+            A cache of decoded images.
 
         Raises
         ------
         NotImplementedError
             If this method is not defined in a child class
         """
-        _ = self, ix, src, dst, fmt
+        _ = self, ix, src, dst, fmt, cache
         raise NotImplementedError("Must be implemented in a child class")
 
     @action
@@ -150,9 +163,12 @@ class BaseImagesBatch(Batch):
             Format of the file to download.
         dst : str, sequence
             components to download.
+        cache : ImageCache, None
+            A cache of decoded images for `fmt='image'` (see :class:`~.image_cache.ImageCache`).
+            Pass the same cache on each epoch to decode every image only once.
         """
         if fmt == 'image':
-            return self._load_image(src, fmt=fmt, dst=dst)
+            return self._load_image(src, fmt=fmt, dst=dst, cache=kwargs.get('cache'))
         return super().load(src=src, fmt=fmt, dst=dst, *args, **kwargs)
 
 
@@ -206,11 +222,32 @@ class BaseImagesBatch(Batch):
 
 @add_methods(transformations={**get_scipy_transforms(),
                               'pad': np.pad,
-                              'resize': resize}, prefix='_sp_', suffix='_')
+                              'resize': _skimage_resize}, prefix='_sp_', suffix='_')
 class ImagesBatch(BaseImagesBatch):
     """ Batch class for 2D images.
 
-    Images are stored as numpy arrays of PIL.Image.
+    Images are stored according to the `storage` class attribute:
+
+    - 'pil' - as numpy arrays of PIL.Image (default),
+    - 'array' - as one contiguous array of shape `(N, H, W, C)` (e.g. of `np.uint8` or `np.float32` dtype),
+      so that elementwise transforms process all images at once and others get views of this array.
+      Images are converted to PIL.Image only for transforms which are based on PIL and only for the time
+      of the transform. Images of different shapes are kept in an object array of `(H, W, C)` arrays,
+      until they get the same shape again. :meth:`~.Batch.to_array` does not copy images of a proper dtype.
+
+    To store images as arrays, override the class attribute::
+
+        class MyBatch(ImagesBatch):
+            storage = 'array'
+
+    If the class attribute `fuse_geometry` is True, geometric transforms (:meth:`.crop`, :meth:`.scale`,
+    :meth:`.rotate`, :meth:`.flip`, :meth:`.shift` and :meth:`.resize`) do not resample images right away.
+    Instead, their affine maps are composed for each image, and images are resampled once, when a component
+    is accessed (e.g. by a non-geometric action or after the pipeline is executed). Each component
+    (e.g. `images` and `masks` in ``src=['images', 'masks']``) gets its own composed map.
+    The interpolation is the most precise one among those requested by composed transforms.
+    Transforms with parameters which cannot be fused (e.g. ``shift(mode='wrap')`` or `dst` different from `src`)
+    are applied right away.
 
     PIL.Image has the following system of coordinates::
 
@@ -231,6 +268,13 @@ class ImagesBatch(BaseImagesBatch):
     `method` than you need to call `_method_` from inside of `other_method`).
     Same is applicable for all child classes of :class:`batch.Batch`.
     """
+    storage = 'pil'
+    fuse_geometry = False
+    # composed affine maps which are not applied yet: component -> (matrices, sizes, resample, regions)
+    _warps = None
+    # a lock which makes threads wait for components being resampled and names of those components
+    _warps_lock = None
+    _warping = ()
 
     @classmethod
     def _get_image_shape(cls, image):
@@ -241,6 +285,8 @@ class ImagesBatch(BaseImagesBatch):
     @property
     def image_shape(self):
         """: tuple - shape of the image"""
+        if isinstance(self.images, np.ndarray) and self.images.dtype != object:
+            return self.images.shape[1:]
         _, shapes_count = np.unique([image.size for image in self.images], return_counts=True, axis=0)
         if len(shapes_count) == 1:
             if isinstance(self.images[0], PIL.Image.Image):
@@ -249,7 +295,7 @@ class ImagesBatch(BaseImagesBatch):
         raise RuntimeError('Images have different shapes')
 
     @inbatch_parallel(init='indices', post='_assemble')
-    def _load_image(self, ix, src=None, fmt=None, dst="images"):
+    def _load_image(self, ix, src=None, fmt=None, dst="images", cache=None):
         """ Loads image
 
         .. note:: Please note that ``dst`` must be ``str`` only, sequence is not allowed here.
@@ -262,8 +308,16 @@ class ImagesBatch(BaseImagesBatch):
             Component to write images to.
         fmt : str
             Format of an image.
+        cache : ImageCache, None
+            A cache of decoded images.
         """
-        return PIL.Image.open(self._make_path(ix, src))
+        path = self._make_path(ix, src)
+        if self.storage == 'array':
+            image = decode_image(path) if cache is None else cache.get(path, lambda: decode_image(path))
+            return image if image.ndim == 3 else image[..., None]
+        if cache is None:
+            return PIL.Image.open(path)
+        return PIL.Image.fromarray(cache.get(path, lambda: decode_image(path)))
 
     @inbatch_parallel(init='indices')
     def _dump_image(self, ix, src='images', dst=None, fmt=None):
@@ -282,7 +336,7 @@ class ImagesBatch(BaseImagesBatch):
         """
         if dst is None:
             raise RuntimeError('You must specify `dst`')
-        image = self.get(ix, src)
+        image = self._to_pil_(self.get(ix, src))
         ix = str(ix) + '.' + fmt if fmt is not None else str(ix)
         image.save(os.path.join(dst, ix))
 
@@ -297,7 +351,9 @@ class ImagesBatch(BaseImagesBatch):
             component to assemble
         """
         _ = args, kwargs
-        if isinstance(result[0], PIL.Image.Image):
+        if self.storage == 'array':
+            setattr(self, component, self._stack_images(result))
+        elif isinstance(result[0], PIL.Image.Image):
             setattr(self, component, np.asarray(result, dtype=object))
         else:
             try:
@@ -307,7 +363,179 @@ class ImagesBatch(BaseImagesBatch):
                 array_result[:] = result
                 setattr(self, component, array_result)
 
-    @apply_parallel
+    @staticmethod
+    def _stack_images(items):
+        """ Put images into one contiguous array or into an object array if they have different shapes """
+        items = [_pil_to_array(item) if isinstance(item, PIL.Image.Image) else item for item in items]
+        if all(isinstance(item, np.ndarray) for item in items):
+            shape = items[0].shape
+            if all(item.shape == shape for item in items) and items[0].dtype != object:
+                # each image is copied once right into its place
+                images = np.empty((len(items), *shape), dtype=np.result_type(*{item.dtype for item in items}))
+                for i, item in enumerate(items):
+                    images[i] = item
+                return images
+        else:
+            try:
+                return np.stack(items)
+            except ValueError:
+                pass
+        images = np.empty(len(items), dtype=object)
+        images[:] = items
+        return images
+
+    def __getattr__(self, name):
+        if self._warps and name in self._warps:
+            self._apply_warps(name)
+        if self.components is not None and name in self.components:
+            # other components are not resampled until they are requested
+            return getattr(super().data, name, None)
+        return super().__getattr__(name)
+
+    @property
+    def data(self):
+        """: tuple or named components - batch data """
+        if self._warps:
+            self._apply_warps()
+        return super().data
+
+    @action
+    def apply_parallel(self, func, *args, p=None, **kwargs):
+        """ Apply a function to each item in the batch (see :meth:`.Batch.apply_parallel`).
+
+        If `fuse_geometry` is True, geometric transforms are not applied, but composed with previous ones.
+        """
+        geometry = None
+        name = getattr(func, '__name__', '')
+        if self.fuse_geometry and getattr(func, '__self__', None) is self and name.startswith('_'):
+            geometry = getattr(self, name + 'geometry', None)
+
+        src, dst = kwargs.get('src', self.apply_defaults['src']), kwargs.get('dst')
+        if geometry is None or not isinstance(src, str) or dst not in (None, src):
+            return super().apply_parallel(func, *args, p=p, **kwargs)
+
+        params = {key: value for key, value in kwargs.items()
+                  if key not in ('src', 'dst', 'target', 'post', 'vectorized', 'n_workers')}
+        try:
+            inspect.signature(geometry).bind(None, *args, **params)
+        except TypeError:
+            # some parameters cannot be fused
+            return super().apply_parallel(func, *args, p=p, **kwargs)
+
+        if isinstance(p, float):
+            p = P(R('binomial', 1, p))
+        args, params, p, items_params = self._get_items_values(args, params, p, ndim=1)
+        if items_params is None:
+            return super().apply_parallel(func, *args, p=p, **kwargs)
+        self._defer_geometry(src, geometry, args, params, p, items_params)
+        return self
+
+    def _defer_geometry(self, component, geometry, args, kwargs, p, params):
+        """ Compose an affine map of a geometric transform with maps of previous ones """
+        if self._warps and component in self._warps:
+            matrices, sizes, resample, regions = self._warps[component]
+        else:
+            sizes = np.array([image_size(image) for image in self.get(component=component)])
+            matrices = np.tile(np.eye(3), (len(sizes), 1, 1))
+            resample = PIL.Image.NEAREST
+            # intermediate images, which bound what is left of an image after each transform
+            regions = [[] for _ in sizes]
+
+        if isinstance(p, np.ndarray):
+            mask = p.reshape(len(sizes), -1)[:, 0].astype(bool)
+        else:
+            mask = np.full(len(sizes), p is None or p == 1)
+
+        take = lambda value, key, i: value[i] if key in params else value
+        for i in np.flatnonzero(mask):
+            matrix, size, item_resample = geometry(sizes[i], *[take(value, j, i) for j, value in enumerate(args)],
+                                                   **{name: take(value, name, i) for name, value in kwargs.items()})
+            regions[i] = [(region @ matrix, region_size) for region, region_size in regions[i]]
+            regions[i].append((matrix, sizes[i].copy()))
+            matrices[i] = matrices[i] @ matrix
+            sizes[i] = size
+            resample = max(resample, _transform_resample(item_resample))
+
+        if self._warps_lock is None:
+            self._warps_lock = threading.RLock()
+        self._warps = {**(self._warps or {}), component: (matrices, sizes, resample, regions)}
+
+    def _apply_warps(self, component=None):
+        """ Resample images of components with composed affine maps
+
+        Other threads which request a component while it is resampled wait for the result.
+        """
+        with self._warps_lock:
+            components = list(self._warps or {}) if component is None else [component]
+            for comp in components:
+                warp = (self._warps or {}).get(comp)
+                if warp is None or comp in self._warping:
+                    # the resampling itself requests source images of the component
+                    continue
+                self._warping = (*self._warping, comp)
+                try:
+                    matrices, sizes, resample, regions = warp
+                    super().apply_parallel(warp_image, P(matrices), P(sizes), resample=resample, regions=P(regions),
+                                           src=comp, dst=comp)
+                finally:
+                    self._warping = tuple(name for name in self._warping if name != comp)
+                # the map is dropped only when resampled images are in place
+                self._warps = {name: value for name, value in self._warps.items() if name != comp}
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_warps_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        if self._warps:
+            self._warps_lock = threading.RLock()
+
+    def _crop_geometry(self, current_size, origin, shape, crop_boundaries=False):
+        origin = self._calc_origin(shape, origin, current_size)
+        right_bottom = origin + shape
+        if crop_boundaries:
+            origin = np.maximum(origin, 0)
+            right_bottom = np.minimum(right_bottom, current_size)
+        return translation(origin), right_bottom - origin, PIL.Image.NEAREST
+
+    def _scale_geometry(self, current_size, factor, preserve_shape=False, origin='center', resample=0):
+        rescaled_size = np.int32(np.ceil(current_size * np.asarray(factor)))
+        matrix = scaling(current_size / rescaled_size)
+        size = rescaled_size
+        if preserve_shape:
+            if np.any(rescaled_size < current_size):
+                # a rescaled image is put on a background
+                matrix = matrix @ translation(-self._calc_origin(rescaled_size, origin, current_size))
+                size = current_size
+            else:
+                matrix, size, _ = self._crop_geometry(rescaled_size, origin, current_size, crop_boundaries=True)
+                matrix = scaling(current_size / rescaled_size) @ matrix
+        return matrix, size, resample
+
+    def _rotate_geometry(self, current_size, angle, resample=PIL.Image.NEAREST, expand=False, center=None,
+                         translate=None):
+        matrix, size = rotation(current_size, angle, expand=expand, center=center, translate=translate)
+        return matrix, size, resample
+
+    def _flip_geometry(self, current_size, mode='lr'):
+        return flipping(current_size, mode), current_size, PIL.Image.NEAREST
+
+    def _shift_geometry(self, current_size, offset):
+        return translation(-np.asarray(offset)), current_size, PIL.Image.NEAREST
+
+    def _resize_geometry(self, current_size, size, resample=PIL.Image.BICUBIC):
+        if size[0] is None and size[1] is None:
+            raise ValueError('At least one component of the parameter "size" must be a number.')
+        if size[0] is None:
+            size = (int(current_size[0] * size[1] / current_size[1]), size[1])
+        elif size[1] is None:
+            size = (size[0], int(current_size[1] * size[0] / current_size[0]))
+        size = np.asarray(size)
+        return scaling(current_size / size), size, resample
+
+    @apply_parallel_
     def to_pil(self, image, mode=None):
         """converts images in Batch to PIL format
 
@@ -386,8 +614,8 @@ class ImagesBatch(BaseImagesBatch):
             elif origin == 'center':
                 origin = np.maximum(0, np.asarray(background_shape) - image_shape) // 2
             elif origin == 'random':
-                origin = (np.random.randint(background_shape[0]-image_shape[0]+1),
-                          np.random.randint(background_shape[1]-image_shape[1]+1))
+                origin = (self.random.integers(background_shape[0]-image_shape[0]+1),
+                          self.random.integers(background_shape[1]-image_shape[1]+1))
             else:
                 raise ValueError("If string, origin should be one of ['center', 'top_left', 'top_right', "
                                  "'bottom_left', 'bottom_right', 'random']. Got '{}'.".format(origin))
@@ -401,7 +629,7 @@ class ImagesBatch(BaseImagesBatch):
 
         return np.asarray(origin, dtype=np.int)
 
-    @apply_parallel
+    @apply_parallel_
     def scale(self, image, factor, preserve_shape=False, origin='center', resample=0):
         """ Scale the content of each image in the batch.
 
@@ -461,6 +689,7 @@ class ImagesBatch(BaseImagesBatch):
         -------
         self
         """
+        image = self._to_pil_(image)
         original_shape = self._get_image_shape(image)
         rescaled_shape = list(np.int32(np.ceil(np.asarray(original_shape)*factor)))
         rescaled_image = image.resize(rescaled_shape, resample=resample)
@@ -468,7 +697,7 @@ class ImagesBatch(BaseImagesBatch):
             rescaled_image = self._preserve_shape(original_shape, rescaled_image, origin)
         return rescaled_image
 
-    @apply_parallel
+    @apply_parallel_
     def crop(self, image, origin, shape, crop_boundaries=False):
         """ Crop an image.
 
@@ -495,20 +724,23 @@ class ImagesBatch(BaseImagesBatch):
         element, as origin will be sampled independently for each `src` element.
         To randomly sample same origin for a number of components, use `R` named expression for `origin` argument.
         """
-        origin = self._calc_origin(shape, origin, image.size)
+        current_size = image.size if isinstance(image, PIL.Image.Image) else (image.shape[1], image.shape[0])
+        origin = self._calc_origin(shape, origin, current_size)
         right_bottom = origin + shape
 
         if crop_boundaries:
             out_of_boundaries = origin < 0
             origin[out_of_boundaries] = 0
 
-            image_shape = np.asarray(image.size)
+            image_shape = np.asarray(current_size)
             out_of_boundaries = right_bottom > image_shape
             right_bottom[out_of_boundaries] = image_shape[out_of_boundaries]
 
+        if isinstance(image, np.ndarray):
+            return _crop_array(image, origin, right_bottom)
         return image.crop((*origin, *right_bottom))
 
-    @apply_parallel
+    @apply_parallel_
     def put_on_background(self, image, background, origin, mask=None):
         """ Put an image on a background at given origin
 
@@ -527,6 +759,7 @@ class ImagesBatch(BaseImagesBatch):
         element, as origin will be sampled independently for each `src` element.
         To randomly sample same origin for a number of components, use `R` named expression for `origin` argument.
         """
+        image = self._to_pil_(image)
         if not isinstance(background, PIL.Image.Image):
             background = PIL.Image.fromarray(background)
         else:
@@ -585,7 +818,7 @@ class ImagesBatch(BaseImagesBatch):
             return self._put_on_background_(transformed_image, background, origin)
         return self._crop_(transformed_image, origin, original_shape, True)
 
-    @apply_parallel
+    @apply_parallel_
     def filter(self, image, mode, *args, **kwargs):
         """ Filters an image. Calls ``image.filter(getattr(PIL.ImageFilter, mode)(*args, **kwargs))``.
 
@@ -602,9 +835,10 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
+        image = self._to_pil_(image)
         return image.filter(getattr(PIL.ImageFilter, mode)(*args, **kwargs))
 
-    @apply_parallel
+    @apply_parallel_
     def transform(self, image, *args, **kwargs):
         """ Calls ``image.transform(*args, **kwargs)``.
 
@@ -620,10 +854,11 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
+        image = self._to_pil_(image)
         size = kwargs.pop('size', self._get_image_shape(image))
         return image.transform(*args, size=size, **kwargs)
 
-    @apply_parallel
+    @apply_parallel_
     def resize(self, image, size, *args, **kwargs):
         """ Calls ``image.resize(*args, **kwargs)``.
 
@@ -641,6 +876,7 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
+        image = self._to_pil_(image)
         if size[0] is None and size[1] is None:
             raise ValueError('At least one component of the parameter "size" must be a number.')
         if size[0] is None:
@@ -652,7 +888,7 @@ class ImagesBatch(BaseImagesBatch):
 
         return image.resize(new_size, *args, **kwargs)
 
-    @apply_parallel
+    @apply_parallel_
     def shift(self, image, offset, mode='const'):
         """ Shifts an image.
 
@@ -668,6 +904,7 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
+        image = self._to_pil_(image)
         if mode == 'const':
             image = image.transform(size=image.size,
                                     method=PIL.Image.AFFINE,
@@ -678,7 +915,7 @@ class ImagesBatch(BaseImagesBatch):
             raise ValueError("mode must be one of ['const', 'wrap']")
         return image
 
-    @apply_parallel
+    @apply_parallel_
     def pad(self, image, *args, **kwargs):
         """ Calls ``PIL.ImageOps.expand``.
 
@@ -697,9 +934,10 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
+        image = self._to_pil_(image)
         return PIL.ImageOps.expand(image, *args, **kwargs)
 
-    @apply_parallel
+    @apply_parallel_
     def rotate(self, image, *args, **kwargs):
         """ Rotates an image.
 
@@ -722,9 +960,10 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
+        image = self._to_pil_(image)
         return image.rotate(*args, **kwargs)
 
-    @apply_parallel
+    @apply_parallel_(vectorized='_flip_all')
     def flip(self, image, mode='lr'):
         """ Flips image.
 
@@ -741,11 +980,23 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
+        if isinstance(image, np.ndarray):
+            return np.flip(image, 1 if mode == 'lr' else 0)
         if mode == 'lr':
             return PIL.ImageOps.mirror(image)
         return PIL.ImageOps.flip(image)
 
-    @apply_parallel
+    def _flip_all(self, images, mode='lr'):
+        """ Flip all images at once (a vectorized version of :meth:`~.ImagesBatch.flip`) """
+        _ = self
+        mode = np.broadcast_to(mode, len(images))
+        left_right = mode == 'lr'
+        result = np.empty_like(images)
+        result[left_right] = images[left_right, :, ::-1]
+        result[~left_right] = images[~left_right, ::-1]
+        return result
+
+    @apply_parallel_(vectorized=True)
     def invert(self, image, channels='all'):
         """ Invert givn channels.
 
@@ -760,7 +1011,13 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
-        if channels == 'all':
+        if isinstance(image, np.ndarray):
+            max_value = 255 if image.dtype == np.uint8 else 1.
+            if channels == 'all':
+                return max_value - image
+            image = image.copy()
+            image[..., channels] = max_value - image[..., channels]
+        elif channels == 'all':
             image = PIL.ImageChops.invert(image)
         else:
             bands = list(image.split())
@@ -770,7 +1027,7 @@ class ImagesBatch(BaseImagesBatch):
             image = PIL.Image.merge('RGB', bands)
         return image
 
-    @apply_parallel
+    @apply_parallel_
     def salt(self, image, p_noise=.015, color=255, size=(1, 1)):
         """ Set random pixel on image to givan value.
 
@@ -798,8 +1055,9 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
+        is_array = isinstance(image, np.ndarray)
         mask_size = np.asarray(self._get_image_shape(image))
-        mask_salt = np.random.binomial(1, p_noise, size=mask_size).astype(bool)
+        mask_salt = self.random.binomial(1, p_noise, size=mask_size).astype(bool)
         image = np.array(image)
         if isinstance(size, (tuple, int)) and size in [1, (1, 1)] and not callable(color):
             image[mask_salt] = color
@@ -814,9 +1072,9 @@ class ImagesBatch(BaseImagesBatch):
                 right_bottom = np.minimum(left_top + current_size, self._get_image_shape(image))
                 image[left_top[0]:right_bottom[0], left_top[1]:right_bottom[1]] = color_lambda()
 
-        return PIL.Image.fromarray(image)
+        return image if is_array else PIL.Image.fromarray(image)
 
-    @apply_parallel
+    @apply_parallel_(vectorized=True)
     def clip(self, image, low=0, high=255):
         """ Truncate image's pixels.
 
@@ -835,6 +1093,8 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
+        if isinstance(image, np.ndarray):
+            return np.clip(image, low, high)
         if isinstance(low, Number):
             low = tuple([low]*3)
         if isinstance(high, Number):
@@ -844,7 +1104,7 @@ class ImagesBatch(BaseImagesBatch):
         low = PIL.Image.new('RGB', image.size, low)
         return PIL.ImageChops.lighter(PIL.ImageChops.darker(image, high), low)
 
-    @apply_parallel
+    @apply_parallel_
     def enhance(self, image, layout='hcbs', factor=(1, 1, 1, 1)):
         """ Apply enhancements from PIL.ImageEnhance to the image.
 
@@ -860,6 +1120,7 @@ class ImagesBatch(BaseImagesBatch):
         factor : float or tuple of float
             factor of enhancement for each operation listed in `layout`.
         """
+        image = self._to_pil_(image)
         enhancements = {
             'h': 'Color',
             'c': 'Contrast',
@@ -880,7 +1141,7 @@ class ImagesBatch(BaseImagesBatch):
 
         return image
 
-    @apply_parallel
+    @apply_parallel_(vectorized=True)
     def multiply(self, image, multiplier=1., clip=False, preserve_type=False):
         """ Multiply each pixel by the given multiplier.
 
@@ -913,7 +1174,7 @@ class ImagesBatch(BaseImagesBatch):
             image = multiplier * image
         return image.astype(dtype)
 
-    @apply_parallel
+    @apply_parallel_(vectorized=True)
     def add(self, image, term=1., clip=False, preserve_type=False):
         """ Add term to each pixel.
 
@@ -942,7 +1203,7 @@ class ImagesBatch(BaseImagesBatch):
             image = term + image
         return image.astype(dtype)
 
-    @apply_parallel
+    @apply_parallel_
     def pil_convert(self, image, mode="L"):
         """ Convert image. Actually calls ``image.convert(mode)``.
 
@@ -957,9 +1218,10 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
+        image = self._to_pil_(image)
         return image.convert(mode)
 
-    @apply_parallel
+    @apply_parallel_
     def posterize(self, image, bits=4):
         """ Posterizes image.
 
@@ -976,9 +1238,10 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
+        image = self._to_pil_(image)
         return PIL.ImageOps.posterize(image, bits)
 
-    @apply_parallel
+    @apply_parallel_
     def cutout(self, image, origin, shape, color):
         """ Fills given areas with color
 
@@ -1011,6 +1274,7 @@ class ImagesBatch(BaseImagesBatch):
         element, as origin will be sampled independently for each `src` element.
         To randomly sample same origin for a number of components, use `R` named expression for `origin` argument.
         """
+        image = self._to_pil_(image)
         image = image.copy()
         shape = (shape, shape) if isinstance(shape, Number) else shape
         origin = self._calc_origin(shape, origin, self._get_image_shape(image))
@@ -1018,32 +1282,22 @@ class ImagesBatch(BaseImagesBatch):
         image.paste(PIL.Image.new('RGB', tuple(shape), tuple(color)), tuple(origin))
         return image
 
-    def _assemble_patches(self, patches, *args, dst, **kwargs):
-        """ Assembles patches after parallel execution.
-
-        Parameters
-        ----------
-        patches : sequence
-            Patches to gather. pathces.shape must be like (batch.size, patches_i, patch_height, patch_width, n_channels)
-        dst : str
-            Component to put patches in.
-        """
-        _ = args, kwargs
-        new_items = np.concatenate(patches)
-        setattr(self, dst, new_items)
-
     @action
-    @inbatch_parallel(init='indices', post='_assemble_patches')
-    def split_to_patches(self, ix, patch_shape, stride=1, drop_last=False, src='images', dst=None):
-        """ Splits image to patches.
+    def split_to_patches(self, patch_shape, stride=1, drop_last=False, src='images', dst=None):
+        """ Splits images to patches.
 
         Small images with the same shape (``patch_shape``) are cropped from the original one with stride ``stride``.
+        Patches of all images are put into ``dst`` one image after another, row by row.
+
+        Images of the same shape are split all at once: patches are taken as views of a sliding window
+        and copied once into a contiguous array of shape `(n_patches, rows, columns, ...)`.
+        If images are stored as PIL images, patches are PIL images as well.
 
         Parameters
         ----------
         patch_shape : int, sequence
-            Patch's shape in the from (rows, columns). If int is given then patches have square shape.
-        stride : int, square
+            Patch's shape in the form (rows, columns). If int is given then patches have square shape.
+        stride : int, sequence
             Step of the moving window from which patches are cropped. If int is given then the window has square shape.
         drop_last : bool
             Whether to drop patches whose window covers area out of the image.
@@ -1051,37 +1305,66 @@ class ImagesBatch(BaseImagesBatch):
         src : str
             Component to get images from. Default is 'images'.
         dst : str
-            Component to write images to. Default is 'images'.
-        p : float
-            Probability of applying the transform. Default is 1.
+            Component to write images to. Default is `src`.
         """
-        _ = dst
-        image = self.get(ix, src)
-        image_shape = self._get_image_shape(image)
-        image = np.array(image)
         stride = (stride, stride) if isinstance(stride, Number) else stride
         patch_shape = (patch_shape, patch_shape) if isinstance(patch_shape, Number) else patch_shape
-        patches = []
-
-        def _iterate_columns(row_from, row_to):
-            column = 0
-            while column < image_shape[1]-patch_shape[1]+1:
-                patches.append(PIL.Image.fromarray(image[row_from:row_to, column:column+patch_shape[1]]))
-                column += stride[1]
-            if not drop_last and column + patch_shape[1] != image_shape[1]:
-                patches.append(PIL.Image.fromarray(image[row_from:row_to,
-                                                         image_shape[1]-patch_shape[1]:image_shape[1]]))
-
-        row = 0
-        while row < image_shape[0]-patch_shape[0]+1:
-            _iterate_columns(row, row+patch_shape[0])
-            row += stride[0]
-        if not drop_last and row + patch_shape[0] != image_shape[0]:
-            _iterate_columns(image_shape[0]-patch_shape[0], image_shape[0])
-
-        return np.array(patches, dtype=object)
-
-    @apply_parallel
+        images = self.get(component=src)
+
+        if isinstance(images, np.ndarray) and images.dtype != object:
+            patches = extract_patches(images, patch_shape, stride, drop_last)
+        else:
+            # images of different shapes are split one by one
+            patches = np.concatenate([extract_patches(np.asarray(image)[np.newaxis], patch_shape, stride, drop_last)
+                                      for image in images])
+            if all(isinstance(image, PIL.Image.Image) for image in images):
+                pil_patches = np.empty(len(patches), dtype=object)
+                pil_patches[:] = [PIL.Image.fromarray(patch) for patch in patches]
+                patches = pil_patches
+        setattr(self, dst or src, patches)
+        return self
+
+    @action
+    def assemble_from_patches(self, image_shape, stride=1, drop_last=False, src='images', dst=None):
+        """ Assembles images from patches averaging overlapping pixels.
+
+        This is an inverse of :meth:`.split_to_patches`, which is convenient for sliding window inference:
+        split images to patches, make predictions for patches and assemble predictions for whole images.
+        Values of overlapping pixels are accumulated for all patches at once.
+
+        Parameters
+        ----------
+        image_shape : sequence
+            Shape of images in the form (rows, columns).
+        stride : int, sequence
+            Step of the moving window which patches were cropped with.
+        drop_last : bool
+            Whether patches whose window covers area out of the image were dropped.
+            If so, pixels which are not covered by any patch are zero.
+        src : str
+            Component to get patches from, one image after another (as :meth:`.split_to_patches` puts them).
+            Default is 'images'.
+        dst : str
+            Component to write images to. Default is `src`.
+
+        Examples
+        --------
+        ::
+
+            (pipeline
+             .split_to_patches(patch_shape=256, stride=128, src='images', dst='patches')
+             .predict_model('model', B('patches'), fetches='predictions', save_to=B('patches'))
+             .assemble_from_patches(image_shape=(1024, 1024), stride=128, src='patches', dst='predictions'))
+        """
+        stride = (stride, stride) if isinstance(stride, Number) else stride
+        patches = self.get(component=src)
+        if patches.dtype == object:
+            patches = np.stack([np.asarray(patch) for patch in patches])
+        images = assemble_patches(patches, image_shape, stride, drop_last)
+        setattr(self, dst or src, images)
+        return self
+
+    @apply_parallel_(vectorized=True)
     def additive_noise(self, image, noise, clip=False, preserve_type=False):
         """ Add additive noise to an image.
 
@@ -1104,7 +1387,7 @@ class ImagesBatch(BaseImagesBatch):
         noise = noise(size=(*image.size, len(image.getbands())) if isinstance(image, PIL.Image.Image) else image.shape)
         return self._add_(image, noise, clip, preserve_type)
 
-    @apply_parallel
+    @apply_parallel_(vectorized=True)
     def multiplicative_noise(self, image, noise, clip=False, preserve_type=False):
         """ Add multiplicative noise to an image.
 
@@ -1127,7 +1410,7 @@ class ImagesBatch(BaseImagesBatch):
         noise = noise(size=(*image.size, len(image.getbands())) if isinstance(image, PIL.Image.Image) else image.shape)
         return self._multiply_(image, noise, clip, preserve_type)
 
-    @apply_parallel
+    @apply_parallel_
     def elastic_transform(self, image, alpha, sigma, **kwargs):
         """ Deformation of images as described by Simard, Steinkraus and Platt, `Best Practices for Convolutional
         Neural Networks applied to Visual Document Analysis <http://cognitivemedium.com/assets/rmnist/Simard.pdf>_`.
@@ -1147,7 +1430,8 @@ class ImagesBatch(BaseImagesBatch):
         p : float
             Probability of applying the transform. Default is 1.
         """
-        image = np.array(image)
+        is_array = isinstance(image, np.ndarray)
+        image = np.asarray(image)
         # full shape is needed
         shape = image.shape
         if len(shape) == 2:
@@ -1157,8 +1441,9 @@ class ImagesBatch(BaseImagesBatch):
         kwargs.setdefault('mode', 'constant')
         kwargs.setdefault('cval', 0)
 
-        column_shift = self._sp_gaussian_filter_(np.random.uniform(-1, 1, size=shape), sigma, **kwargs) * alpha
-        row_shift = self._sp_gaussian_filter_(np.random.uniform(-1, 1, size=shape), sigma, **kwargs) * alpha
+        rng = self.random
+        column_shift = self._sp_gaussian_filter_(rng.uniform(-1, 1, size=shape), sigma, **kwargs) * alpha
+        row_shift = self._sp_gaussian_filter_(rng.uniform(-1, 1, size=shape), sigma, **kwargs) * alpha
 
         row, column, channel = np.meshgrid(range(shape[0]), range(shape[1]), range(shape[2]))
 
@@ -1166,6 +1451,37 @@ class ImagesBatch(BaseImagesBatch):
 
         distored_image = self._sp_map_coordinates_(image, indices, order=1, mode='reflect')
 
+        if is_array:
+            return distored_image.reshape(image.shape)
         if shape[-1] == 1:
             return PIL.Image.fromarray(np.uint8(distored_image.reshape(image.shape))[..., 0])
         return PIL.Image.fromarray(np.uint8(distored_image.reshape(image.shape)))
+
+
+def _transform_resample(resample):
+    """ Return a resampling filter of `PIL.Image.transform` which is the closest to a given one """
+    if resample is None:
+        return PIL.Image.BICUBIC
+    return resample if resample in (PIL.Image.NEAREST, PIL.Image.BILINEAR, PIL.Image.BICUBIC) else PIL.Image.BICUBIC
+
+
+def _pil_to_array(image):
+    """ Return an array of shape `(H, W, C)` with pixels of a PIL image """
+    image = np.asarray(image)
+    return image if image.ndim == 3 else image[..., None]
+
+
+def _crop_array(image, origin, right_bottom):
+    """ Crop an array as `PIL.Image.crop` does: a view if the box is inside the image, or a zero-padded copy """
+    (left, top), (right, bottom) = origin, right_bottom
+    height, width = image.shape[:2]
+    if left >= 0 and top >= 0 and right <= width and bottom <= height:
+        return image[top:bottom, left:right]
+
+    result = np.zeros((bottom - top, right - left, *image.shape[2:]), dtype=image.dtype)
+    inner_top, inner_left = max(top, 0), max(left, 0)
+    inner_bottom, inner_right = min(bottom, height), min(right, width)
+    if inner_bottom > inner_top and inner_right > inner_left:
+        result[inner_top-top:inner_bottom-top, inner_left-left:inner_right-left] = \
+            image[inner_top:inner_bottom, inner_left:inner_right]
+    return result
@@ -1,11 +1,13 @@
 """ Contains classes to handle batch data components """
 import copy as cp
+import functools
 import numpy as np
 try:
     import pandas as pd
 except ImportError:
     import _fake as pd
 
+from .dsindex import ItemPositions
 from .utils import is_iterable
 
 
@@ -26,10 +28,19 @@ class AdvancedDict(dict):
         return np.stack([self[i] for i in indices])
 
 class BaseComponents:
-    """ Base class for a components storage """
-    def __init__(self, components=None, data=None, indices=None, crop=False, copy=False, cast_to_array=True):
+    """ Base class for a components storage
+
+    Parameters
+    ----------
+    pos : ItemPositions or None
+        positions of items in `indices` (e.g. the one of the batch index).
+        If not given, it is created on the first position lookup.
+    """
+    def __init__(self, components=None, data=None, indices=None, crop=False, copy=False, cast_to_array=True,
+                 pos=None):
         self.components = components
         self._indices = indices
+        self._pos = pos
         self.data = data
         self.cast_to_array = cast_to_array
         self._crop = crop
@@ -98,28 +109,54 @@ class BaseComponents:
     def __getitem__(self, item):
         if isinstance(item, slice):
             item = list(range(item.start, item.stop, item.step))
-        if self._indices is not None and item not in self._indices:
+        if self._indices is not None and not self._contains(item):
             raise KeyError(item)
         return type(self)(self.components, self, item, crop=False)
 
+    def _contains(self, item):
+        if is_iterable(item):
+            return item in self._indices
+        try:
+            self.find_in_index(item)
+        except KeyError:
+            return False
+        return True
+
     def find_in_index(self, item):
-        """ Return a posiition of an item in the index """
-        if isinstance(self._indices, list):
-            return self._indices.index(item)
-        if isinstance(self._indices, np.ndarray):
-            return np.where(self._indices == item)[0][0]
-        raise TypeError("Unknown index type: %s" % type(self._indices))
+        """ Return a position of an item in the index
+
+        Parameters
+        ----------
+        item : hashable or array-like
+            an item or a sequence of items
+
+        Returns
+        -------
+        int or np.ndarray of int
+
+        Raises
+        ------
+        KeyError
+            if some items are not in the index
+        """
+        if not isinstance(self._indices, (list, np.ndarray)):
+            raise TypeError("Unknown index type: %s" % type(self._indices))
+        if self._pos is None:
+            self._pos = ItemPositions(self._indices)
+        if is_iterable(item):
+            return self._pos.get(item)
+        return self._pos[item]
 
     def get_pos(self, component, indices):
-        """ Return positions of given indices """
+        """ Return positions of given indices
+
+        For a sequence of indices all positions are found at once (see :class:`~.dsindex.ItemPositions`).
+        """
         items = indices
         if self._indices is not None:
             # a cropped numpy array needs a position as an index
             if isinstance(self.data[component], np.ndarray):
-                if is_iterable(indices):
-                    items = [self.find_in_index(i) for i in indices]
-                else:
-                    items = self.find_in_index(indices)
+                items = self.find_in_index(indices)
         return items
 
     def _get(self, component, indices=None, cropped=True):
@@ -209,7 +246,7 @@ def get_from_source(components, source, indices=None, crop=False, copy=False, ca
     return data
 
 
-def create_item_class(components, source=None, indices=None, crop=None, copy=False, cast_to_array=True):
+def create_item_class(components, source=None, indices=None, crop=None, copy=False, cast_to_array=True, pos=None):
     """ Create components class """
     if components is None:
         # source is a memory-like object (numpy array, pandas dataframe, hdf5 storage, etc)
@@ -219,7 +256,7 @@ def create_item_class(components, source=None, indices=None, crop=None, copy=Fal
         # so it can be a tuple, dict, pd.DataFrame, etc
         if isinstance(source, (list, tuple)):
             source = dict(zip(components, source))
-        item_class = BaseComponents
+        item_class = functools.partial(BaseComponents, pos=pos)
 
     item = item_class(components, source, indices=indices, crop=crop, copy=copy, cast_to_array=cast_to_array)
 
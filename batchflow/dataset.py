@@ -205,8 +205,7 @@ class Dataset(Baseset):
                 If the index lies out of the source dataset index's range, the IndexError is raised.
 
         """
-        indices = index.indices if isinstance(index, DatasetIndex) else index
-        if not np.isin(indices, self.indices).all():
+        if not self.index.isin(index).all():
             raise IndexError
         return type(self).from_dataset(self, self.index.create_subset(index))
 
@@ -303,7 +302,7 @@ class Dataset(Baseset):
         n_splits : int
             a number of folds
 
-        shuffle : bool, int, class:`numpy.random.RandomState` or callable
+        shuffle : bool, int, class:`numpy.random.RandomState`, class:`numpy.random.Generator` or callable
             specifies the order of items, could be:
 
             - bool - if `False`, items go sequentionally, one after another as they appear in the index.
@@ -311,7 +310,7 @@ class Dataset(Baseset):
 
             - int - a seed number for a random shuffle.
 
-            - :class:`numpy.random.RandomState` instance.
+            - :class:`numpy.random.RandomState` or :class:`numpy.random.Generator` instance.
 
             - callable - a function which takes an array of item indices in the initial order
                 (as they appear in the index) and returns the order of items.
@@ -3,16 +3,15 @@ import os
 import traceback
 import threading
 import concurrent.futures as cf
+from contextlib import contextmanager
+import atexit
 import asyncio
 import functools
 import logging
 import inspect
-try:
-    from numba import jit
-except ImportError:
-    jit = None
 
 from .named_expr import P
+from .jit import jit_cache_enabled, track_compile_time
 
 
 def _workers_count():
@@ -24,6 +23,142 @@ def _workers_count():
     return cpu_count * 4
 
 
+class WorkerPools:
+    """ A per-process registry of executors shared by all parallel actions
+
+    Executors are created lazily on the first request and are kept alive until :meth:`.shutdown`
+    is called (e.g. by ``pipeline.reset('iter')``) or the interpreter exits.
+
+    Attributes
+    ----------
+    hits : int
+        the number of requests served with an already existing executor
+    misses : int
+        the number of requests which led to a new executor creation
+
+    Examples
+    --------
+    ::
+
+        with worker_pools.use('threads', 8) as executor:
+            futures = [executor.submit(func, item) for item in items]
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._pools = {}
+        self._users = {}
+        self._retired = []
+        self.hits = 0
+        self.misses = 0
+
+    def _mark_worker(self):
+        self._local.in_pool = True
+
+    def _in_worker(self):
+        return getattr(self._local, 'in_pool', False)
+
+    def _create(self, target, n_workers):
+        if target == 'threads':
+            return cf.ThreadPoolExecutor(max_workers=n_workers, initializer=self._mark_worker)
+        if target == 'mpc':
+            return cf.ProcessPoolExecutor(max_workers=n_workers)
+        raise ValueError("target should be one of ['threads', 'mpc']")
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            # executors inherited from a parent process cannot be used in a forked child
+            self._pools, self._users, self._retired = {}, {}, []
+            self._pid = os.getpid()
+
+    def get(self, target, n_workers):
+        """ Return an executor for a given target and a number of workers (create it if needed) """
+        with self._lock:
+            self._check_process()
+            key = target, n_workers
+            pool = self._pools.get(key)
+            if pool is not None and getattr(pool, '_broken', False):
+                self._retire(pool)
+                pool = None
+            if pool is None:
+                pool = self._create(target, n_workers)
+                self._pools[key] = pool
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._users[id(pool)] = self._users.get(id(pool), 0) + 1
+        return pool
+
+    def release(self, pool):
+        """ Mark that a caller does not use the executor anymore """
+        with self._lock:
+            self._users[id(pool)] = self._users.get(id(pool), 1) - 1
+            if self._users[id(pool)] <= 0 and pool in self._retired:
+                self._retired.remove(pool)
+                self._users.pop(id(pool))
+                pool.shutdown(wait=False)
+
+    @contextmanager
+    def use(self, target, n_workers):
+        """ A context manager which provides an executor for a given target and a number of workers
+
+        Notes
+        -----
+        If it is called from a thread which already belongs to a shared thread pool (i.e. a nested parallel call),
+        then a temporary executor is created in order to avoid a deadlock when all workers wait for each other.
+        """
+        if target == 'threads' and self._in_worker():
+            # its workers are marked too, so deeper nested calls get their own executors as well
+            with cf.ThreadPoolExecutor(max_workers=n_workers, initializer=self._mark_worker) as executor:
+                yield executor
+            return
+
+        pool = self.get(target, n_workers)
+        try:
+            yield pool
+        finally:
+            self.release(pool)
+
+    def _retire(self, pool):
+        if self._users.get(id(pool), 0) > 0:
+            # the executor is still in use, so it will be shut down on release
+            self._retired.append(pool)
+        else:
+            self._users.pop(id(pool), None)
+            pool.shutdown(wait=False)
+
+    def shutdown(self):
+        """ Shut down all executors """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._check_process()
+                return
+            pools = list(self._pools.values())
+            self._pools = {}
+            for pool in pools:
+                self._retire(pool)
+
+    @property
+    def stats(self):
+        """ dict : the number of cache hits and misses and the number of live executors """
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, pools=len(self._pools))
+
+    def reset_stats(self):
+        """ Reset hits and misses counters """
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._pools)
+
+
+worker_pools = WorkerPools()
+atexit.register(worker_pools.shutdown)
+
+
 def _make_action_wrapper_with_args(use_lock=None):    # pylint: disable=redefined-outer-name
     return functools.partial(_make_action_wrapper, _use_lock=use_lock)
 
@@ -107,6 +242,9 @@ def apply_parallel(*args, **kwargs):
         Note, that if no defaults redefined those from the nearest
         parent class will be used in :class:`batch.MethodsTransformingMeta`.
 
+        Elementwise methods might be marked with `@apply_parallel(vectorized=True)`,
+        so that they are called once for the whole component array if it is homogeneous
+        (see :meth:`~.Batch.apply_parallel` for details).
         """
     def mark(method):
         method.apply_kwargs = kwargs
@@ -255,7 +393,7 @@ def inbatch_parallel(init, post=None, target='threads', _use_self=None, **dec_kw
             init_fn, post_fn = _check_functions(self)
 
             n_workers = kwargs.pop('n_workers', _workers_count())
-            with cf.ThreadPoolExecutor(max_workers=n_workers) as executor:
+            with worker_pools.use('threads', n_workers) as executor:
                 futures = []
                 args, kwargs, params = _prepare_args(self, args, kwargs)
                 full_kwargs = {**dec_kwargs, **kwargs}
@@ -274,7 +412,7 @@ def inbatch_parallel(init, post=None, target='threads', _use_self=None, **dec_kw
             init_fn, post_fn = _check_functions(self)
 
             n_workers = kwargs.pop('n_workers', _workers_count())
-            with cf.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            with worker_pools.use('mpc', n_workers) as executor:
                 futures = []
                 mpc_func = method(self, *args, **kwargs)
                 args, kwargs, params = _prepare_args(self, args, kwargs)
@@ -400,25 +538,53 @@ def njit(nogil=True):
 
 
 def mjit(*args, nopython=True, nogil=True, **kwargs):
-    """ jit decorator for methods """
-    def _jit(method):
-        source = inspect.getsource(method).split('\n')
-        indent = len(source[0]) - len(source[0].lstrip())
-        source = [s[indent:] for s in source if len(s) > indent and s[indent] != '@']
-        source = '\n'.join(source)
-        globs = method.__globals__.copy()
-        exec(source, globs)  # pylint: disable=exec-used
-        if jit is not None:
-            func = jit(*args, nopython=nopython, nogil=nogil, **kwargs)(globs[method.__name__])
-        else:
-            func = method
+    """ jit decorator for methods
+
+    numba is imported and a method is compiled on the first call, so that modules with jitted methods
+    can be imported fast. Compiled methods are cached on disk unless `cache=False` is passed
+    (see :func:`~.jit.set_jit_cache`), and they can be compiled ahead of time with :func:`~.jit.warm_up`.
+    """
+    def _compile(method):
+        try:
+            from numba import jit  # pylint: disable=import-outside-toplevel
+        except ImportError:
             logging.warning('numba is not installed. This causes a severe performance degradation for method %s',
                             method.__name__)
+            return method
+
+        source, first_line = inspect.getsourcelines(method)
+        indent = len(source[0]) - len(source[0].lstrip())
+        # decorators are blanked out rather than removed, and the source is compiled with the name of its file
+        # and the same line numbers, so that numba can locate the source and cache the compiled method
+        source = [s[indent:] if len(s) > indent and s[indent] != '@' else '\n' for s in source]
+        source = '\n' * (first_line - 1) + ''.join(source)
+        globs = method.__globals__.copy()
+        exec(compile(source, method.__code__.co_filename, 'exec'), globs)  # pylint: disable=exec-used
+        func = globs[method.__name__]
+        func.__qualname__ = method.__qualname__
+
+        track_compile_time()
+        options = {'cache': jit_cache_enabled(), **kwargs}
+        return jit(*args, nopython=nopython, nogil=nogil, **options)(func)
+
+    def _jit(method):
+        func = None
+        lock = threading.Lock()
+
+        def _get_dispatcher():
+            nonlocal func
+            if func is None:
+                with lock:
+                    if func is None:
+                        func = _compile(method)
+            return func
 
         @functools.wraps(method)
         def _wrapped_method(self, *args, **kwargs):
             _ = self
-            return func(None, *args, **kwargs)
+            return (func or _get_dispatcher())(None, *args, **kwargs)
+        _wrapped_method.get_dispatcher = _get_dispatcher
+        _wrapped_method.is_method = True
         return _wrapped_method
 
     if len(args) == 1 and (callable(args[0])) and len(kwargs) == 0:
@@ -2,7 +2,11 @@
 import os
 import math
 import glob
-from collections.abc import Iterable
+import json
+import fnmatch
+import hashlib
+import concurrent.futures as cf
+from collections.abc import Iterable, Mapping
 import warnings
 import numpy as np
 
@@ -10,6 +14,219 @@ from .base import Baseset
 from .utils import create_bar, update_bar
 
 
+class ItemPositions:
+    """ Positions of items in a 1-d index
+
+    The lookup structure is built lazily on the first request and depends on the index:
+
+    - an index equal to ``np.arange(len(index))`` is its own position map,
+    - sortable items are found with a binary search over a sorted copy of the index
+      (no copy is made if the index is already sorted),
+    - other items are hashed into a dict.
+
+    For repeated items the position of the first occurrence is returned.
+
+    Parameters
+    ----------
+    indices : 1-d array-like or None
+        items in the index
+    order : np.ndarray or None
+        positions which sort the index, if they are already known (see :attr:`.order`)
+
+    Examples
+    --------
+    >>> pos = ItemPositions(['b', 'c', 'a'])
+    >>> pos['a']
+    2
+    >>> pos.get(['a', 'b'])
+    array([2, 0])
+    """
+    def __init__(self, indices, order=None):
+        self.indices = np.asarray(indices if indices is not None else [])
+        self._engine = None
+        self._keys = None
+        self._order = None
+        self._map = None
+        if order is not None:
+            self._engine = 'sorted'
+            self._keys, self._order = self.indices[order], order
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def engine(self):
+        """ str : a lookup method, one of 'range', 'sorted' or 'hash' """
+        if self._engine is None:
+            self._build()
+        return self._engine
+
+    @property
+    def order(self):
+        """ np.ndarray or None : positions which sort the index (None if the index is sorted or unsortable) """
+        _ = self.engine
+        return self._order
+
+    @property
+    def is_unique(self):
+        """ bool : whether all items in the index are different """
+        if self.engine == 'range':
+            return True
+        if self._engine == 'sorted':
+            return not np.any(self._keys[1:] == self._keys[:-1])
+        return len(self._map) == len(self)
+
+    def _build(self):
+        indices = self.indices
+        if indices.dtype.kind in 'iu' and np.array_equal(indices, np.arange(len(indices))):
+            self._engine = 'range'
+            return
+
+        try:
+            if np.all(indices[1:] >= indices[:-1]):
+                keys, order = indices, None
+            else:
+                # a stable sort keeps the first occurrence of repeated items first
+                order = np.argsort(indices, kind='stable')
+                keys = indices[order]
+        except TypeError:
+            self._engine = 'hash'
+            self._map = dict(zip(indices[::-1], range(len(indices) - 1, -1, -1)))
+        else:
+            self._engine = 'sorted'
+            self._keys, self._order = keys, order
+
+    def _find(self, items):
+        """ Return positions of items and a mask of items found in the index """
+        if items.dtype.kind == 'O' and items.ndim > 0 and self.engine != 'hash' and self.indices.dtype.kind != 'O':
+            # items of different types are looked up one by one
+            result = [self._find(np.asarray(item)) for item in items.ravel()]
+            pos = np.array([item_pos for item_pos, _ in result], dtype=np.intp).reshape(items.shape)
+            found = np.array([item_found for _, item_found in result], dtype=bool).reshape(items.shape)
+            return pos, found
+
+        if self.engine == 'range':
+            if items.dtype.kind in 'iuf':
+                pos = items.astype(np.intp)
+                found = (pos == items) & (pos >= 0) & (pos < len(self))
+                return np.where(found, pos, 0), found
+        elif self._engine == 'sorted':
+            kinds = {self._keys.dtype.kind, items.dtype.kind}
+            # numbers cannot be compared with strings
+            comparable = 'O' in kinds or kinds <= set('US') or not kinds & set('US')
+            if len(self) > 0 and comparable:
+                try:
+                    pos = np.minimum(np.searchsorted(self._keys, items), len(self) - 1)
+                    found = np.asarray(self._keys[pos] == items, dtype=bool)
+                except TypeError:
+                    pass
+                else:
+                    if found.shape == items.shape:
+                        return (pos if self._order is None else self._order[pos]), found
+        else:
+            pos = np.array([self._map.get(item, -1) for item in items.ravel()], dtype=np.intp).reshape(items.shape)
+            return np.maximum(pos, 0), pos >= 0
+
+        # items cannot be compared to the index items
+        return np.zeros(items.shape, dtype=np.intp), np.zeros(items.shape, dtype=bool)
+
+    @staticmethod
+    def _as_array(items):
+        if isinstance(items, np.ndarray):
+            return items
+        array = np.asarray(items)
+        if array.dtype.kind in 'US' and not all(isinstance(item, str) for item in items):
+            # numpy would cast mixed items to strings
+            array = np.empty(len(items), dtype=object)
+            array[:] = items
+        return array
+
+    def get(self, items):
+        """ Return positions of items
+
+        Parameters
+        ----------
+        items : hashable or array-like
+            an item or a sequence of items
+
+        Returns
+        -------
+        int or np.ndarray of int
+
+        Raises
+        ------
+        KeyError
+            if some items are not in the index
+        """
+        if not isinstance(items, (list, tuple, np.ndarray)):
+            return self[items]
+        items = self._as_array(items)
+        pos, found = self._find(items)
+        if not np.all(found):
+            raise KeyError(items[~found])
+        return pos
+
+    def isin(self, items):
+        """ Return a boolean mask of items which are present in the index """
+        return self._find(self._as_array(items))[1]
+
+    def __getitem__(self, item):
+        if self.engine == 'hash':
+            try:
+                return self._map[item]
+            except (KeyError, TypeError):
+                raise KeyError(item) from None
+        pos, found = self._find(np.asarray(item))
+        if not found:
+            raise KeyError(item)
+        return int(pos)
+
+    def __contains__(self, item):
+        try:
+            self[item]
+        except KeyError:
+            return False
+        return True
+
+
+class FilesPaths(Mapping):
+    """ A read-only mapping from items of a :class:`.FilesIndex` to their full paths
+
+    Paths are kept in an object array aligned with the index, so the mapping takes no extra memory
+    and behaves like the dict which :attr:`.FilesIndex.paths` used to be.
+
+    Parameters
+    ----------
+    positions : ItemPositions
+        positions of items in the index
+    paths : np.ndarray
+        full paths of the items in the same order as in the index
+
+    Examples
+    --------
+    >>> paths = findex.paths
+    >>> paths['file_1.txt']
+    '/path/to/file_1.txt'
+    >>> paths.array
+    array(['/path/to/file_0.txt', '/path/to/file_1.txt'], dtype=object)
+    """
+    def __init__(self, positions, paths):
+        self._positions = positions
+        self.array = paths
+
+    def __getitem__(self, item):
+        return self.array[self._positions[item]]
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def __iter__(self):
+        return iter(self._positions.indices)
+
+    def __len__(self):
+        return len(self._positions)
+
+
 class DatasetIndex(Baseset):
     """ Stores an index for a dataset.
     The index should be 1-d array-like, e.g. numpy array, pandas Series, etc.
@@ -31,6 +248,8 @@ class DatasetIndex(Baseset):
         super().__init__(*args, **kwargs)
         self._pos = self.build_pos()
         self._random_state = None
+        if not self._pos.is_unique:
+            warnings.warn("Index contains non-unique elements")
 
     @classmethod
     def from_index(cls, *args, **kwargs):
@@ -112,16 +331,11 @@ class DatasetIndex(Baseset):
         if len(_index.shape) > 1:
             raise TypeError("Index should be 1-dimensional")
 
-        if len(np.unique(_index)) != len(_index):
-            warnings.warn("Index contains non-unique elements")
-
         return _index
 
     def build_pos(self):
-        """ Create a dictionary with positions in the index. """
-        if self.indices is None:
-            return dict()
-        return dict(zip(self.indices, np.arange(len(self))))
+        """ Create a lookup table with positions in the index. """
+        return ItemPositions(self.indices)
 
     def get_pos(self, index):
         """ Return position of an item in the index.
@@ -156,11 +370,28 @@ class DatasetIndex(Baseset):
         elif isinstance(index, str):
             pos = self._pos[index]
         elif isinstance(index, Iterable):
-            pos = np.asarray([self._pos[ix] for ix in index])
+            if not isinstance(index, (list, tuple, np.ndarray)):
+                index = list(index)
+            pos = self._pos.get(index)
         else:
             pos = self._pos[index]
         return pos
 
+    def isin(self, index):
+        """ Return a boolean mask of items which are present in the index.
+
+        Parameters
+        ----------
+        index : DatasetIndex or 1-d array-like
+            Items to check.
+
+        Returns
+        -------
+        numpy.array
+        """
+        index = index.indices if isinstance(index, DatasetIndex) else index
+        return self._pos.isin(index)
+
     def subset_by_pos(self, pos):
         """ Return subset of index by given positions in the index.
 
@@ -192,7 +423,7 @@ class DatasetIndex(Baseset):
         shares : float or tuple of floats
             train, test and validation shares.
 
-        shuffle : bool, int, class:`numpy.random.RandomState` or callable
+        shuffle : bool, int, class:`numpy.random.RandomState`, class:`numpy.random.Generator` or callable
             specifies the order of items, could be:
 
             - bool - if `False`, items go sequentionally, one after another as they appear in the index.
@@ -200,7 +431,7 @@ class DatasetIndex(Baseset):
 
             - int - a seed number for a random shuffle.
 
-            - :class:`numpy.random.RandomState` instance.
+            - :class:`numpy.random.RandomState` or :class:`numpy.random.Generator` instance.
 
             - callable - a function which takes an array of item indices in the initial order
                 (as they appear in the index) and returns the order of items.
@@ -232,17 +463,19 @@ class DatasetIndex(Baseset):
 
         if shuffle:
             order = self.shuffle(shuffle)
+            take = lambda start, stop: order[start:stop]
         else:
-            order = np.arange(len(self))
+            # contiguous slices keep subsets as views of the index
+            take = slice
 
         if valid_share > 0:
-            validation_pos = order[:valid_share]
+            validation_pos = take(0, valid_share)
             self.validation = self.create_subset(self.subset_by_pos(validation_pos))
         if test_share > 0:
-            test_pos = order[valid_share : valid_share + test_share]
+            test_pos = take(valid_share, valid_share + test_share)
             self.test = self.create_subset(self.subset_by_pos(test_pos))
         if train_share > 0:
-            train_pos = order[valid_share + test_share:]
+            train_pos = take(valid_share + test_share, None)
             self.train = self.create_subset(self.subset_by_pos(train_pos))
 
     def shuffle(self, shuffle, iter_params=None):
@@ -250,7 +483,7 @@ class DatasetIndex(Baseset):
 
         Parameters
         ----------
-        shuffle : bool, int, class:`numpy.random.RandomState` or callable
+        shuffle : bool, int, class:`numpy.random.RandomState`, class:`numpy.random.Generator` or callable
             specifies the order of items, could be:
 
             - bool - if `False`, items go sequentionally, one after another as they appear in the index.
@@ -258,7 +491,7 @@ class DatasetIndex(Baseset):
 
             - int - a seed number for a random shuffle.
 
-            - :class:`numpy.random.RandomState` instance.
+            - :class:`numpy.random.RandomState` or :class:`numpy.random.Generator` instance.
 
             - callable - a function which takes an array of item indices in the initial order
                 (as they appear in the index) and returns the order of items.
@@ -283,14 +516,15 @@ class DatasetIndex(Baseset):
             if iter_params['_random_state'] is None or iter_params['_random_state'].seed != shuffle:
                 iter_params['_random_state'] = np.random.RandomState(shuffle)
             order = iter_params['_random_state'].permutation(order)
-        elif isinstance(shuffle, np.random.RandomState):
-            if iter_params['_random_state'] != shuffle:
+        elif isinstance(shuffle, (np.random.RandomState, np.random.Generator)):
+            if iter_params['_random_state'] is not shuffle:
                 iter_params['_random_state'] = shuffle
             order = iter_params['_random_state'].permutation(order)
         elif callable(shuffle):
             order = shuffle(self.indices)
         else:
-            raise ValueError("shuffle could be bool, int, numpy.random.RandomState or callable", shuffle)
+            raise ValueError("shuffle could be bool, int, numpy.random.RandomState, numpy.random.Generator "
+                             "or callable", shuffle)
         return order
 
     def next_batch(self, batch_size, shuffle=False, n_iters=None, n_epochs=None, drop_last=False, iter_params=None):
@@ -301,7 +535,7 @@ class DatasetIndex(Baseset):
         batch_size : int
             Desired number of items in the batch (the actual batch could contain fewer items)
 
-        shuffle : bool, int, class:`numpy.random.RandomState` or callable
+        shuffle : bool, int, class:`numpy.random.RandomState`, class:`numpy.random.Generator` or callable
             Specifies the order of items, could be:
 
             - bool
@@ -311,7 +545,7 @@ class DatasetIndex(Baseset):
             - int
                 A seed number for a random shuffle.
 
-            - :class:`numpy.random.RandomState` instance
+            - :class:`numpy.random.RandomState` or :class:`numpy.random.Generator` instance
                 Class for a reproducible random shuffle.
 
             - callable
@@ -419,7 +653,7 @@ class DatasetIndex(Baseset):
         batch_size : int
             Desired number of items in the batch (the actual batch could contain fewer items).
 
-        shuffle : bool, int, class:`numpy.random.RandomState` or callable
+        shuffle : bool, int, class:`numpy.random.RandomState`, class:`numpy.random.Generator` or callable
             Specifies the order of items, could be:
 
             - bool
@@ -429,7 +663,7 @@ class DatasetIndex(Baseset):
             - int
                 A seed number for a random shuffle.
 
-            - :class:`numpy.random.RandomState` instance
+            - :class:`numpy.random.RandomState` or :class:`numpy.random.Generator` instance
                 Class for a reproducible random shuffle.
 
             - callable
@@ -556,6 +790,156 @@ class DatasetIndex(Baseset):
         return batch
 
 
+def _scan_dir(dirname):
+    """ Return the modification time of a directory and its entries as (name, is_dir, is_file) tuples """
+    try:
+        path = dirname or os.curdir
+        mtime = os.stat(path).st_mtime_ns
+        with os.scandir(path) as entries:
+            return mtime, [(entry.name, entry.is_dir(), entry.is_file()) for entry in entries]
+    except OSError:
+        return None, []
+
+def walk_glob(pattern, dirs=False, n_workers=None, dir_mtimes=None):
+    """ Return paths to files (or directories) matching a glob pattern
+
+    Works like ``glob.glob(pattern, recursive=True)`` followed by a file type check,
+    but each directory is listed only once with :func:`os.scandir`, which also provides
+    entry types without extra system calls, and directories of the same level are listed in parallel threads.
+
+    Parameters
+    ----------
+    pattern : str
+        a path or a glob pattern.
+    dirs : bool
+        whether to return directories instead of files.
+    n_workers : int or None
+        the number of threads to list directories with.
+    dir_mtimes : dict or None
+        if given, modification times of all visited directories are stored in it.
+
+    Returns
+    -------
+    list of str
+    """
+    dir_mtimes = dir_mtimes if dir_mtimes is not None else {}
+    parts = pattern.split(os.sep)
+    n_static = 0
+    while n_static < len(parts) and not glob.has_magic(parts[n_static]):
+        n_static += 1
+    root = os.sep.join(parts[:n_static]) if parts[:n_static] != [''] else os.sep
+    parts = parts[n_static:]
+
+    def _check(path):
+        return os.path.isdir(path) if dirs else os.path.isfile(path)
+
+    if not parts:
+        # no wildcards
+        parent = os.path.dirname(pattern)
+        try:
+            dir_mtimes[parent] = os.stat(parent or os.curdir).st_mtime_ns
+        except OSError:
+            pass
+        return [pattern] if _check(pattern) else []
+
+    def _join(dirname, name):
+        return os.path.join(dirname, name) if dirname else name
+
+    with cf.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        def _scan(dirnames):
+            scans = executor.map(_scan_dir, dirnames) if len(dirnames) > 1 else map(_scan_dir, dirnames)
+            for dirname, (mtime, entries) in zip(dirnames, scans):
+                if mtime is not None:
+                    dir_mtimes[dirname] = mtime
+                yield dirname, entries
+
+        current = [root if n_static > 0 else '']
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            matched = []
+            if part == '**':
+                # the directory itself and all its subdirectories (or all items if it is the last part)
+                frontier, subdirs = current, list(current)
+                while frontier:
+                    new_frontier = []
+                    for dirname, entries in _scan(frontier):
+                        for name, is_dir, is_file in entries:
+                            if name.startswith('.'):
+                                continue
+                            path = _join(dirname, name)
+                            if is_dir:
+                                new_frontier.append(path)
+                            if last and (is_dir if dirs else is_file):
+                                matched.append(path)
+                    subdirs.extend(new_frontier)
+                    frontier = new_frontier
+                if not last:
+                    matched = subdirs
+            elif not glob.has_magic(part):
+                matched = [_join(dirname, part) for dirname in current]
+                if last:
+                    matched = [path for path in matched if _check(path)]
+            else:
+                for dirname, entries in _scan(current):
+                    names = {name: (is_dir, is_file) for name, is_dir, is_file in entries
+                             if part.startswith('.') or not name.startswith('.')}
+                    for name in fnmatch.filter(names, part):
+                        is_dir, is_file = names[name]
+                        if (is_dir if dirs else is_file) if last else is_dir:
+                            matched.append(_join(dirname, name))
+            current = matched
+    return current
+
+
+class FilesIndexCache:
+    """ A cache file with items and paths of a :class:`.FilesIndex`
+
+    The cache is valid while modification times of all directories visited to build the index are the same.
+
+    Parameters
+    ----------
+    path : str or None
+        a path to the cache file. If None, a file in ``~/.cache/batchflow`` is named after `key`.
+    key : list
+        arguments which define the index (e.g. absolute path patterns and flags).
+    """
+    VERSION = 1
+
+    def __init__(self, path=None, key=None):
+        self.key = json.dumps([self.VERSION] + list(key or []))
+        if path is None:
+            digest = hashlib.sha1(self.key.encode()).hexdigest()
+            path = os.path.join(os.path.expanduser('~'), '.cache', 'batchflow', 'files_index_%s.npz' % digest)
+        self.path = path
+
+    def load(self):
+        """ Return items, paths and the sort order of items, or None if the cache is missing or outdated """
+        try:
+            with np.load(self.path, allow_pickle=False) as cache:
+                if str(cache['key']) != self.key:
+                    return None
+                for dirname, mtime in zip(cache['dir_names'], cache['dir_mtimes']):
+                    if os.stat(str(dirname) or os.curdir).st_mtime_ns != mtime:
+                        return None
+                order = cache['order'] if cache['has_order'] else None
+                return cache['index'], cache['paths'].astype(object), order
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, index, paths, order, dir_mtimes):
+        """ Write items, paths, the sort order of items and modification times of directories to the cache file """
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, key=np.array(self.key), index=index, paths=np.asarray(paths, dtype=str),
+                     has_order=order is not None, order=order if order is not None else np.empty(0, dtype=np.intp),
+                     dir_names=np.array(list(dir_mtimes.keys()), dtype=str),
+                     dir_mtimes=np.array(list(dir_mtimes.values()), dtype=np.int64))
+        os.replace(tmp_path, self.path)
+
+
 class FilesIndex(DatasetIndex):
     """ Index with the list of files or directories with the given path pattern
 
@@ -574,6 +958,10 @@ class FilesIndex(DatasetIndex):
 
     >>> fi = FilesIndex(path=['/path/to/archive/2016/*','/path/to/current/file/*'], no_ext=True)
 
+    Create an index of all png files in a directory tree and keep it in a cache file for the next runs:
+
+    >>> fi = FilesIndex(path='/path/to/data/**/*.png', cache=True, n_workers=16)
+
     To get a path to the file call `get_fullpath(index_id)`:
 
     >>> path = fi.get_fullpath(some_id)
@@ -589,12 +977,17 @@ class FilesIndex(DatasetIndex):
     """
     def __init__(self, *args, **kwargs):
         self._paths = None
+        self._pos = None
         self.dirs = False
         super().__init__(*args, **kwargs)
 
     @property
     def paths(self):
-        return self._paths
+        """ FilesPaths : a mapping from items to their full paths.
+
+        Paths are stored in an object array (see ``paths.array``) in the same order as items in the index.
+        """
+        return FilesPaths(self._pos, self._paths)
 
     @classmethod
     def concat(cls, *index_list):
@@ -611,10 +1004,8 @@ class FilesIndex(DatasetIndex):
         DatasetIndex
             Contains one common index.
         """
-        paths = {}
-        for index in index_list:
-            paths.update(index.paths)
-        return type(index_list[0])(index=np.concatenate([i.index for i in index_list]), paths=paths)
+        return type(index_list[0])(index=np.concatenate([i.index for i in index_list]),
+                                   paths=np.concatenate([i.paths.array for i in index_list]))
 
     def build_index(self, index=None, path=None, *args, **kwargs):
         """ Build index from a path string or an index given. """
@@ -623,26 +1014,61 @@ class FilesIndex(DatasetIndex):
         else:
             _index = self.build_from_path(path, *args, **kwargs)
 
-        if len(_index) != len(self._paths):
+        if self._pos is None or self._pos.indices is not _index:
+            self._pos = ItemPositions(_index)
+        if len(_index) != len(self._paths) or not self._pos.is_unique:
             raise ValueError("Index contains non-unique elements, which leads to path collision")
         return _index
 
+    def build_pos(self):
+        """ Create a lookup table with positions in the index. """
+        # positions are already built to check the index for collisions
+        return self._pos
+
     def build_from_index(self, index, paths, dirs=None):
-        """ Build index from another index for indices given. """
+        """ Build index from another index for indices given.
+
+        Parameters
+        ----------
+        index : DatasetIndex or 1-d array-like
+            items of the index.
+        paths : mapping or 1-d array-like
+            a mapping from items to their full paths or full paths in the same order as in `index`.
+        dirs : bool
+            whether items are directories.
+        """
         if isinstance(index, DatasetIndex):
             index = index.indices
         else:
             index = DatasetIndex(index).indices
 
-        if isinstance(paths, dict):
-            self._paths = dict((file, paths[file]) for file in index)
-        else:
-            self._paths = dict((file, paths[pos]) for pos, file in np.ndenumerate(index))
+        if isinstance(paths, Mapping):
+            paths = [paths[file] for file in index]
+        # an object array does not pad every path to the length of the longest one
+        self._paths = np.asarray(paths, dtype=object)
         self.dirs = dirs
         return index
 
-    def build_from_path(self, path, dirs=False, no_ext=False, sort=False):
-        """ Build index from a path/glob or a sequence of paths/globs. """
+    def build_from_path(self, path, dirs=False, no_ext=False, sort=False, cache=False, n_workers=None):
+        """ Build index from a path/glob or a sequence of paths/globs.
+
+        Parameters
+        ----------
+        path : str or sequence of str
+            paths or glob patterns (with a recursive ``**`` allowed).
+        dirs : bool
+            whether to index directories instead of files.
+        no_ext : bool
+            whether to remove file extensions from items.
+        sort : bool
+            whether to sort items.
+        cache : bool or str
+            whether to store the index in a cache file and load it on the next run with the same arguments
+            if no directory has changed since then. Could also be a path to the cache file.
+            By default, cache files are stored in ``~/.cache/batchflow``.
+        n_workers : int or None
+            the number of threads to scan directories with.
+        """
         if isinstance(path, str):
             paths = [path]
         else:
@@ -651,37 +1077,64 @@ class FilesIndex(DatasetIndex):
         if len(paths) == 0:
             raise ValueError("`path` cannot be empty. Got '{}'.".format(path))
 
-        _all_index = []
-        _all_paths = dict()
         for one_path in paths:
-            _index, _paths = self.build_from_one_path(one_path, dirs, no_ext)
+            if not isinstance(one_path, str):
+                raise TypeError('Each path must be a string, instead got {}'.format(one_path))
+
+        self.dirs = dirs
+
+        if cache:
+            cache_key = [os.path.abspath(one_path) for one_path in paths] + [dirs, no_ext, sort]
+            cache = FilesIndexCache(cache if isinstance(cache, str) else None, key=cache_key)
+            cached = cache.load()
+            if cached is not None:
+                _all_index, self._paths, order = cached
+                self._pos = ItemPositions(_all_index, order=order)
+                return _all_index
+
+        _all_index, _all_paths = [], []
+        dir_mtimes = {}
+        for one_path in paths:
+            _index, _paths = self.build_from_one_path(one_path, dirs, no_ext, n_workers=n_workers,
+                                                      dir_mtimes=dir_mtimes)
             _all_index.append(_index)
-            _all_paths.update(_paths)
+            _all_paths.append(_paths)
 
-        _all_index = np.ravel(_all_index)
+        _all_index = np.concatenate(_all_index)
+        _all_paths = np.concatenate(_all_paths)
 
         if sort:
-            _all_index.sort()
+            order = np.argsort(_all_index, kind='stable')
+            _all_index, _all_paths = _all_index[order], _all_paths[order]
         self._paths = _all_paths
-        self.dirs = dirs
+
+        if cache:
+            self._pos = ItemPositions(_all_index)
+            if self._pos.is_unique:
+                cache.save(_all_index, _all_paths, self._pos.order, dir_mtimes)
 
         return _all_index
 
-    def build_from_one_path(self, path, dirs=False, no_ext=False):
-        """ Build index from a path/glob. """
+    def build_from_one_path(self, path, dirs=False, no_ext=False, n_workers=None, dir_mtimes=None):
+        """ Build index from a path/glob.
+
+        Returns
+        -------
+        index : np.ndarray
+            items of the index.
+        paths : np.ndarray
+            full paths of the items.
+        """
         if not isinstance(path, str):
             raise TypeError('Each path must be a string, instead got {}'.format(path))
 
-        check_fn = os.path.isdir if dirs else os.path.isfile
-        pathlist = glob.iglob(path, recursive=True)
-        _full_index = np.asarray([self.build_key(fname, no_ext) for fname in pathlist if check_fn(fname)])
-        if len(_full_index):
-            _index = _full_index[:, 0]
-            _paths = _full_index[:, 1]
+        pathlist = walk_glob(path, dirs=dirs, n_workers=n_workers, dir_mtimes=dir_mtimes)
+        if len(pathlist):
+            _index = np.array([self.build_key(fname, no_ext)[0] for fname in pathlist], dtype=str)
+            _paths = np.array(pathlist, dtype=object)
         else:
             warnings.warn("No items to index in %s" % path)
-            _index, _paths = np.empty(0), np.empty(0)
-        _paths = dict(zip(_index, _paths))
+            _index, _paths = np.empty(0, dtype=str), np.empty(0, dtype=object)
         return _index, _paths
 
     @staticmethod
@@ -696,9 +1149,10 @@ class FilesIndex(DatasetIndex):
         return key_name, fullpathname
 
     def get_fullpath(self, key):
-        """ Return the full path name for an item in the index. """
-        return self._paths[key]
+        """ Return the full path name for an item (or full paths for a sequence of items) in the index. """
+        return self._paths[self.get_pos(key)]
 
     def create_subset(self, index):
         """ Return a new FilesIndex based on the subset of indices given. """
-        return type(self).from_index(index=index, paths=self._paths, dirs=self.dirs)
+        items = index.indices if isinstance(index, DatasetIndex) else np.asarray(index).reshape(-1)
+        return type(self).from_index(index=index, paths=self._paths[self.get_pos(items)], dirs=self.dirs)
@@ -0,0 +1,168 @@
+""" Contains a cache of decoded images """
+import os
+import threading
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+import PIL
+
+
+class ImageCache:
+    """ A byte-bounded LRU cache of decoded images
+
+    Images are kept as arrays, so after the first epoch they are neither read from disk nor decoded.
+    One cache can be shared by all threads which load images (e.g. prefetching threads).
+
+    When `spill_dir` is given, images evicted from memory are saved there as ``.npy`` files
+    and read back with memory mapping, which is still much faster than decoding.
+
+    Parameters
+    ----------
+    max_bytes : int
+        the maximum size of images kept in memory.
+    transform : callable or None
+        a deterministic function which takes an image array and returns an array to cache
+        (e.g. resized to a smaller shape). It should return `uint8` arrays, if images are used as `PIL` images.
+    spill_dir : str or None
+        a directory for images evicted from memory.
+    max_spill_bytes : int or None
+        the maximum size of images kept in `spill_dir` (default is unlimited).
+
+    Attributes
+    ----------
+    hits, spill_hits, misses : int
+        numbers of images found in memory, found in `spill_dir` and decoded.
+
+    Examples
+    --------
+    >>> cache = ImageCache(max_bytes=2**32, transform=lambda image: image[::2, ::2])
+    >>> pipeline.load(fmt='image', cache=cache)
+    >>> cache.hit_rate, cache.nbytes
+    """
+    def __init__(self, max_bytes=2**30, transform=None, spill_dir=None, max_spill_bytes=None):
+        self.max_bytes = max_bytes
+        self.transform = transform
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.nbytes = 0
+        self.spill_nbytes = 0
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._spilled = OrderedDict()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._items) + len(self._spilled)
+
+    def __contains__(self, key):
+        return key in self._items or key in self._spilled
+
+    @property
+    def hit_rate(self):
+        """ float : a share of requests served without decoding """
+        total = self.hits + self.spill_hits + self.misses
+        return (self.hits + self.spill_hits) / total if total > 0 else 0.
+
+    def get(self, key, loader):
+        """ Return a cached array or load it
+
+        Parameters
+        ----------
+        key : hashable
+            a key of an image (e.g. a file path).
+        loader : callable
+            a function without arguments which returns an image array (or anything `np.asarray` accepts).
+
+        Returns
+        -------
+        np.ndarray
+            a read-only array.
+        """
+        with self._lock:
+            image = self._items.get(key)
+            if image is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return image
+            spilled = self._spilled.pop(key, None)
+
+        if spilled is not None:
+            file_name, nbytes = spilled
+            image = np.array(np.load(file_name, mmap_mode='r'))
+            os.remove(file_name)
+            with self._lock:
+                self.spill_nbytes -= nbytes
+                self.spill_hits += 1
+        else:
+            image = np.asarray(loader())
+            if self.transform is not None:
+                image = np.asarray(self.transform(image))
+            with self._lock:
+                self.misses += 1
+
+        image.flags.writeable = False
+        self._put(key, image)
+        return image
+
+    def _put(self, key, image):
+        evicted = []
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = image
+                self.nbytes += image.nbytes
+            while self.nbytes > self.max_bytes and len(self._items) > 1:
+                old_key, old_image = self._items.popitem(last=False)
+                self.nbytes -= old_image.nbytes
+                evicted.append((old_key, old_image))
+
+        if self.spill_dir is not None:
+            for old_key, old_image in evicted:
+                self._spill(old_key, old_image)
+
+    def _spill(self, key, image):
+        if self.max_spill_bytes is not None and image.nbytes > self.max_spill_bytes:
+            return
+        file_name = os.path.join(self.spill_dir, '%d.npy' % next(self._counter))
+        np.save(file_name, image)
+
+        removed = []
+        with self._lock:
+            self._spilled[key] = file_name, image.nbytes
+            self.spill_nbytes += image.nbytes
+            while self.max_spill_bytes is not None and self.spill_nbytes > self.max_spill_bytes:
+                _, (old_file, nbytes) = self._spilled.popitem(last=False)
+                self.spill_nbytes -= nbytes
+                removed.append(old_file)
+        for old_file in removed:
+            os.remove(old_file)
+
+    def clear(self):
+        """ Remove all images from memory and from `spill_dir` """
+        with self._lock:
+            files = [file_name for file_name, _ in self._spilled.values()]
+            self._items.clear()
+            self._spilled.clear()
+            self.nbytes = self.spill_nbytes = 0
+        for file_name in files:
+            os.remove(file_name)
+
+
+def decode_image(path):
+    """ Return an image from a file as an array
+
+    Arrays keep values of images as they are loaded without the cache: palette images ('P') keep
+    palette indices, integer and float images ('I;16', 'I', 'F') keep their dtypes and binary images ('1')
+    become 'L' images. Images of other modes (e.g. 'CMYK' or 'LA') are converted to 'RGB' or 'RGBA'.
+    """
+    with PIL.Image.open(path) as image:
+        if image.mode == '1':
+            image = image.convert('L')
+        elif image.mode not in ('L', 'P', 'RGB', 'RGBA', 'I', 'F') and not image.mode.startswith('I;'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        return np.asarray(image)
@@ -0,0 +1,102 @@
+""" Contains functions which split images into patches and assemble images back from patches """
+import numpy as np
+try:
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:
+    sliding_window_view = None
+
+
+def patch_positions(length, patch_length, stride, drop_last=False):
+    """ Return starts of patches along an axis
+
+    Patches start every `stride` pixels. Unless `drop_last` is True, one more patch is cropped
+    from the edge of an image if patches do not cover an image till its end.
+    """
+    if patch_length > length:
+        return np.empty(0, dtype=np.int64)
+    positions = np.arange(0, length - patch_length + 1, stride)
+    if not drop_last and positions[-1] + patch_length != length:
+        positions = np.append(positions, length - patch_length)
+    return positions
+
+
+def _windows(images, patch_shape):
+    """ Return a read-only view of shape `(N, H - ph + 1, W - pw + 1, ph, pw, ...)` with all windows of images """
+    if sliding_window_view is not None:
+        windows = sliding_window_view(images, patch_shape, axis=(1, 2))
+        # window axes go right after positions, while other item axes (e.g. channels) stay the last
+        return np.moveaxis(windows, (-2, -1), (3, 4))
+    shape = (images.shape[0], images.shape[1] - patch_shape[0] + 1, images.shape[2] - patch_shape[1] + 1,
+             *patch_shape, *images.shape[3:])
+    strides = (*images.strides[:3], *images.strides[1:3], *images.strides[3:])
+    return np.lib.stride_tricks.as_strided(images, shape=shape, strides=strides, writeable=False)
+
+
+def extract_patches(images, patch_shape, stride=1, drop_last=False):
+    """ Split images of the same shape into patches
+
+    Patches are views of images until they are copied once into the resulting array.
+
+    Parameters
+    ----------
+    images : np.ndarray
+        an array of shape `(N, H, W, ...)`.
+    patch_shape : sequence of int
+        a patch shape in the form (rows, columns).
+    stride : sequence of int
+        a step between patches in the form (rows, columns).
+    drop_last : bool
+        whether to drop patches which do not fit into an image with a given stride.
+        If False, such patches are cropped from the edge of an image.
+
+    Returns
+    -------
+    np.ndarray
+        a contiguous array of shape `(N * n_patches, ph, pw, ...)`. Patches of each image go in rows.
+    """
+    rows = patch_positions(images.shape[1], patch_shape[0], stride[0], drop_last)
+    columns = patch_positions(images.shape[2], patch_shape[1], stride[1], drop_last)
+    windows = _windows(images, patch_shape)
+    patches = windows[:, rows[:, None], columns[None, :]]
+    return patches.reshape(-1, *patches.shape[3:])
+
+
+def assemble_patches(patches, image_shape, stride=1, drop_last=False):
+    """ Assemble images from their patches averaging overlapping pixels
+
+    Parameters
+    ----------
+    patches : np.ndarray
+        an array of shape `(N * n_patches, ph, pw, ...)` with patches in the order of :func:`.extract_patches`.
+    image_shape : sequence of int
+        an image shape in the form (rows, columns).
+    stride, drop_last
+        parameters which patches were extracted with.
+
+    Returns
+    -------
+    np.ndarray
+        an array of shape `(N, H, W, ...)`. Pixels which are not covered by any patch are zero.
+    """
+    patch_shape = patches.shape[1:3]
+    item_shape = patches.shape[3:]
+    height, width = image_shape
+    rows = patch_positions(height, patch_shape[0], stride[0], drop_last)
+    columns = patch_positions(width, patch_shape[1], stride[1], drop_last)
+    n_patches = len(rows) * len(columns)
+    if n_patches == 0 or len(patches) % n_patches != 0:
+        raise ValueError("%d patches cannot be assembled into images of shape %s" % (len(patches), tuple(image_shape)))
+
+    # positions of patch pixels within an image
+    pixel_rows = rows[:, None, None, None] + np.arange(patch_shape[0])[None, None, :, None]
+    pixel_columns = columns[None, :, None, None] + np.arange(patch_shape[1])[None, None, None, :]
+    pixels = (pixel_rows * width + pixel_columns).ravel()
+    counts = np.bincount(pixels, minlength=height * width).reshape(height, width, *([1] * len(item_shape)))
+
+    n_values = int(np.prod(item_shape))
+    indices = (pixels[:, None] * n_values + np.arange(n_values)).ravel()
+    patches = patches.reshape(-1, n_patches * patches[0].size)
+    images = np.stack([np.bincount(indices, weights=values, minlength=height * width * n_values)
+                       for values in patches])
+    images = images.reshape(-1, height, width, *item_shape) / np.maximum(counts, 1)
+    return images.astype(np.result_type(patches.dtype, np.float32))
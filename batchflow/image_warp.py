@@ -0,0 +1,147 @@
+""" Contains affine maps of geometric transforms of images and a function which applies them at once """
+import math
+
+import numpy as np
+import scipy.ndimage
+import PIL
+
+
+# orders of spline interpolation in scipy which correspond to PIL resampling filters
+_SPLINE_ORDERS = {PIL.Image.NEAREST: 0, PIL.Image.BILINEAR: 1, PIL.Image.BICUBIC: 3}
+
+
+def translation(offset):
+    """ Return a map of output pixel coordinates into input ones for a shift by `-offset` """
+    return np.array([[1., 0., offset[0]], [0., 1., offset[1]], [0., 0., 1.]])
+
+
+def scaling(factor):
+    """ Return a map of output pixel coordinates into input ones for stretching an image `1 / factor` times """
+    factor = np.broadcast_to(np.asarray(factor, dtype=np.float64), 2)
+    return np.array([[factor[0], 0., 0.], [0., factor[1], 0.], [0., 0., 1.]])
+
+
+def flipping(size, mode='lr'):
+    """ Return a map of output pixel coordinates into input ones for a left/right or an upside/down flip """
+    if mode == 'lr':
+        return np.array([[-1., 0., size[0]], [0., 1., 0.], [0., 0., 1.]])
+    if mode == 'ud':
+        return np.array([[1., 0., 0.], [0., -1., size[1]], [0., 0., 1.]])
+    raise ValueError("mode must be one of ['lr', 'ud']")
+
+
+def rotation(size, angle, expand=False, center=None, translate=None):
+    """ Return a map of output pixel coordinates into input ones and an output size for a rotation
+    as `PIL.Image.rotate` does it """
+    width, height = size
+    post_trans = translate if translate is not None else (0, 0)
+    center = center if center is not None else (width / 2., height / 2.)
+
+    angle = -math.radians(angle % 360)
+    a, b = round(math.cos(angle), 15), round(math.sin(angle), 15)
+    matrix = np.array([[a, b, 0.], [-b, a, 0.], [0., 0., 1.]])
+    matrix[:2, 2] = matrix[:2, :2] @ (-center[0] - post_trans[0], -center[1] - post_trans[1]) + center
+
+    if expand:
+        corners = matrix[:2, :2] @ np.array([[0, width, width, 0], [0, 0, height, height]]) + matrix[:2, 2:]
+        new_width = math.ceil(corners[0].max()) - math.floor(corners[0].min())
+        new_height = math.ceil(corners[1].max()) - math.floor(corners[1].min())
+        matrix[:2, 2] = matrix[:2, :2] @ (-(new_width - width) / 2., -(new_height - height) / 2.) + matrix[:2, 2]
+        width, height = new_width, new_height
+    return matrix, np.array([width, height])
+
+
+def image_size(image):
+    """ Return a size of a PIL image or an array of shape `(H, W, ...)` in the form (width, height) """
+    if isinstance(image, PIL.Image.Image):
+        return np.array(image.size)
+    return np.array([image.shape[1], image.shape[0]])
+
+
+def region_mask(size, regions):
+    """ Return a mask of output pixels which lie within all given regions or None if no pixel lies outside them
+
+    Parameters
+    ----------
+    size : sequence of int
+        an output size in the form (width, height).
+    regions : sequence of tuples
+        pairs of a matrix which maps coordinates of output pixels into coordinates of a region
+        and a size of the region.
+    """
+    width, height = size
+    corners = np.array([[.5, width - .5, width - .5, .5], [.5, .5, height - .5, height - .5], [1., 1., 1., 1.]])
+    regions = [(matrix, region_size) for matrix, region_size in regions
+               if not _contains(matrix @ corners, region_size)]
+    if len(regions) == 0:
+        return None
+
+    x, y = np.meshgrid(np.arange(width) + .5, np.arange(height) + .5)
+    points = np.stack([x.ravel(), y.ravel(), np.ones(x.size)])
+    mask = np.ones(x.size, dtype=bool)
+    for matrix, region_size in regions:
+        mask &= _contains(matrix @ points, region_size, axis=0)
+    return mask.reshape(height, width)
+
+
+def _contains(points, size, axis=None):
+    inside = (points[0] >= 0) & (points[0] < size[0]) & (points[1] >= 0) & (points[1] < size[1])
+    return inside.all() if axis is None else inside
+
+
+def warp_image(image, matrix, size, resample=PIL.Image.NEAREST, regions=None):
+    """ Resample an image once with an affine map
+
+    Parameters
+    ----------
+    image : PIL.Image or np.ndarray
+        an image (arrays should have a shape `(H, W, ...)`).
+    matrix : np.ndarray
+        a 3x3 matrix which maps coordinates of output pixels into coordinates of input pixels.
+        Coordinates are continuous (x, y) as in `PIL.Image.transform`, so that the center of the top left pixel
+        is (0.5, 0.5).
+    size : sequence of int
+        an output size in the form (width, height).
+    resample : int
+        `PIL.Image.NEAREST`, `PIL.Image.BILINEAR` or `PIL.Image.BICUBIC`.
+    regions : sequence of tuples or None
+        maps of output pixel coordinates into coordinates of intermediate images and their sizes
+        (see :func:`.region_mask`). Pixels which lie outside any of intermediate images are zero,
+        as if transforms were applied one by one.
+
+    Returns
+    -------
+    PIL.Image or np.ndarray
+        an image of the same type as the input one. Pixels which come from outside an image are zero.
+    """
+    size = tuple(int(value) for value in size)
+    if np.array_equal(matrix, np.eye(3)) and size == tuple(image_size(image)):
+        return image
+    if isinstance(image, PIL.Image.Image):
+        mask = region_mask(size, regions) if regions else None
+        image = image.transform(size, PIL.Image.AFFINE, data=tuple(matrix[:2].ravel()), resample=resample)
+        if mask is not None:
+            image.paste(0, mask=PIL.Image.fromarray(np.uint8(~mask) * 255))
+        return image
+
+    # as in PIL, pixels near borders are interpolated from border pixels and those outside an image are zero
+    mask = region_mask(size, [(matrix, image_size(image)), *(regions or [])])
+
+    # (row, column) indices of pixels are (y - 0.5, x - 0.5)
+    to_xy = np.array([[0., 1., .5], [1., 0., .5], [0., 0., 1.]])
+    index_matrix = np.linalg.inv(to_xy) @ matrix @ to_xy
+    linear = np.eye(image.ndim)
+    linear[:2, :2] = index_matrix[:2, :2]
+    offset = np.concatenate([index_matrix[:2, 2], np.zeros(image.ndim - 2)])
+    order = _SPLINE_ORDERS[resample]
+    # splines of higher orders overshoot, so integer pixels are computed as floats and clipped
+    is_integer = image.dtype.kind in 'ui' and order > 1
+    output_shape = (size[1], size[0], *image.shape[2:])
+    result = scipy.ndimage.affine_transform(image, linear, offset=offset, output_shape=output_shape,
+                                            output=np.float64 if is_integer else None, order=order, mode='nearest')
+    if is_integer:
+        info = np.iinfo(image.dtype)
+        result = np.clip(np.round(result), info.min, info.max).astype(image.dtype)
+    if mask is not None:
+        result[~mask] = 0
+    return result
@@ -0,0 +1,151 @@
+""" Contains settings of a persistent cache of jit-compiled functions, their warm-up and compile time tracking """
+import os
+import time
+import logging
+import threading
+import functools
+
+
+_SETTINGS = dict(cache=True)
+_LISTENER = []
+_LOCK = threading.Lock()
+
+
+def set_jit_cache(enabled=True, path=None):
+    """ Configure a persistent on-disk cache of functions compiled with numba
+
+    Compiled functions (:func:`~.mjit` methods and jitted functions of metrics) are saved to disk,
+    so that other processes (e.g. research jobs) load them instead of compiling again.
+    A cache of a function is invalidated when its source file changes.
+
+    Parameters
+    ----------
+    enabled : bool
+        whether to cache functions which are compiled after the call.
+        :func:`~.mjit` methods and :func:`.lazy_njit` functions are compiled on the first call,
+        so the setting applies to them even if their modules are already imported.
+    path : str or None
+        a cache directory. It is also passed to child processes via the `NUMBA_CACHE_DIR` environment variable.
+        If None, functions are cached in `__pycache__` directories next to their source files
+        (or in a user-wide directory if those are not writable).
+    """
+    _SETTINGS['cache'] = enabled
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+        os.environ['NUMBA_CACHE_DIR'] = path
+        try:
+            from numba.core import config  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            pass
+        else:
+            config.CACHE_DIR = path
+
+
+def jit_cache_enabled():
+    """ Return whether compiled functions are cached on disk """
+    return _SETTINGS['cache']
+
+
+def lazy_njit(**options):
+    """ njit decorator for functions, which are compiled on the first call
+
+    numba is imported when the function is called for the first time, and the cache setting
+    at that moment is used (see :func:`.set_jit_cache`), unless `cache` is passed.
+
+    Examples
+    --------
+    >>> @lazy_njit(nogil=True)
+    ... def sigmoid(arr):
+    ...     return 1. / (1. + np.exp(-arr))
+    """
+    def _lazy_njit(func):
+        dispatcher = None
+        lock = threading.Lock()
+
+        def _get_dispatcher():
+            nonlocal dispatcher
+            if dispatcher is None:
+                with lock:
+                    if dispatcher is None:
+                        try:
+                            from numba import njit  # pylint: disable=import-outside-toplevel
+                        except ImportError:
+                            logging.warning('numba is not installed. This causes a severe performance degradation '
+                                            'for function %s', func.__name__)
+                            dispatcher = func
+                        else:
+                            track_compile_time()
+                            dispatcher = njit(**{'cache': jit_cache_enabled(), **options})(func)
+            return dispatcher
+
+        @functools.wraps(func)
+        def _wrapped(*args, **kwargs):
+            return (dispatcher or _get_dispatcher())(*args, **kwargs)
+        _wrapped.get_dispatcher = _get_dispatcher
+        _wrapped.is_method = False
+        return _wrapped
+    return _lazy_njit
+
+
+def warm_up(func, *args_list):
+    """ Compile a jitted function ahead of time (or load it from the cache) for types of given arguments
+
+    Parameters
+    ----------
+    func : numba dispatcher, a function decorated with :func:`.lazy_njit` or a method decorated with :func:`~.mjit`
+        a function to compile.
+    args_list : tuples
+        example arguments (without `self` for methods) whose types make signatures to compile.
+
+    Examples
+    --------
+    >>> warm_up(binarize, (np.zeros((1, 1), dtype=np.float32), .5), (np.zeros((1, 1)), .5))
+    """
+    import numba  # pylint: disable=import-outside-toplevel
+
+    track_compile_time()
+    dispatcher, prefix = func, ()
+    if hasattr(func, 'get_dispatcher'):
+        # methods decorated with mjit get None instead of self
+        dispatcher = func.get_dispatcher()
+        prefix = (None,) if func.is_method else ()
+    if not hasattr(dispatcher, 'compile'):
+        # numba is not installed, so there is nothing to compile
+        return
+    for args in args_list:
+        dispatcher.compile(tuple(numba.typeof(arg) for arg in (*prefix, *args)))
+
+
+def track_compile_time():
+    """ Record compile time of all numba functions into pipeline profilers (see :class:`~.ActionProfiler`)
+
+    Only actual compilations are recorded, while loading from the cache is not.
+    """
+    if _LISTENER:
+        return
+    try:
+        from numba.core import event  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return
+
+    class _CompileListener(event.Listener):
+        """ Measure time of (possibly nested) compilations in each thread """
+        def __init__(self):
+            self._local = threading.local()
+
+        def on_start(self, event):          # pylint: disable=redefined-outer-name
+            stack = self._local.__dict__.setdefault('stack', [])
+            stack.append((time.time(), time.perf_counter(), time.thread_time()))
+
+        def on_end(self, event):            # pylint: disable=redefined-outer-name
+            start_time, start, start_cpu = self._local.stack.pop()
+            py_func = event.data['dispatcher'].py_func
+            from .profiler import record_compilation  # pylint: disable=import-outside-toplevel
+            record_compilation(py_func.__qualname__, start_time=start_time,
+                               total_time=time.perf_counter() - start, cpu_time=time.thread_time() - start_cpu)
+
+    with _LOCK:
+        if not _LISTENER:
+            listener = _CompileListener()
+            event.register('numba:compile', listener)
+            _LISTENER.append(listener)
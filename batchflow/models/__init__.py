@@ -1,3 +1,25 @@
 """ Contains models """
+import importlib
+
 from .base import BaseModel
-from .sklearn import SklearnModel
+
+
+# models which need heavy dependencies (e.g. scikit-learn) are imported on the first access
+_LAZY_NAMES = {
+    'sklearn': ['SklearnModel'],
+}
+_MODULES = {name: module for module, names in _LAZY_NAMES.items() for name in names}
+
+
+def __getattr__(name):
+    """ Import a model on the first access (PEP 562) """
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES))
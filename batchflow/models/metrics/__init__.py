@@ -1,5 +1,5 @@
 """ Contains model evaluation metrics """
-from .utils import binarize, sigmoid, get_components, infmean
+from .utils import binarize, sigmoid, get_components, infmean, warm_up
 from .base import Metrics
 from .classify import ClassificationMetrics
 from .segment import SegmentationMetricsByPixels, SegmentationMetricsByInstances
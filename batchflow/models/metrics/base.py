@@ -60,9 +60,13 @@ class Metrics:
 
         res = {}
         for name in _metrics:
-            metric_fn = getattr(self, name)
-            metric_val = metric_fn(*args, **kwargs)
-            res[name] = self._aggregate(metric_val, agg)
+            res[name] = self._evaluate(name, agg, *args, **kwargs)
         res = res[metrics] if isinstance(metrics, str) else res
 
         return res
+
+    def _evaluate(self, name, agg, *args, **kwargs):
+        """ Calculate and aggregate one metric """
+        metric_fn = getattr(self, name)
+        metric_val = metric_fn(*args, **kwargs)
+        return self._aggregate(metric_val, agg)
@@ -1,10 +1,10 @@
 """ Contains two class classification metrics """
+import threading
 from copy import copy
 from functools import partial
 
 import numpy as np
 
-from ...decorators import mjit
 from . import Metrics, binarize, sigmoid, infmean
 
 METRICS_ALIASES = {'sensitivity' : 'true_positive_rate',
@@ -48,6 +48,12 @@ class ClassificationMetrics(Metrics):
         a class axis (default is None)
     threshold : float
         A probability level for binarization (lower values become 0, equal or greater values become 1)
+    streaming : bool
+        whether to keep only a confusion matrix summed over items instead of confusion matrices of all items
+        (see streaming metrics below).
+    item_metrics : str, sequence of str or dict
+        metrics whose per-item values are averaged while streaming, so that they can be evaluated with `agg='mean'`.
+        A dict maps metric names to dicts of their parameters (e.g. ``{'iou': dict(multiclass=None)}``).
 
     Notes
     -----
@@ -101,6 +107,21 @@ class ClassificationMetrics(Metrics):
     - `'macro'` - calculate metrics for each class, and take their mean.
 
 
+    **Streaming metrics**
+
+    By default, :meth:`.update` concatenates confusion matrices of items (e.g. images), so that
+    metrics might be evaluated for each item and then aggregated with `agg`.
+    When metrics are gathered for a large dataset, e.g. with ``save_to=V('metrics', mode='u')``,
+    `streaming=True` keeps memory constant: only a confusion matrix summed over items is stored
+    along with running sums of per-item values of `item_metrics`.
+
+    - Metrics listed in `item_metrics` are evaluated with `agg='mean'` exactly as without streaming,
+      provided that they are evaluated with the same parameters.
+    - Other metrics (as well as any metrics with `agg=None`) are evaluated for all items combined.
+
+    Streaming metrics are merged with :meth:`.update`, which is thread-safe,
+    and they can be pickled to be merged across processes.
+
     Examples
     --------
 
@@ -109,14 +130,21 @@ class ClassificationMetrics(Metrics):
         metrics = ClassificationMetrics(targets, predictions, num_classes=10, fmt='labels')
         metrics.evaluate(['sensitivity', 'specificity'], multiclass='macro')
 
+        pipeline.gather_metrics('masks', targets=B('masks'), predictions=V('predictions'), fmt='proba', axis=-1,
+                                streaming=True, item_metrics='iou', save_to=V('metrics', mode='u'))
+
     """
     def __init__(self, targets, predictions, fmt='proba', num_classes=None, axis=None, threshold=.5,
-                 skip_bg=False, calc=True):
+                 skip_bg=False, calc=True, streaming=False, item_metrics=None):
         super().__init__()
         self.targets = None
         self.predictions = None
         self._confusion_matrix = None
         self.skip_bg = skip_bg
+        self.streaming = streaming
+        self.item_metrics = self._parse_item_metrics(item_metrics)
+        self._item_sums = {}
+        self._lock = threading.Lock() if streaming else None
         self.num_classes = None if axis is None else predictions.shape[axis]
         self.num_classes = self.num_classes or num_classes or 2
         self._agg_fn_dict = {'mean': partial(infmean, axis=0)}
@@ -147,6 +175,8 @@ class ClassificationMetrics(Metrics):
 
         if calc:
             self._calc()
+            if streaming:
+                self._reduce()
 
     def __getattr__(self, name):
         if name == "METRICS_ALIASES":
@@ -185,19 +215,80 @@ class ClassificationMetrics(Metrics):
         self.targets = None
         self.predictions = None
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.streaming:
+            self._lock = threading.Lock()
+
     def append(self, metrics):
         """ Append confusion matrix with data from another metrics"""
         # pylint: disable=protected-access
-        self._confusion_matrix = np.concatenate((self._confusion_matrix, metrics._confusion_matrix), axis=0)
+        if self.streaming:
+            self._merge(metrics)
+        else:
+            self._confusion_matrix = np.concatenate((self._confusion_matrix, metrics._confusion_matrix), axis=0)
 
     def update(self, metrics):
         """ Update confusion matrix with data from another metrics"""
         # pylint: disable=protected-access
-        if self._no_zero_axis:
+        if self.streaming:
+            self._merge(metrics)
+        elif self._no_zero_axis:
             self._confusion_matrix = self._confusion_matrix + metrics._confusion_matrix
         else:
             self._confusion_matrix = np.concatenate((self._confusion_matrix, metrics._confusion_matrix), axis=0)
 
+    @staticmethod
+    def _parse_item_metrics(item_metrics):
+        if item_metrics is None:
+            return []
+        if isinstance(item_metrics, str):
+            item_metrics = [item_metrics]
+        if not isinstance(item_metrics, dict):
+            item_metrics = {name: {} for name in item_metrics}
+        return list(item_metrics.items())
+
+    @staticmethod
+    def _item_key(name, args, kwargs):
+        return repr((METRICS_ALIASES.get(name, name), args, sorted(kwargs.items())))
+
+    def _reduce(self):
+        """ Sum the confusion matrix and per-item values of `item_metrics` over items """
+        for name, kwargs in self.item_metrics:
+            values = np.asarray(getattr(self, name)(**kwargs), dtype=np.float64)
+            values = values.reshape(-1, *values.shape[1:]) if values.ndim > 0 else values.reshape(1)
+            # the same as `infmean`: infs and nans are not averaged
+            finite = np.isfinite(values)
+            self._item_sums[self._item_key(name, (), kwargs)] = (np.where(finite, values, 0).sum(axis=0),
+                                                                 finite.sum(axis=0))
+        self._confusion_matrix = self._confusion_matrix.sum(axis=0, keepdims=True)
+        self.free()
+
+    def _merge(self, metrics):
+        """ Add aggregates of other streaming metrics """
+        # pylint: disable=protected-access
+        if not metrics.streaming:
+            raise ValueError("Only streaming metrics can be merged into streaming metrics")
+        if self._item_sums.keys() != metrics._item_sums.keys():
+            raise ValueError("Streaming metrics should have the same item metrics")
+        with self._lock:
+            self._confusion_matrix = self._confusion_matrix + metrics._confusion_matrix
+            self._item_sums = {key: (total + metrics._item_sums[key][0], count + metrics._item_sums[key][1])
+                               for key, (total, count) in self._item_sums.items()}
+
+    def _evaluate(self, name, agg, *args, **kwargs):
+        item_sums = self._item_sums.get(self._item_key(name, args, kwargs)) if agg == 'mean' else None
+        if item_sums is None:
+            return super()._evaluate(name, agg, *args, **kwargs)
+        total, count = item_sums
+        metric_val = np.divide(total, count, out=np.full(np.shape(total), np.inf), where=count > 0)
+        return self._aggregate(metric_val)
+
     def __getitem__(self, item):
         # pylint: disable=protected-access
         metrics = self.copy()
@@ -205,18 +296,24 @@ class ClassificationMetrics(Metrics):
         return metrics
 
     def _calc(self):
-        self._confusion_matrix = np.zeros((self.targets.shape[0], self.num_classes, self.num_classes), dtype=np.intp)
-        return self._calc_confusion_jit(self.targets, self.predictions, self.num_classes, self._confusion_matrix)
-
-    @mjit
-    def _calc_confusion_jit(self, targets, predictions, num_classes, confusion):
-        for i in range(targets.shape[0]):
-            targ = targets[i].flatten()
-            pred = predictions[i].flatten()
-            for t in range(num_classes):
-                coords = np.where(targ == t)
-                for c in pred[coords]:
-                    confusion[i, c, t] += 1
+        """ Count items' pixels of each pair of a predicted class and a target class at once """
+        num_items, num_classes = self.targets.shape[0], self.num_classes
+        targets = self.targets.reshape(num_items, -1).astype(np.intp)
+        predictions = self.predictions.reshape(num_items, -1).astype(np.intp)
+        if predictions.size > 0 and (predictions.min() < 0 or predictions.max() >= num_classes):
+            raise ValueError("Predicted labels should be in range [0, %d)" % num_classes)
+
+        # only a summed matrix is needed when there are no per-item metrics to stream
+        per_item = not self.streaming or self.item_metrics
+        bins = predictions * num_classes + targets
+        if per_item:
+            bins += np.arange(num_items).reshape(-1, 1) * num_classes ** 2
+        # pixels with targets out of classes (e.g. an ignore label) are not counted
+        if targets.size > 0 and (targets.min() < 0 or targets.max() >= num_classes):
+            bins = bins[(targets >= 0) & (targets < num_classes)]
+        num_matrices = num_items if per_item else 1
+        confusion = np.bincount(bins.ravel(), minlength=num_matrices * num_classes ** 2)
+        self._confusion_matrix = confusion.reshape((num_matrices, num_classes, num_classes))
 
     def _return(self, value):
         return value[0] if isinstance(value, np.ndarray) and value.shape == (1, ) else value
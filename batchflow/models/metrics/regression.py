@@ -1,7 +1,10 @@
 """ Contains regression metrics """
+import threading
+
 import numpy as np
 
 from . import Metrics
+from .streaming import RunningMoments, QuantileSketch
 
 METRICS_ALIASES = {'mae': 'mean_absolute_error',
                    'mse': 'mean_squared_error',
@@ -39,6 +42,9 @@ class RegressionMetrics(Metrics):
     gap : float
         Max difference between target and prediction for sample to be considered as properly classified (default is 3).
 
+    streaming : bool
+        Whether to keep only running statistics instead of all targets and predictions (default is False).
+
     Notes
     -----
     - For all the metrics, except max error, accuracy and median absolute error, you can compute sample-wise weighting.
@@ -52,6 +58,16 @@ class RegressionMetrics(Metrics):
     - `None` - no averaging, calculate metrics for each output individually
     - `mean` - calculate metrics for each output, and take their mean.
 
+    Metrics for more data are added with :meth:`.update`, e.g. by ``gather_metrics(..., save_to=V('m', mode='u'))``.
+    With `streaming=True` memory does not depend on the number of samples:
+
+    - mae, mse, rmse, r2_score and explained_variance_ratio are calculated exactly from running weighted moments,
+    - max error is exact as well,
+    - median absolute error and accuracy are estimated with a quantile sketch of absolute errors
+      (they are exact until the sketch is compressed, i.e. for a few thousands of samples).
+
+    Streaming metrics of different threads or processes can be merged with :meth:`.update`.
+
     Examples
     --------
     ::
@@ -60,6 +76,9 @@ class RegressionMetrics(Metrics):
         metrics.evaluate('mae', agg='mean')
         metrics.evaluate(['accuracy', 'mse'], agg=None)
 
+        metrics = RegressionMetrics(targets, predictions, streaming=True)
+        metrics.update(more_targets, more_predictions)
+
     **Metrics**
     All metrics return:
 
@@ -68,9 +87,42 @@ class RegressionMetrics(Metrics):
     - a vector with (n_outputs, ) items if targets are multioutput and `agg` set to `None`
     """
 
-    def __init__(self, targets, predictions, weights=None, multi=False):
+    def __init__(self, targets, predictions, weights=None, multi=False, streaming=False):
         super().__init__()
+        self.multi = multi
+        self.streaming = streaming
+
+        self.targets, self.predictions, self.weights = self._to_arrays(targets, predictions, weights)
+        self._agg_fn_dict.update(mean=np.mean)
+
+        self._lock = None
+        if streaming:
+            self._lock = threading.Lock()
+            self._targets = RunningMoments()
+            self._errors = RunningMoments()
+            self._abs_errors = RunningMoments()
+            self._max_errors = None
+            self._sketches = None
+            self._add(self.targets, self.predictions, self.weights)
+            self.targets = self.predictions = self.weights = None
+
+    def __getattr__(self, name):
+        if name == "METRICS_ALIASES":
+            raise AttributeError # See https://nedbatchelder.com/blog/201010/surprising_getattr_recursion.html
+        name = METRICS_ALIASES.get(name, name)
+        return object.__getattribute__(self, name)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.streaming:
+            self._lock = threading.Lock()
+
+    def _to_arrays(self, targets, predictions, weights):
         # if-else block bellow processes the case when the inputs and targets are list
         # of arrays-like. That's happening when we accumulate targets and predictions in the pipeline
         # via `.update(V('targets', mode='a'), value)`.
@@ -81,40 +133,94 @@ class RegressionMetrics(Metrics):
         # and has the same structure [[], [], ..].
         # In the first case concatenating such arrays does not make any sense. To separate such cases we introduce
         # 'multi' argument.
-
-        if np.ndim(targets) == 0 or (np.ndim(targets) == 1 and multi):
-            self.targets = np.array([targets])
-            self.predictions = np.array([predictions])
-        elif np.ndim(targets) == 1 or (np.ndim(targets) == 2 and multi):
-            self.targets = np.array(targets)
-            self.predictions = np.array(predictions)
+        if np.ndim(targets) == 0 or (np.ndim(targets) == 1 and self.multi):
+            targets = np.array([targets])
+            predictions = np.array([predictions])
+        elif np.ndim(targets) == 1 or (np.ndim(targets) == 2 and self.multi):
+            targets = np.array(targets)
+            predictions = np.array(predictions)
         else:
-            self.targets = np.concatenate(targets, axis=0)
-            self.predictions = np.concatenate(predictions, axis=0)
+            targets = np.concatenate(targets, axis=0)
+            predictions = np.concatenate(predictions, axis=0)
 
         if weights is not None:
-            self.weights = np.array(weights).flatten()
+            weights = np.array(weights).flatten()
+        return targets, predictions, weights
+
+    def _add(self, targets, predictions, weights):
+        """ Add samples to running statistics """
+        errors = predictions - targets
+        abs_errors = np.abs(errors)
+        self._targets.add(targets, weights)
+        self._errors.add(errors, weights)
+        self._abs_errors.add(abs_errors, weights)
+
+        max_errors = abs_errors.max(axis=0)
+        self._max_errors = max_errors if self._max_errors is None else np.maximum(self._max_errors, max_errors)
+        if self._sketches is None:
+            self._sketches = [QuantileSketch() for _ in range(abs_errors[0].size)]
+        for sketch, values in zip(self._sketches, abs_errors.reshape(len(abs_errors), -1).T):
+            sketch.add(values)
+
+    def update(self, *args, **kwargs):
+        """ Add samples from other metrics or new targets and predictions
+
+        Parameters
+        ----------
+        args, kwargs
+            either another :class:`.RegressionMetrics`
+            or `targets`, `predictions` and, optionally, `weights` as in :class:`.RegressionMetrics`.
+        """
+        if len(args) == 1 and not kwargs and isinstance(args[0], RegressionMetrics):
+            metrics = args[0]
         else:
-            self.weights = None
+            metrics = RegressionMetrics(*args, **kwargs, multi=self.multi, streaming=self.streaming)
+
+        # pylint: disable=protected-access
+        if metrics.streaming != self.streaming:
+            raise ValueError("Streaming metrics can be merged only with streaming metrics")
+        if self.streaming:
+            with self._lock:
+                self._targets.merge(metrics._targets)
+                self._errors.merge(metrics._errors)
+                self._abs_errors.merge(metrics._abs_errors)
+                self._max_errors = np.maximum(self._max_errors, metrics._max_errors)
+                for sketch, other in zip(self._sketches, metrics._sketches):
+                    sketch.merge(other)
+        else:
+            self.targets = np.concatenate([self.targets, metrics.targets], axis=0)
+            self.predictions = np.concatenate([self.predictions, metrics.predictions], axis=0)
+            if (self.weights is None) != (metrics.weights is None):
+                raise ValueError("Either all or none of samples should have weights")
+            if self.weights is not None:
+                self.weights = np.concatenate([self.weights, metrics.weights])
 
-        self._agg_fn_dict.update(mean=lambda x: np.mean(x))
-
-    def __getattr__(self, name):
-        if name == "METRICS_ALIASES":
-            raise AttributeError # See https://nedbatchelder.com/blog/201010/surprising_getattr_recursion.html
-        name = METRICS_ALIASES.get(name, name)
-        return object.__getattribute__(self, name)
+    def _quantiles(self, method, *args):
+        values = [getattr(sketch, method)(*args) for sketch in self._sketches]
+        return np.array(values).reshape(np.shape(self._max_errors))
 
     def mean_absolute_error(self):
+        # pylint: disable=missing-docstring
+        if self.streaming:
+            return self._abs_errors.mean
         return np.average(np.abs(self.predictions - self.targets), axis=0, weights=self.weights)
 
     def mean_squared_error(self):
+        # pylint: disable=missing-docstring
+        if self.streaming:
+            return self._errors.variance + self._errors.mean ** 2
         return np.average((self.predictions - self.targets) ** 2, axis=0, weights=self.weights)
 
     def median_absolute_error(self):
+        # pylint: disable=missing-docstring
+        if self.streaming:
+            return self._quantiles('quantile', .5)
         return np.median(np.abs(self.predictions - self.targets), axis=0)
 
     def max_error(self):
+        # pylint: disable=missing-docstring
+        if self.streaming:
+            return self._max_errors
         return np.max(np.abs(self.predictions - self.targets), axis=0)
 
     def root_mean_squared_error(self):
@@ -122,6 +228,8 @@ class RegressionMetrics(Metrics):
 
     def r2_score(self):
         # pylint: disable=missing-docstring
+        if self.streaming:
+            return 1 - (self._errors.m2 + self._errors.weight * self._errors.mean ** 2) / self._targets.m2
         if self.weights is not None:
             weight = self.weights[:, np.newaxis]
         else:
@@ -134,6 +242,8 @@ class RegressionMetrics(Metrics):
 
     def explained_variance_ratio(self):
         # pylint: disable=missing-docstring
+        if self.streaming:
+            return 1 - self._errors.m2 / self._targets.m2
         diff_avg = np.average(self.predictions - self.targets, axis=0, weights=self.weights)
         numerator = np.average((self.predictions - self.targets - diff_avg) ** 2, axis=0, weights=self.weights)
 
@@ -150,5 +260,7 @@ class RegressionMetrics(Metrics):
          gap : int, default 3
             The maximum difference between pred and true values to classify sample as correct.
          """
+        if self.streaming:
+            return self._quantiles('cdf', gap)
         return (np.abs(self.predictions - self.targets) < gap).sum(axis=0) / self.targets.shape[0]
     
\ No newline at end of file
@@ -1,6 +1,10 @@
 """ Contains metrics for segmentation """
+import os
+
 import numpy as np
+import scipy.ndimage
 
+from ...decorators import worker_pools
 from . import ClassificationMetrics, get_components
 
 
@@ -58,22 +62,30 @@ class SegmentationMetricsByInstances(ClassificationMetrics):
     -----
     For other parameters see :class:`~.ClassificationMetrics`.
 
+    Instances of each item are matched in parallel threads. Overlaps of all instances of a class
+    with the other mask are counted at once with `np.bincount` over instance labels of pixels.
+
     """
     def __init__(self, targets, predictions, fmt='proba', num_classes=None, axis=None,
-                 skip_bg=True, threshold=.5, iot=.5, calc=True):
-        super().__init__(targets, predictions, fmt, num_classes, axis, threshold, skip_bg, calc=False)
+                 skip_bg=True, threshold=.5, iot=.5, calc=True, streaming=False, item_metrics=None):
+        super().__init__(targets, predictions, fmt, num_classes, axis, threshold, skip_bg, calc=False,
+                         streaming=streaming, item_metrics=item_metrics)
 
         self.iot = iot
-        self.target_instances = self._get_instances(self.targets)
-        self.predicted_instances = self._get_instances(self.predictions)
         if calc:
             self._calc()
+            if streaming:
+                self._reduce()
+
+    @property
+    def target_instances(self):
+        """ nested list with coords of target instances (see :meth:`._get_instances`) """
+        return self._get_instances(self.targets) if self.targets is not None else None
 
-    def free(self):
-        """ Free memory allocated for intermediate data """
-        super().free()
-        self.target_instances = None
-        self.predicted_instances = None
+    @property
+    def predicted_instances(self):
+        """ nested list with coords of predicted instances (see :meth:`._get_instances`) """
+        return self._get_instances(self.predictions) if self.predictions is not None else None
 
     def _get_instances(self, inputs):
         """ Find instances of each class within inputs
@@ -103,25 +115,41 @@ class SegmentationMetricsByInstances(ClassificationMetrics):
         return instances
 
     def _calc(self):
-        self._confusion_matrix = np.zeros((self.targets.shape[0], self.num_classes - 1, 2, 2), dtype=np.intp)
-
-        for k in range(1, self.num_classes):
-            for i, item_instances in enumerate(self.target_instances[k-1]):
-                for coords in item_instances:
-                    targ = len(coords[0])
-                    pred = np.sum(self.predictions[i][coords] == k)
-                    if np.sum(pred) / targ >= self.iot:
-                        self._confusion_matrix[i, k-1, 1, 1] += 1
-                    else:
-                        self._confusion_matrix[i, k-1, 0, 1] += 1
-
+        num_items = self.targets.shape[0]
+        self._confusion_matrix = np.zeros((num_items, self.num_classes - 1, 2, 2), dtype=np.intp)
+        if num_items > 1:
+            with worker_pools.use('threads', min(num_items, os.cpu_count() or 1)) as executor:
+                list(executor.map(self._calc_item, range(num_items)))
+        elif num_items == 1:
+            self._calc_item(0)
+
+    def _calc_item(self, i):
+        """ Count matched target instances (true positives), unmatched target instances (false negatives)
+        and unmatched predicted instances (false positives) of each class for one item """
         for k in range(1, self.num_classes):
-            for i, item_instances in enumerate(self.predicted_instances[k-1]):
-                for coords in item_instances:
-                    pred = len(coords[0])
-                    targ = np.sum(self.targets[i][coords] == k)
-                    if targ == 0 or pred / targ < self.iot:
-                        self._confusion_matrix[i, k-1, 1, 0] += 1
+            targets, predictions = self.targets[i] == k, self.predictions[i] == k
+            if self.num_classes == 2:
+                # as in `_get_instances`, instances of a binary mask are its non-zero components
+                target_labels, num_targets = scipy.ndimage.label(self.targets[i])
+                predicted_labels, num_predicted = scipy.ndimage.label(self.predictions[i])
+            else:
+                target_labels, num_targets = scipy.ndimage.label(targets)
+                predicted_labels, num_predicted = scipy.ndimage.label(predictions)
+
+            # sizes of instances and the number of their pixels which are of the same class in the other mask
+            target_sizes = np.bincount(target_labels.ravel(), minlength=num_targets + 1)[1:]
+            target_hits = np.bincount(target_labels[predictions], minlength=num_targets + 1)[1:]
+            predicted_sizes = np.bincount(predicted_labels.ravel(), minlength=num_predicted + 1)[1:]
+            predicted_hits = np.bincount(predicted_labels[targets], minlength=num_predicted + 1)[1:]
+
+            true_positive = np.count_nonzero(target_hits / target_sizes >= self.iot)
+            ratios = np.divide(predicted_sizes, predicted_hits, out=np.zeros(num_predicted),
+                               where=predicted_hits > 0)
+            false_positive = np.count_nonzero((predicted_hits == 0) | (ratios < self.iot))
+
+            self._confusion_matrix[i, k-1, 1, 1] = true_positive
+            self._confusion_matrix[i, k-1, 0, 1] = num_targets - true_positive
+            self._confusion_matrix[i, k-1, 1, 0] = false_positive
 
     def true_positive(self, label=None, *args, **kwargs):
         _ = args, kwargs
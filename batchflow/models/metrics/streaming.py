@@ -0,0 +1,147 @@
+""" Contains mergeable running statistics for streaming metrics """
+import numpy as np
+
+
+class RunningMoments:
+    """ Weighted running mean and sum of squared deviations of values
+
+    Batches are combined with the parallel variant of Welford's algorithm (Chan et al.),
+    so that moments of any number of samples are kept in constant memory
+    and accumulators of different threads or processes can be merged.
+
+    Attributes
+    ----------
+    weight : float
+        a total weight of samples.
+    mean : np.ndarray
+        a weighted mean of samples.
+    m2 : np.ndarray
+        a weighted sum of squared deviations of samples from their mean.
+    """
+    def __init__(self):
+        self.weight = 0.
+        self.mean = 0.
+        self.m2 = 0.
+
+    def add(self, values, weights=None):
+        """ Add samples (along the first axis) with optional sample weights """
+        values = np.asarray(values, dtype=np.float64)
+        if weights is None:
+            weight = float(len(values))
+            mean = values.mean(axis=0)
+            m2 = ((values - mean) ** 2).sum(axis=0)
+        else:
+            weights = np.asarray(weights, dtype=np.float64).reshape(-1, *[1] * (values.ndim - 1))
+            weight = float(weights.sum())
+            mean = (weights * values).sum(axis=0) / weight
+            m2 = (weights * (values - mean) ** 2).sum(axis=0)
+        self._combine(weight, mean, m2)
+
+    def merge(self, other):
+        """ Add moments of another accumulator """
+        self._combine(other.weight, other.mean, other.m2)
+
+    def _combine(self, weight, mean, m2):
+        total = self.weight + weight
+        if total == 0:
+            return
+        delta = mean - self.mean
+        self.mean = self.mean + delta * weight / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.weight * weight / total
+        self.weight = total
+
+    @property
+    def variance(self):
+        """ np.ndarray : a weighted variance of samples """
+        return self.m2 / self.weight
+
+
+class QuantileSketch:
+    """ A mergeable sketch of a distribution of values to estimate its quantiles (a merging t-digest)
+
+    Values are kept as centroids (means and counts) which are small at tails and large in the middle
+    of the distribution, so that extreme quantiles are accurate, while the number of centroids
+    does not exceed `compression`. Until values are compressed quantiles are exact.
+
+    Parameters
+    ----------
+    compression : int
+        the maximum number of centroids.
+    buffer_size : int
+        the number of values which are added before centroids are compressed (default is `10 * compression`).
+    """
+    def __init__(self, compression=200, buffer_size=None):
+        self.compression = compression
+        self.buffer_size = buffer_size or 10 * compression
+        self.means = np.empty(0)
+        self.counts = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+        self._buffer = []
+        self._buffered = 0
+
+    @property
+    def count(self):
+        """ float : the number of values """
+        self._flush()
+        return self.counts.sum()
+
+    def add(self, values):
+        """ Add values """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._buffer.append(values)
+        self._buffered += values.size
+        if self._buffered > self.buffer_size:
+            self._flush()
+
+    def merge(self, other):
+        """ Add values of another sketch """
+        other._flush()                  # pylint: disable=protected-access
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(np.concatenate([self.means, other.means, *self._buffer]),
+                       np.concatenate([self.counts, other.counts, np.ones(self._buffered)]))
+        self._buffer, self._buffered = [], 0
+
+    def _flush(self):
+        if self._buffered > 0:
+            self._compress(np.concatenate([self.means, *self._buffer]),
+                           np.concatenate([self.counts, np.ones(self._buffered)]))
+            self._buffer, self._buffered = [], 0
+
+    def _compress(self, means, counts):
+        order = np.argsort(means, kind='stable')
+        means, counts = means[order], counts[order]
+        if len(means) > self.compression:
+            # adjacent centroids are merged if they fall into the same unit of the scale function
+            # k(q) = compression / pi * arcsin(2q - 1), which has more units at tails
+            cumulative = np.cumsum(counts)
+            quantiles = (cumulative - counts / 2) / cumulative[-1]
+            units = np.floor(self.compression / np.pi * np.arcsin(2 * quantiles - 1))
+            starts = np.flatnonzero(np.diff(units, prepend=np.nan) != 0)
+            merged_counts = np.add.reduceat(counts, starts)
+            means = np.add.reduceat(means * counts, starts) / merged_counts
+            counts = merged_counts
+        self.means, self.counts = means, counts
+
+    def quantile(self, q):
+        """ Return an estimate of a quantile of values (with linear interpolation as `np.quantile` does) """
+        self._flush()
+        if len(self.means) == 0:
+            return np.nan
+        # centroids are placed at the middle of their ranks and interpolated in between
+        ranks = np.cumsum(self.counts) - (self.counts + 1) / 2
+        ranks = np.concatenate([[0], ranks, [self.counts.sum() - 1]])
+        means = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(q * (self.counts.sum() - 1), ranks, means)
+
+    def cdf(self, value):
+        """ Return an estimate of a share of values which are less than `value` """
+        self._flush()
+        if len(self.means) == 0:
+            return np.nan
+        return self.counts[self.means < value].sum() / self.counts.sum()
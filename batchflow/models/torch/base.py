@@ -18,7 +18,7 @@ from .utils import unpack_fn_from_config, get_shape
 from .layers import ConvBlock
 from .losses import CrossEntropyLoss, binary as binary_losses, multiclass as multiclass_losses
 from ..base import BaseModel
-from ... import Config
+from ...config import Config
 
 
 
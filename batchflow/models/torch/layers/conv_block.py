@@ -14,7 +14,7 @@ from .resize import IncreaseDim, Reshape, Interpolate, SubPixelConv, Combine
 from .attention import SelfAttention
 from ..utils import get_shape
 from ...utils import unpack_args
-from .... import Config
+from ....config import Config
 
 
 logger = logging.getLogger(__name__)
@@ -4,6 +4,8 @@ from functools import partial
 
 import numpy as np
 
+from .rng import RandomStreams, random_streams, get_method
+
 
 class _DummyBatch:
     """ A fake batch for static models """
@@ -37,6 +39,132 @@ def eval_expr(expr, **kwargs):
     return expr
 
 
+def has_named_expr(expr):
+    """ Check whether an expression contains named expressions (so :func:`eval_expr` is needed) """
+    if isinstance(expr, NamedExpression):
+        return True
+    if isinstance(expr, (list, tuple)):
+        return any(has_named_expr(val) for val in expr)
+    if isinstance(expr, dict):
+        return any(has_named_expr(key) or has_named_expr(val) for key, val in expr.items())
+    return False
+
+
+# how long a value of an expression stays the same
+STATIC, PER_RUN, PER_BATCH, PER_ITEM = range(4)
+
+
+def expr_level(expr, config=None):
+    """ Return how long a value of an expression stays the same
+
+    Parameters
+    ----------
+    expr
+        an expression which might contain named expressions inside lists, tuples and dicts.
+    config : Config or None
+        a pipeline config to check whether config options are named expressions too.
+
+    Returns
+    -------
+    int
+        one of
+
+        - `STATIC` - there are no named expressions at all
+        - `PER_RUN` - the value does not change during a pipeline run (e.g. ``C('batch_size')``)
+        - `PER_BATCH` - the value is different for each batch (e.g. ``B('size')``, ``V('loss')``, ``R('normal')``)
+        - `PER_ITEM` - the value is different for each batch item (``P(...)``)
+    """
+    if isinstance(expr, NamedExpression):
+        return expr.get_level(config)
+    if isinstance(expr, (list, tuple)):
+        return max((expr_level(val, config) for val in expr), default=STATIC)
+    if isinstance(expr, dict):
+        return max((max(expr_level(key, config), expr_level(val, config)) for key, val in expr.items()),
+                   default=STATIC)
+    return STATIC
+
+
+def compile_expr(expr, cache=None, config=None):
+    """ Return a function which evaluates an expression in the same way as :func:`eval_expr`
+
+    The expression tree is analysed only once, so its parts without named expressions are returned as is
+    instead of being walked and rebuilt on every call.
+
+    Parameters
+    ----------
+    expr
+        an expression which might contain named expressions inside lists, tuples and dicts.
+    cache : dict or None
+        if given, values of subexpressions which do not change during a pipeline run (see :func:`expr_level`)
+        are evaluated once and stored in `cache`. Clear it when the run is over or the config is changed.
+    config : Config or None
+        a pipeline config.
+
+    Returns
+    -------
+    callable
+        a function which takes the same keyword arguments as :func:`eval_expr` (e.g. `batch` and `pipeline`).
+
+    Examples
+    --------
+    >>> evaluate = compile_expr(dict(size=C('size'), images=B('images'), shape=(10, 10)), cache={})
+    >>> evaluate(batch=batch, pipeline=pipeline)
+    """
+    level = expr_level(expr, config)
+    if level == STATIC:
+        return lambda **kwargs: expr
+    if level == PER_RUN and cache is not None:
+        return partial(_eval_cached, expr, cache)
+    if isinstance(expr, AlgebraicNamedExpression):
+        return _compile_algebraic(expr, cache, config)
+    if isinstance(expr, NamedExpression):
+        return partial(eval_expr, expr)
+    if isinstance(expr, (list, tuple)):
+        items = [compile_expr(val, cache, config) for val in expr]
+        return lambda **kwargs: type(expr)([item(**kwargs) for item in items])
+
+    items = [(compile_expr(key, cache, config), compile_expr(val, cache, config)) for key, val in expr.items()]
+    def _eval_dict(**kwargs):
+        _expr = type(expr)()
+        for key, val in items:
+            _expr.update({key(**kwargs): val(**kwargs)})
+        return _expr
+    return _eval_dict
+
+
+def _compile_algebraic(expr, cache, config):
+    op = OPERATIONS[expr.op]
+    a, b, c = [compile_expr(arg, cache, config) for arg in (expr.a, expr.b, expr.c)]
+    if expr.op in UNARY_OPS:
+        return lambda **kwargs: op(a(**kwargs))
+    if expr.op in BINARY_OPS:
+        return lambda **kwargs: op(a(**kwargs), b(**kwargs))
+    return lambda **kwargs: op(a(**kwargs), b(**kwargs), c(**kwargs))
+
+
+_MISSING = object()
+
+def _eval_cached(expr, cache, **kwargs):
+    # the cache might be cleared by another thread (e.g. when a config is changed), so it is read once
+    key = id(expr)
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = cache[key] = eval_expr(expr, **kwargs)
+    return value
+
+
+def _has_random(expr):
+    if isinstance(expr, R):
+        return True
+    if isinstance(expr, NamedExpression):
+        return any(_has_random(value) for value in expr.__dict__.values())
+    if isinstance(expr, (list, tuple)):
+        return any(_has_random(value) for value in expr)
+    if isinstance(expr, dict):
+        return any(_has_random(key) or _has_random(value) for key, value in expr.items())
+    return False
+
+
 def swap(op):
     """ Swap args """
     def _op_(a, b):
@@ -126,6 +254,7 @@ class NamedExpression(metaclass=MetaNamedExpression):
 
     """
     __slots__ = ('__dict__', )
+    level = PER_BATCH
 
     def __init__(self, name=None, mode='w'):
         self.name = name
@@ -174,6 +303,10 @@ class NamedExpression(metaclass=MetaNamedExpression):
     def set_params(self, **kwargs):
         self.params = kwargs
 
+    def get_level(self, config=None):
+        """ Return how long a value of the expression stays the same (see :func:`expr_level`) """
+        return max(self.level, expr_level(self.name, config))
+
     def _get_name(self, **kwargs):
         if isinstance(self.name, NamedExpression):
             return self.name.get(**kwargs)
@@ -289,6 +422,8 @@ class NamedExpression(metaclass=MetaNamedExpression):
 
 class AlgebraicNamedExpression(NamedExpression):
     """ Algebraic expression over named expressions """
+    level = PER_RUN
+
     def __init__(self, op=None, a=None, b=None, c=None):
         super().__init__(AN_EXPR, mode='w')
         self.op = op
@@ -296,6 +431,9 @@ class AlgebraicNamedExpression(NamedExpression):
         self.b = b
         self.c = c
 
+    def get_level(self, config=None):
+        return max(self.level, *[expr_level(arg, config) for arg in (self.a, self.b, self.c)])
+
     def get(self, **kwargs):
         """ Return a value of an algebraic expression """
         a = eval_expr(self.a, **kwargs)
@@ -373,12 +511,32 @@ class C(PipelineNamedExpression):
         C('model_class', default=ResNet)
         C('GPU')
         C()
+
+    Notes
+    -----
+    During a pipeline run a config option is read only once (see :func:`compile_expr`),
+    so the config should be changed with :meth:`~.Pipeline.set_config` or by assigning to ``C(...)``,
+    rather than by modifying `pipeline.config` directly.
     """
+    level = PER_RUN
+
     def __init__(self, name=None, mode='w', **kwargs):
         super().__init__(name, mode)
         self._has_default = 'default' in kwargs
         self.default = kwargs.get('default')
 
+    def get_level(self, config=None):
+        level = max(super().get_level(config), expr_level(self.default, config))
+        if config is not None and isinstance(self.name, str):
+            # a config option might be a named expression itself
+            try:
+                value = config[self.name]
+            except KeyError:
+                value = None
+            if isinstance(value, NamedExpression):
+                level = max(level, value.get_level(config))
+        return level
+
     def get(self, **kwargs):
         """ Return a value of a pipeline config """
         name, pipeline, _ = self._get(**kwargs)
@@ -400,6 +558,7 @@ class C(PipelineNamedExpression):
         name, pipeline, _ = self._get(**kwargs)
         config = pipeline.config or {}
         config[name] = value
+        pipeline._clear_expr_cache()       # pylint:disable=protected-access
 
 
 class V(PipelineNamedExpression):
@@ -599,36 +758,129 @@ class R(NamedExpression):
         R('normal', 0, 1)
         R('poisson', lam=5.5, seed=42, size=3)
         R(['metro', 'taxi', 'bike'], p=[.6, .1, .3], size=10)
+
+    When wrapped with ``P``, values for all batch items are drawn at once (see :meth:`.get_items`).
+
+    Values are drawn from a random stream of the batch (see :attr:`.Batch.random`), so they are reproducible
+    when a pipeline seed is given. If `seed` is given, each batch gets its own stream spawned from it,
+    while outside of a pipeline values come from one stream. If `state` is given, it is used as is.
     """
+    # methods which do not take `size` or cannot get per-item parameters as arrays
+    _NOT_SIZED = ('permutation', 'shuffle', 'bytes')
+    _NOT_BROADCASTED = ('choice', 'dirichlet', 'multinomial', 'multivariate_normal')
+
     def __init__(self, name, *args, state=None, seed=None, size=None, **kwargs):
         super().__init__(name)
-        if isinstance(state, np.random.RandomState):
-            self.random_state = state
-        else:
-            self.random_state = np.random.RandomState(seed)
+        self.random_state = state
+        self.streams = RandomStreams(seed) if seed is not None else None
+        self._rng = self.streams.get() if seed is not None else None
         self.args = args
         self.kwargs = kwargs
         self.size = size
 
-    def get(self, **kwargs):
-        """ Return a value of a random variable """
-        name, kwargs = self._get(**kwargs)
-        args = self.args
+    def _get_rng(self, batch):
+        if self.random_state is not None:
+            return self.random_state
+        if getattr(batch, 'random_key', None) is not None:
+            return batch.get_random_stream(self.streams)
+        if self._rng is not None:
+            return self._rng
+        return random_streams.local
 
+    def _get_method(self, name, batch=None):
+        args = self.args
         if not isinstance(name, str):
             args = (name,) + args
             name = 'choice'
-        if isinstance(name, str) and hasattr(self.random_state, name):
-            name = getattr(self.random_state, name)
-        else:
-            raise TypeError('An expression should be an int, an iterable or a numpy distribution name')
+        method = get_method(self._get_rng(batch), name)
+        if method is not None:
+            return method, method.__name__, args
+        raise TypeError('An expression should be an int, an iterable or a numpy distribution name')
+
+    def get(self, **kwargs):
+        """ Return a value of a random variable """
+        name, kwargs = self._get(**kwargs)
+        method, _, args = self._get_method(name, kwargs['batch'])
 
         args = eval_expr(args, **kwargs)
         if self.size is not None:
             self.kwargs['size'] = self.size
         kwargs = eval_expr(self.kwargs, **kwargs)
 
-        return name(*args, **kwargs)
+        return method(*args, **kwargs)
+
+    def get_items(self, n_items, **kwargs):
+        """ Return values of a random variable for each of `n_items` items (e.g. batch items)
+
+        Instead of `n_items` calls, all values are drawn with one call with ``size=(n_items, *size)``.
+        Random arguments and a random `size` (``R('normal', R('uniform', 0, 1), size=R('randint', 3, 8))``)
+        get their own value for each item as well.
+
+        Returns
+        -------
+        np.ndarray
+            an array of `n_items` values, or an object array of arrays if items have different sizes.
+        """
+        name, kwargs = self._get(**kwargs)
+        method, method_name, args = self._get_method(name, kwargs['batch'])
+        params = {key: value for key, value in self.kwargs.items() if key != 'size'}
+
+        per_item = any(isinstance(value, R) for value in (*args, *params.values()))
+        if not self._can_vectorize(method_name, args, params, per_item):
+            return self._get_items_one_by_one(n_items, **kwargs)
+
+        size, sizes = None, None
+        if isinstance(self.size, R):
+            sizes = self.size.get_items(n_items, **kwargs)
+            if sizes.ndim != 1 or sizes.dtype.kind not in 'iu':
+                return self._get_items_one_by_one(n_items, **kwargs)
+            if (sizes == sizes[0]).all():
+                size, sizes = int(sizes[0]), None
+        else:
+            size = eval_expr(self.size, **kwargs)
+
+        if sizes is not None:
+            if per_item:
+                return self._get_items_one_by_one(n_items, **kwargs)
+            # items of different sizes are drawn at once and split afterwards
+            args = eval_expr(args, **kwargs)
+            params = eval_expr(params, **kwargs)
+            values = method(*args, size=int(sizes.sum()), **params)
+            items = np.empty(n_items, dtype=object)
+            for i, item in enumerate(np.split(values, np.cumsum(sizes)[:-1])):
+                items[i] = item
+            return items
+
+        item_shape = () if size is None else tuple(np.atleast_1d(size))
+        # per-item parameters should broadcast against values
+        param_shape = (n_items,) + (1,) * len(item_shape)
+
+        def _eval_param(value):
+            if isinstance(value, R):
+                return value.get_items(n_items, **kwargs).reshape(param_shape)
+            return eval_expr(value, **kwargs)
+
+        args = [_eval_param(value) for value in args]
+        params = {key: _eval_param(value) for key, value in params.items()}
+        return method(*args, size=(n_items,) + item_shape, **params)
+
+    def _can_vectorize(self, method_name, args, params, per_item):
+        """ Check whether values for all items could be drawn with one call of a method """
+        if method_name in self._NOT_SIZED:
+            return False
+        # random values nested in other expressions cannot be drawn per item
+        nested_random = any(_has_random(value) and not isinstance(value, R)
+                            for value in (*args, *params.values(), self.size))
+        if nested_random:
+            return False
+        if per_item and method_name in self._NOT_BROADCASTED:
+            return False
+        # items drawn without replacement should be unique within an item, not across all items
+        without_replacement = method_name == 'choice' and params.get('replace') is False
+        return not without_replacement
+
+    def _get_items_one_by_one(self, n_items, **kwargs):
+        return np.array([self.get(**kwargs) for _ in range(n_items)])
 
     def assign(self, *args, **kwargs):
         """ Assign a value """
@@ -705,6 +957,8 @@ class P(W):
     --------
     :func:`~batchflow.inbatch_parallel`
     """
+    level = PER_ITEM
+
     def _get_name(self, **kwargs):
         return self.name
 
@@ -715,7 +969,7 @@ class P(W):
             name, kwargs = self._get(**kwargs)
             batch = kwargs['batch']
             if isinstance(name, R):
-                val = np.array([name.get(**kwargs) for _ in batch])
+                val = name.get_items(len(batch), **kwargs)
             elif isinstance(name, NamedExpression):
                 val = name.get(**kwargs)
             else:
@@ -1,6 +1,7 @@
 """ Contains the base class for open datasets """
-from .. import Dataset, DatasetIndex
-from .. import ImagesBatch
+from ..dataset import Dataset
+from ..dsindex import DatasetIndex
+from ..batch_image import ImagesBatch
 
 
 class Openset(Dataset):
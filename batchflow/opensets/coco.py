@@ -13,7 +13,8 @@ import requests
 from PIL import Image
 
 from . import ImagesOpenset
-from .. import FilesIndex, any_action_failed, parallel
+from ..dsindex import FilesIndex
+from ..decorators import any_action_failed, parallel
 
 logger = logging.getLogger('COCO')
 
@@ -1,6 +1,8 @@
 """ Contains pipeline class """
+import os
 import sys
 import time
+import itertools
 from functools import partial
 import traceback
 import threading
@@ -11,31 +13,34 @@ import warnings
 from cProfile import Profile
 from pstats import Stats
 import queue as q
-import numpy as np
 import pandas as pd
 
 from .base import Baseset
 from .config import Config
 from .batch import Batch
-from .decorators import deprecated
+from .decorators import deprecated, worker_pools
 from .exceptions import SkipBatchException, EmptyBatchSequence
-from .named_expr import NamedExpression, V, eval_expr
+from .named_expr import NamedExpression, V, eval_expr, expr_level, compile_expr, STATIC
 from .once_pipeline import OncePipeline
+from .prefetch import SharedMemoryExecutor, PrefetchStats, is_shared_memory_available
+from .profiler import ActionProfiler
+from .rebatch import RebatchBuffer
+from .table import TableWriter
+from .rng import RandomStreams, batch_random_streams
 from .model_dir import ModelDirectory
 from .variables import VariableDirectory
-from .models.metrics import (ClassificationMetrics, SegmentationMetricsByPixels,
-                             SegmentationMetricsByInstances, RegressionMetrics, Loss)
 from ._const import *       # pylint:disable=wildcard-import
 from .utils import create_bar, update_bar, save_data_to
 
 
+# metrics classes from `.models.metrics`, which is imported only when metrics are gathered
 METRICS = dict(
-    classification=ClassificationMetrics,
-    segmentation=SegmentationMetricsByPixels,
-    mask=SegmentationMetricsByPixels,
-    instance=SegmentationMetricsByInstances,
-    regression=RegressionMetrics,
-    loss=Loss,
+    classification='ClassificationMetrics',
+    segmentation='SegmentationMetricsByPixels',
+    mask='SegmentationMetricsByPixels',
+    instance='SegmentationMetricsByInstances',
+    regression='RegressionMetrics',
+    loss='Loss',
 )
 
 
@@ -53,6 +58,26 @@ def hashable(x):
     return True
 
 
+def _overrides_merge(batch_class):
+    """ Check if a batch class merges batches in its own way """
+    return any(getattr(getattr(batch_class, name), '__func__', None) is not getattr(Batch, name).__func__
+               for name in ('merge', 'merge_component'))
+
+
+class _DeferredTableWriter:
+    """ Collect rows dumped in a worker process to write them in the main process """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, writes, path, fmt, kwargs):
+        self.writes = writes
+        self.path = path
+        self.fmt = fmt
+        self.kwargs = kwargs
+
+    def write(self, frame):
+        """ Put a dataframe aside until a batch is returned to the main process """
+        self.writes.append((self.path, self.fmt, self.kwargs, frame))
+
+
 class Pipeline:
     """ Pipeline """
     def __init__(self, dataset=None, config=None, pipeline=None, actions=None, proba=None, repeat=None):
@@ -103,9 +128,20 @@ class Pipeline:
         self._iter_params = None
         self._not_init_vars = True
 
+        self._action_plan = None
+        self._checked_methods = set()
+        self._expr_cache = {}
+        self.random_streams = None
+        self._table_writers = {}
+        self._table_writers_lock = threading.Lock()
+        self._run_pid = None
+        self._deferred_writes = []
+
         self._profile = None
         self._profiler = None
-        self.profile_info = None
+        self._profile_frames = []
+        self._profile_info = None
+        self.prefetch_stats = None
         self.elapsed_time = 0.0
         self._profile_info_lock = threading.Lock()
 
@@ -280,6 +316,7 @@ class Pipeline:
     def append_pipeline(self, pipeline, proba=None, repeat=None):
         """ Add a nested pipeline to the log of future actions """
         self._actions.append({'name': PIPELINE_ID, 'pipeline': pipeline, 'proba': proba, 'repeat': repeat})
+        self._action_plan = None
 
     @property
     def index(self):
@@ -308,6 +345,7 @@ class Pipeline:
         if clear:
             self.config = {}
         self.config.update(config)
+        self._clear_expr_cache()
         return self
 
     def update_config(self, config):
@@ -657,18 +695,28 @@ class Pipeline:
     def _exec_one_action(self, batch, action, args, kwargs):
         if self._needs_exec(batch, action):
             repeat = self._eval_expr(action['repeat'], batch=batch) or 1
+            name = action['name']
             for _ in range(repeat):
                 batch.pipeline = self
-                action_method, _ = self._get_action_method(batch, action['name'])
-                batch = action_method(*args, **kwargs)
+                if (type(batch), name) in self._checked_methods:
+                    action_method = getattr(batch, name)
+                else:
+                    action_method, _ = self._get_action_method(batch, name)
+                    self._checked_methods.add((type(batch), name))
+                new_batch = action_method(*args, **kwargs)
+                if new_batch is not batch and isinstance(new_batch, Batch) and new_batch.random_key is None:
+                    new_batch.inherit_random_streams(batch)
+                batch = new_batch
                 batch.pipeline = self
         return batch
 
-    def _exec_nested_pipeline(self, batch, action):
+    def _exec_nested_pipeline(self, batch, action, plan=None):
         if self._needs_exec(batch, action):
             repeat = self._eval_expr(action['repeat'], batch=batch) or 1
+            if plan is None:
+                plan = self._compile_actions(action['pipeline']._actions)  # pylint: disable=protected-access
             for _ in range(repeat):
-                batch = self._exec_all_actions(batch, action['pipeline']._actions)  # pylint: disable=protected-access
+                batch = self._exec_all_actions(batch, plan=plan)
         return batch
 
     def _add_profile_info(self, batch, action, exec_time, **kwargs):
@@ -699,12 +747,37 @@ class Pipeline:
                                    'batch_id', *list(kwargs.keys())])
         df['total_time'] += time.time() - start_time
 
-        if self.profile_info is None:
-            with self._profile_info_lock:
-                self.profile_info = df
-        else:
-            with self._profile_info_lock:
-                self.profile_info = self.profile_info.append(df)
+        # frames are concatenated only when profile info is requested
+        with self._profile_info_lock:
+            self._profile_frames.append(df)
+            self._profile_info = None
+
+    def _record_profile_info(self, batch, action, start_time, exec_time, cpu_time, eval_expr_time):
+        """ Add execution times of an action to the lightweight profiler """
+        action_id = self._profiler.get_action_id(id(action), lambda: self._get_profile_action_name(action))
+        self._profiler.record(action_id, iter=self._iter_params['_n_iters'], batch_id=id(batch),
+                              start_time=start_time, total_time=exec_time, cpu_time=cpu_time,
+                              eval_expr_time=eval_expr_time)
+
+    def _get_profile_action_name(self, action):
+        if action in self._actions:
+            return self.get_action_name(action, add_index=True)
+        # an action from a nested pipeline
+        return action['name'][2:] if action['name'].startswith('#_') else action['name']
+
+    @property
+    def profile_info(self):
+        """ pd.DataFrame or None : profiling information collected with `profile` option of :meth:`.gen_batch`
+
+        With ``profile=True`` rows contain wall and CPU execution times of actions.
+        With ``profile='detailed'`` rows also contain cProfile stats of all functions called in actions.
+        """
+        if isinstance(self._profiler, ActionProfiler):
+            return self._profiler.to_dataframe()
+        with self._profile_info_lock:
+            if self._profile_info is None and self._profile_frames:
+                self._profile_info = pd.concat(self._profile_frames)
+            return self._profile_info
 
     def show_profile_info(self, per_iter=False, detailed=False,
                           groupby=None, columns=None, sortby=None, limit=10):
@@ -716,6 +789,7 @@ class Pipeline:
             Whether to make an aggregation over iters or not.
         detailed : bool
             Whether to use information from :class:`cProfiler` or not.
+            Requires a pipeline run with ``profile='detailed'``.
         groupby : str or sequence of str
             Used only when `per_iter` is True, directly passed to pandas.
         columns : sequence of str
@@ -728,103 +802,181 @@ class Pipeline:
         parse : bool
             Allows to re-create underlying dataframe from scratches.
         """
+        profile_info = self.profile_info
+        if profile_info is None:
+            raise ValueError("No profile info. Run a pipeline with `profile=True` or `profile='detailed'`")
+        if detailed and 'id' not in profile_info.index.names:
+            raise ValueError("Detailed profile info requires a run with `profile='detailed'`")
+        time_column = 'pipeline_time' if 'pipeline_time' in profile_info.columns else 'cpu_time'
+
         if per_iter is False and detailed is False:
-            columns = columns or ['total_time', 'pipeline_time']
+            columns = columns or ['total_time', time_column]
             sortby = sortby or ('total_time', 'sum')
             aggs = {key: ['sum', 'mean', 'max'] for key in columns}
-            result = (self.profile_info.groupby(['action', 'iter'])[columns].mean().groupby('action').agg(aggs)
+            result = (profile_info.groupby(['action', 'iter'])[columns].mean().groupby('action').agg(aggs)
                       .sort_values(sortby, ascending=False))
 
         elif per_iter is False and detailed is True:
             columns = columns or ['ncalls', 'tottime', 'cumtime']
             sortby = sortby or ('tottime', 'sum')
             aggs = {key: ['sum', 'mean', 'max'] for key in columns}
-            result = (self.profile_info.reset_index().groupby(['action', 'id']).agg(aggs)
+            result = (profile_info.reset_index().groupby(['action', 'id']).agg(aggs)
                       .sort_values(['action', sortby], ascending=[True, False])
                       .groupby(level=0).apply(lambda df: df[:limit]).droplevel(0))
 
         elif per_iter is True and detailed is False:
             groupby = groupby or ['iter', 'action']
-            columns = columns or ['action', 'total_time', 'pipeline_time', 'batch_id']
+            columns = columns or ['action', 'total_time', time_column, 'batch_id']
             sortby = sortby or 'total_time'
-            result = (self.profile_info.reset_index().groupby(groupby)[columns].mean()
+            result = (profile_info.reset_index().groupby(groupby)[columns].mean()
                       .sort_values(['iter', sortby], ascending=[True, False]))
 
         elif per_iter is True and detailed is True:
             groupby = groupby or ['iter', 'action', 'id']
             columns = columns or ['ncalls', 'tottime', 'cumtime']
             sortby = sortby or 'tottime'
-            result = (self.profile_info.reset_index().set_index(groupby)[columns]
+            result = (profile_info.reset_index().set_index(groupby)[columns]
                       .sort_values(['iter', 'action', sortby], ascending=[True, True, False])
                       .groupby(level=[0, 1]).apply(lambda df: df[:limit]).droplevel([0, 1]))
         return result
 
 
-    def _exec_all_actions(self, batch, actions=None):
-        join_batches = None
-        actions = actions or self._actions
+    def _compile_actions(self, actions):
+        """ Turn actions into an execution plan
 
+        Each step of the plan holds a function which executes an action and functions which evaluate
+        named expressions in action args and kwargs (see :func:`~.named_expr.compile_expr`).
+        Constant arguments are never evaluated again and are passed to actions as is, without copying.
+        """
+        plan = []
         for action in actions:
+            name = action['name']
+            step = dict(action=action, plan=None,
+                        eval_args=self._compile_expr(action['args']) if 'args' in action else None,
+                        eval_kwargs=self._compile_expr(action['kwargs']) if 'kwargs' in action else None)
+            if action.get('#dont_run', False) or name == REBATCH_ID:
+                step['run'] = self._exec_noop
+            elif name == JOIN_ID:
+                step['run'] = self._exec_join
+            elif name == MERGE_ID:
+                step['run'] = self._exec_merge
+            elif name == PIPELINE_ID:
+                step['run'] = self._exec_nested_step
+                step['plan'] = self._compile_actions(action['pipeline']._actions)  # pylint: disable=protected-access
+            elif name in ACTIONS:
+                step['run'] = partial(self._exec_special_action, getattr(self, ACTIONS[name]))
+            else:
+                step['run'] = self._exec_batch_action
+            plan.append(step)
+        return plan
+
+    def _compile_expr(self, expr):
+        if expr_level(expr, self.config) == STATIC:
+            return None
+        return compile_expr(expr, cache=self._expr_cache, config=self.config)
+
+    def _clear_expr_cache(self):
+        """ Forget values of named expressions cached during a run (e.g. when a config is changed) """
+        self._expr_cache.clear()
+        self._action_plan = None
+
+    def _get_action_plan(self, actions=None):
+        if actions is not None:
+            return self._compile_actions(actions)
+        if self._action_plan is None:
+            self._action_plan = self._compile_actions(self._actions)
+        return self._action_plan
+
+    def _exec_all_actions(self, batch, actions=None, plan=None):
+        plan = plan if plan is not None else self._get_action_plan(actions)
+        if self._profile and isinstance(self._profiler, ActionProfiler):
+            # numba functions compiled by actions are recorded into the profiler of this pipeline only
+            with self._profiler.recording():
+                return self._exec_plan(batch, plan)
+        return self._exec_plan(batch, plan)
+
+    def _exec_plan(self, batch, plan):
+        join_batches = None
+        for step in plan:
+            action = step['action']
             if self._profile:
                 start_time = time.time()
-                self._profiler.enable()
-
-            _action = action.copy()
-            if 'args' in action:
-                _action['args'] = self._eval_expr(action['args'], batch=batch)
-            if 'kwargs' in action:
-                _action['kwargs'] = self._eval_expr(action['kwargs'], batch=batch)
+                start_perf, start_cpu = time.perf_counter(), time.thread_time()
+                if self._profile == 'detailed':
+                    self._profiler.enable()
+
+            _action = action
+            if step['eval_args'] is not None or step['eval_kwargs'] is not None:
+                _action = action.copy()
+                if step['eval_args'] is not None:
+                    _action['args'] = step['eval_args'](batch=batch, pipeline=self)
+                if step['eval_kwargs'] is not None:
+                    _action['kwargs'] = step['eval_kwargs'](batch=batch, pipeline=self)
 
             if self._profile:
-                eval_expr_time = time.time() - start_time
+                eval_expr_time = time.perf_counter() - start_perf
 
-            if _action.get('#dont_run', False):
-                pass
-            elif _action['name'] in [JOIN_ID, MERGE_ID]:
-                join_batches = []
-                for pipe in _action['pipelines']:   # pylint: disable=not-an-iterable
-                    if _action['mode'] == 'i':
-                        jbatch = pipe.create_batch(batch.index)
-                    elif _action['mode'] == 'n':
-                        jbatch = pipe.next_batch()
-                    join_batches.append(jbatch)
-
-                if _action['name'] == MERGE_ID:
-                    if _action['fn'] is None:
-                        batch, _ = batch.merge([batch] + join_batches, components=_action['components'])
-                    else:
-                        batch, _ = _action['fn']([batch] + join_batches)
-                    join_batches = None
-            elif _action['name'] == REBATCH_ID:
-                pass
-            elif _action['name'] == PIPELINE_ID:
-                batch = self._exec_nested_pipeline(batch, _action)
-            elif _action['name'] in ACTIONS:
-                action_fn = getattr(self, ACTIONS[_action['name']])
-                action_fn(batch, _action)
-            else:
-                if join_batches is None:
-                    _action_args = _action['args']
+            batch, join_batches = step['run'](batch, _action, join_batches, step)
+
+            if self._profile:
+                exec_time = time.perf_counter() - start_perf
+                if self._profile == 'detailed':
+                    self._profiler.disable()
+                    self._add_profile_info(batch, action, start_time=start_time, exec_time=exec_time,
+                                           eval_expr_time=eval_expr_time)
                 else:
-                    _action_args = tuple([tuple(join_batches), *_action['args']])
-                    join_batches = None
+                    self._record_profile_info(batch, action, start_time=start_time, exec_time=exec_time,
+                                              cpu_time=time.thread_time() - start_cpu,
+                                              eval_expr_time=eval_expr_time)
 
-                batch = self._exec_one_action(batch, _action, _action_args, _action['kwargs'])
+        return batch
 
-            if self._profile:
-                self._profiler.disable()
-                exec_time = time.time() - start_time
-                self._add_profile_info(batch, action, start_time=start_time, exec_time=exec_time,
-                                       eval_expr_time=eval_expr_time)
+    @staticmethod
+    def _exec_noop(batch, _action, join_batches, _step):
+        return batch, join_batches
 
+    @staticmethod
+    def _create_join_batches(batch, action):
+        join_batches = []
+        for pipe in action['pipelines']:
+            if action['mode'] == 'i':
+                jbatch = pipe.create_batch(batch.index)
+            elif action['mode'] == 'n':
+                jbatch = pipe.next_batch()
+            join_batches.append(jbatch)
+        return join_batches
+
+    def _exec_join(self, batch, action, _join_batches, _step):
+        return batch, self._create_join_batches(batch, action)
+
+    def _exec_merge(self, batch, action, _join_batches, _step):
+        join_batches = self._create_join_batches(batch, action)
+        if action['fn'] is None:
+            batch, _ = batch.merge([batch] + join_batches, components=action['components'])
+        else:
+            batch, _ = action['fn']([batch] + join_batches)
+        return batch, None
 
-        return batch
+    def _exec_nested_step(self, batch, action, join_batches, step):
+        return self._exec_nested_pipeline(batch, action, step['plan']), join_batches
+
+    @staticmethod
+    def _exec_special_action(action_fn, batch, action, join_batches, _step):
+        action_fn(batch, action)
+        return batch, join_batches
+
+    def _exec_batch_action(self, batch, action, join_batches, _step):
+        if join_batches is None:
+            args = action['args']
+        else:
+            args = tuple([tuple(join_batches), *action['args']])
+        return self._exec_one_action(batch, action, args, action['kwargs']), None
 
     def _needs_exec(self, batch, action):
         if action['proba'] is None:
             return True
         proba = self._eval_expr(action['proba'], batch=batch)
-        return np.random.binomial(1, proba) == 1
+        return batch.random.binomial(1, proba) == 1
 
     def execute_for(self, batch, new_loop=False):
         """ Run a pipeline for one batch
@@ -843,7 +995,9 @@ class Pipeline:
         if new_loop:
             asyncio.set_event_loop(asyncio.new_event_loop())
         batch.pipeline = self
-        batch_res = self._exec_all_actions(batch)
+        # samplers draw from streams of the batch, so their values do not depend on a thread or a process
+        with batch_random_streams(batch):
+            batch_res = self._exec_all_actions(batch)
         batch_res.pipeline = self
         return batch_res
 
@@ -1216,7 +1370,8 @@ class Pipeline:
                 raise ValueError('Metrics name is ambiguous', metrics_class)
             if len(available_metrics) == 0:
                 raise ValueError('Metrics not found', metrics_class)
-            metrics_class = METRICS[available_metrics[0]]
+            from .models import metrics as metrics_module  # pylint: disable=import-outside-toplevel
+            metrics_class = getattr(metrics_module, METRICS[available_metrics[0]])
         elif not isinstance(metrics_class, type):
             raise TypeError('Metrics can be a string or a class', metrics_class)
 
@@ -1239,9 +1394,37 @@ class Pipeline:
         return new_p._add_action(REBATCH_ID, _args=dict(batch_size=batch_size, pipeline=self, fn=fn,
                                                         components=components, batch_class=batch_class))
 
+    def _execute_prefetched(self, batch):
+        """ Run a pipeline for a prefetched batch and measure the execution time
+
+        Rows dumped to tables in a worker process are returned along with the batch,
+        so they are written by the main process.
+        """
+        self._deferred_writes = []
+        start = time.perf_counter()
+        batch_res = self.execute_for(batch, new_loop=True)
+        elapsed = time.perf_counter() - start
+        writes, self._deferred_writes = self._deferred_writes, []
+        return batch_res, elapsed, writes
+
     def _put_batches_into_queue(self, gen_batch, bar, bar_desc):
+        stats = self.prefetch_stats
+        unordered = stats.order == 'any'
+        lock = threading.Lock()
+        pending = [0, False]
+
+        def _put_completed(future):
+            # in 'any' order futures are queued as soon as they complete
+            self._prefetch_queue.put(future)
+            with lock:
+                pending[0] -= 1
+                finished = pending[1] and pending[0] == 0
+            if finished:
+                self._prefetch_queue.put(None)
+
         while not self._stop_flag:
-            self._prefetch_count.put(1, block=True)
+            with stats.wait('producer_wait'):
+                self._prefetch_count.put(1, block=True)
             try:
                 batch = next(gen_batch)
                 if bar:
@@ -1249,12 +1432,23 @@ class Pipeline:
             except StopIteration:
                 break
             else:
-                future = self._executor.submit(self.execute_for, batch, new_loop=True)
-                self._prefetch_queue.put(future, block=True)
-        self._prefetch_queue.put(None, block=True)
+                future = self._executor.submit(self._execute_prefetched, batch)
+                stats.submit(future)
+                if unordered:
+                    with lock:
+                        pending[0] += 1
+                    future.add_done_callback(_put_completed)
+                else:
+                    self._prefetch_queue.put(future, block=True)
+
+        with lock:
+            pending[1] = True
+            finished = pending[0] == 0
+        if not unordered or finished:
+            self._prefetch_queue.put(None, block=True)
 
     def _run_batches_from_queue(self):
-        skip_batch = False
+        stats = self.prefetch_stats
         while not self._stop_flag:
             future = self._prefetch_queue.get(block=True)
             if future is None:
@@ -1262,18 +1456,24 @@ class Pipeline:
                 self._batch_queue.put(None)
                 break
 
+            cf.wait([future])
+            stats.complete(future)
             try:
-                batch = future.result()
-            except SkipBatchException:
-                skip_batch = True
-            except Exception:   # pylint: disable=broad-except
-                exc = future.exception()
-                print("Exception in a thread:", exc)
-                traceback.print_tb(exc.__traceback__)
+                batch, busy_time, writes = future.result()
+                for path, fmt, kwargs, frame in writes:
+                    self.get_table_writer(path, fmt, **kwargs).write(frame)
+            except Exception as exc:   # pylint: disable=broad-except
+                if not isinstance(exc, SkipBatchException):
+                    print("Exception in a thread:", exc)
+                    traceback.print_tb(exc.__traceback__)
+                # a batch which is not yielded frees its place in the prefetch queue
+                stats.add('dropped')
+                self._prefetch_count.get(block=True)
+                self._prefetch_count.task_done()
+            else:
+                stats.add('busy_time', busy_time)
+                self._batch_queue.put(batch, block=True)
             finally:
-                if not skip_batch:
-                    self._batch_queue.put(batch, block=True)
-                    skip_batch = False
                 self._prefetch_queue.task_done()
 
     def _clear_queue(self, queue):
@@ -1294,7 +1494,7 @@ class Pipeline:
         what : list of str, str or bool or None
             what to reset to start from scratch:
 
-            - 'iter' - restart the batch iterator
+            - 'iter' - restart the batch iterator and shut down shared worker pools
             - 'variables' - re-initialize all pipeline variables
             - 'models' - reset all models
 
@@ -1331,6 +1531,7 @@ class Pipeline:
 
             self._stop_executor(self._executor)
             self._stop_executor(self._service_executor)
+            worker_pools.shutdown()
 
             self._executor = None
             self._service_executor = None
@@ -1340,6 +1541,7 @@ class Pipeline:
             self._rest_batch = None
             self._batch_generator = None
             self._iter_params = Baseset.get_default_iter_params()
+            self.close_table_writers()
 
         if 'vars' in what or 'variables' in what:
             self._init_all_variables()
@@ -1359,38 +1561,61 @@ class Pipeline:
 
         kwargs.setdefault('iter_params', None)
 
+        def _gen_inner_batches():
+            while True:
+                try:
+                    yield pipeline.next_batch(*args, **kwargs)
+                except StopIteration:
+                    return
+
+        batches = _gen_inner_batches()
+        first_batch = next(batches, None)
+        if first_batch is None:
+            return
+        batches = itertools.chain([first_batch], batches)
+
         self._rest_batch = None
+        fn = _action['fn']
+        if fn is None and not _overrides_merge(type(first_batch)):
+            yield from self._rebatch_buffered(batches, _action)
+        else:
+            yield from self._rebatch_merged(batches, _action, fn or first_batch.merge)
+
+    @staticmethod
+    def _rebatch_buffered(batches, action):
+        buffer = RebatchBuffer(action['batch_size'], components=action['components'],
+                               batch_class=action['batch_class'])
+        for batch in batches:
+            buffer.put(batch)
+            while len(buffer) >= action['batch_size']:
+                yield buffer.get()
+        if len(buffer) > 0:
+            yield buffer.get()
+
+    def _rebatch_merged(self, batches, action, fn):
         while True:
             if self._rest_batch is None:
                 cur_len = 0
-                batches = []
+                merged = []
             else:
                 cur_len = len(self._rest_batch)
-                batches = [self._rest_batch]
+                merged = [self._rest_batch]
                 self._rest_batch = None
-            while cur_len < _action['batch_size']:
-                try:
-                    new_batch = pipeline.next_batch(*args, **kwargs)
-                except StopIteration:
-                    break
-                else:
-                    batches.append(new_batch)
-                    cur_len += len(new_batch)
-            if len(batches) == 0:
+            if cur_len < action['batch_size']:
+                for batch in batches:
+                    merged.append(batch)
+                    cur_len += len(batch)
+                    if cur_len >= action['batch_size']:
+                        break
+            if len(merged) == 0:
                 break
 
-            if _action['fn'] is None:
-                batch, self._rest_batch = batches[0].merge(batches, batch_size=_action['batch_size'],
-                                                           components=_action['components'],
-                                                           batch_class=_action['batch_class'])
-            else:
-                batch, self._rest_batch = _action['fn'](batches, batch_size=_action['batch_size'],
-                                                        components=_action['components'],
-                                                        batch_class=_action['batch_class'])
+            batch, self._rest_batch = fn(merged, batch_size=action['batch_size'],
+                                         components=action['components'], batch_class=action['batch_class'])
             yield batch
 
 
-    def gen_batch(self, *args, iter_params=None, reset='iter', profile=False, **kwargs):
+    def gen_batch(self, *args, iter_params=None, reset='iter', profile=False, seed=None, **kwargs):
         """ Generate batches
 
         Parameters
@@ -1398,7 +1623,7 @@ class Pipeline:
         batch_size : int
             desired number of items in the batch (the actual batch could contain fewer items)
 
-        shuffle : bool, int, class:`numpy.random.RandomState` or callable
+        shuffle : bool, int, class:`numpy.random.RandomState`, class:`numpy.random.Generator` or callable
             specifies the order of items, could be:
 
             - bool - if `False`, items go sequentionally, one after another as they appear in the index.
@@ -1406,7 +1631,7 @@ class Pipeline:
 
             - int - a seed number for a random shuffle.
 
-            - :class:`numpy.random.RandomState` instance.
+            - :class:`numpy.random.RandomState` or :class:`numpy.random.Generator` instance.
 
             - callable - a function which takes an array of item indices in the initial order
                 (as they appear in the index) and returns the order of items.
@@ -1437,7 +1662,14 @@ class Pipeline:
 
         target : 'threads' or 'mpc'
             batch parallelization engine used for prefetching (default='threads').
-            'mpc' rarely works well due to complicated and slow python's inter-process communications.
+            With 'mpc' worker processes are forked once with the pipeline, so only batch indices are sent to them,
+            and batch components come back through shared memory (see :class:`~.prefetch.SharedMemoryExecutor`).
+            Note that changes of pipeline variables and models made in worker processes are lost.
+
+        prefetch_order : 'strict' or 'any'
+            whether prefetched batches are yielded in the order they were generated (default='strict')
+            or as soon as they are ready ('any'), so a slow batch does not hold back the next ones.
+            Prefetching statistics are available in :attr:`prefetch_stats` (see :class:`~.prefetch.PrefetchStats`).
 
         reset : list of str, str or bool
             what to reset to start from scratch:
@@ -1446,6 +1678,22 @@ class Pipeline:
             - 'variables' - re-initialize all pipeline variables
             - 'models' - reset all models
 
+        profile : bool or 'detailed'
+            whether to collect profiling information (default=False):
+
+            - True - wall and CPU times of actions are stored in preallocated buffers
+              (see :class:`~.profiler.ActionProfiler`), which barely slows the pipeline down
+            - 'detailed' - all functions called in actions are profiled with :class:`cProfile.Profile`
+
+            Collected information is available in :attr:`profile_info` and :meth:`show_profile_info`.
+
+        seed : None, int or np.random.SeedSequence
+            a root seed of :attr:`random_streams` (see :class:`~.rng.RandomStreams`).
+            Batches are numbered in the order they are generated and each of them draws random values
+            (e.g. ``R`` expressions, action probabilities, augmentations) from a stream for its number,
+            so with a seed given runs are reproducible with any prefetching.
+            If None, a fresh seed is used.
+
         Yields
         ------
         an instance of the batch class returned by the last action
@@ -1468,9 +1716,14 @@ class Pipeline:
         kwargs_value = self._eval_expr(kwargs)
         self.reset(reset)
         self._iter_params = iter_params or self._iter_params or Baseset.get_default_iter_params()
+        self._expr_cache.clear()
+        self._action_plan = self._compile_actions(self._actions)
+        self.random_streams = RandomStreams(seed)
         self._profile = profile
-        if profile:
+        if profile == 'detailed':
             self._profiler = Profile()
+        elif profile and not isinstance(self._profiler, ActionProfiler):
+            self._profiler = ActionProfiler()
 
         return self._gen_batch(*args_value, iter_params=self._iter_params, **kwargs_value)
 
@@ -1478,17 +1731,25 @@ class Pipeline:
     def _gen_batch(self, *args, **kwargs):
         """ Generate batches """
         start_time = time.time()
+        # table writers belong to the process which runs the pipeline
+        self._run_pid = os.getpid()
         target = kwargs.pop('target', 'threads')
         prefetch = kwargs.pop('prefetch', 0)
+        prefetch_order = kwargs.pop('prefetch_order', 'strict')
+        if prefetch_order not in ['strict', 'any']:
+            raise ValueError("prefetch_order should be one of ['strict', 'any']")
         on_iter = kwargs.pop('on_iter', None)
         bar = kwargs.pop('bar', None)
         bar_desc = kwargs.pop('bar_desc', None)
 
         if len(self._actions) > 0 and self._actions[0]['name'] == REBATCH_ID:
-            batch_generator = self.gen_rebatch(*args, **kwargs, prefetch=prefetch)
-            prefetch = 0
+            # the inner pipeline streams are spawned from the root, so they are reproducible too
+            seed = self.random_streams.root.spawn(1)[0]
+            # the inner pipeline prefetches its batches, while actions after rebatch are prefetched here
+            batch_generator = self.gen_rebatch(*args, **kwargs, prefetch=prefetch, seed=seed)
         else:
             batch_generator = self._dataset.gen_batch(*args, **kwargs)
+        batch_generator = self._set_random_keys(batch_generator)
 
         if self._not_init_vars:
             self._init_all_variables()
@@ -1507,53 +1768,72 @@ class Pipeline:
         if self.before:
             self.before.run()
 
-        if prefetch > 0:
-            # pool cannot have more than 63 workers
-            prefetch = min(prefetch, 62)
+        try:
+            if prefetch > 0:
+                # pool cannot have more than 63 workers
+                prefetch = min(prefetch, 62)
+
+                if target in ['threads', 't']:
+                    self._executor = cf.ThreadPoolExecutor(max_workers=prefetch + 1)
+                elif target in ['mpc', 'm']:
+                    if is_shared_memory_available():
+                        shared = [self, self._dataset, getattr(self._dataset, 'data', None)]
+                        self._executor = SharedMemoryExecutor(max_workers=prefetch + 1, shared=shared)
+                    else:
+                        self._executor = cf.ProcessPoolExecutor(max_workers=prefetch + 1)
+                else:
+                    raise ValueError("target should be one of ['threads', 'mpc']")
+
+                self._stop_flag = False
+                self.prefetch_stats = PrefetchStats(prefetch, prefetch + 1, prefetch_order)
+                self._prefetch_count = q.Queue(maxsize=prefetch + 1)
+                # in 'any' order the number of queued futures is limited by `_prefetch_count`
+                self._prefetch_queue = q.Queue(maxsize=prefetch if prefetch_order == 'strict' else 0)
+                self._batch_queue = q.Queue(maxsize=1)
+                self._service_executor = cf.ThreadPoolExecutor(max_workers=2)
+                self._service_executor.submit(self._put_batches_into_queue, batch_generator, bar, bar_desc)
+                self._service_executor.submit(self._run_batches_from_queue)
+
+                while not self._stop_flag:
+                    with self.prefetch_stats.wait('consumer_wait'):
+                        batch_res = self._batch_queue.get(block=True)
+                    self._batch_queue.task_done()
+                    if batch_res is not None:
+                        self.prefetch_stats.sample_depth()
+                        self.prefetch_stats.add('yielded')
+                        yield batch_res
+                        self._prefetch_count.get(block=True)
+                        self._prefetch_count.task_done()
+                        if callable(on_iter):
+                            on_iter(batch_res)
+                    else:
+                        self._stop_flag = True
+                self.prefetch_stats.finish()
 
-            if target in ['threads', 't']:
-                self._executor = cf.ThreadPoolExecutor(max_workers=prefetch + 1)
-            elif target in ['mpc', 'm']:
-                self._executor = cf.ProcessPoolExecutor(max_workers=prefetch + 1)
+                if isinstance(self._executor, SharedMemoryExecutor):
+                    # worker processes are not needed anymore
+                    self._executor.shutdown()
+                    self._executor = None
             else:
-                raise ValueError("target should be one of ['threads', 'mpc']")
-
-            self._stop_flag = False
-            self._prefetch_count = q.Queue(maxsize=prefetch + 1)
-            self._prefetch_queue = q.Queue(maxsize=prefetch)
-            self._batch_queue = q.Queue(maxsize=1)
-            self._service_executor = cf.ThreadPoolExecutor(max_workers=2)
-            self._service_executor.submit(self._put_batches_into_queue, batch_generator, bar, bar_desc)
-            self._service_executor.submit(self._run_batches_from_queue)
-
-            while not self._stop_flag:
-                batch_res = self._batch_queue.get(block=True)
-                self._batch_queue.task_done()
-                if batch_res is not None:
-                    yield batch_res
-                    self._prefetch_count.get(block=True)
-                    self._prefetch_count.task_done()
-                    if callable(on_iter):
-                        on_iter(batch_res)
-                else:
-                    self._stop_flag = True
-        else:
-            is_empty = True
-            for batch in batch_generator:
-                try:
-                    batch_res = self.execute_for(batch)
-                    if bar:
-                        update_bar(bar, bar_desc, pipeline=self, batch=batch)
-                except SkipBatchException:
-                    pass
-                else:
-                    is_empty = False
-                    yield batch_res
-                    if callable(on_iter):
-                        on_iter(batch_res)
-            if is_empty:
-                warnings.warn("Batch generator is empty. Use pipeline.reset('iter') to restart iteration.",
-                              EmptyBatchSequence, stacklevel=3)
+                is_empty = True
+                for batch in batch_generator:
+                    try:
+                        batch_res = self.execute_for(batch)
+                        if bar:
+                            update_bar(bar, bar_desc, pipeline=self, batch=batch)
+                    except SkipBatchException:
+                        pass
+                    else:
+                        is_empty = False
+                        yield batch_res
+                        if callable(on_iter):
+                            on_iter(batch_res)
+                if is_empty:
+                    warnings.warn("Batch generator is empty. Use pipeline.reset('iter') to restart iteration.",
+                                  EmptyBatchSequence, stacklevel=3)
+        finally:
+            # writers are closed even if the generator is closed or garbage collected before the end
+            self.close_table_writers()
 
         if bar:
             bar.close()
@@ -1563,6 +1843,37 @@ class Pipeline:
         self.elapsed_time += time.time() - start_time
 
 
+    @staticmethod
+    def _set_random_keys(batch_generator):
+        # keys are set before batches are sent to workers, so a batch stream does not depend on the worker
+        for key, batch in enumerate(batch_generator):
+            batch.random_key = key
+            yield batch
+
+    def get_table_writer(self, path, fmt, **kwargs):
+        """ Return a writer which appends rows to a table file until the end of the run
+
+        Writers are created once for each file, so all batches of a run are written to the same file
+        (see :class:`~.table.TableWriter`).
+        In worker processes (e.g. with `target='mpc'`) rows are collected and written by the process
+        which runs the pipeline, so a file is never opened by several processes.
+        """
+        if self._run_pid is not None and self._run_pid != os.getpid():
+            return _DeferredTableWriter(self._deferred_writes, path, fmt, kwargs)
+        key = os.path.abspath(path), fmt
+        with self._table_writers_lock:
+            writer = self._table_writers.get(key)
+            if writer is None:
+                writer = self._table_writers[key] = TableWriter(path, fmt, **kwargs)
+        return writer
+
+    def close_table_writers(self):
+        """ Write all pending rows and close table files """
+        with self._table_writers_lock:
+            writers, self._table_writers = self._table_writers, {}
+        for writer in writers.values():
+            writer.close()
+
     def create_batch(self, batch_index, *args, **kwargs):
         """ Create a new batch by given indices and execute all lazy actions """
         batch = self._dataset.create_batch(batch_index, *args, **kwargs)
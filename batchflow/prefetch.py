@@ -0,0 +1,482 @@
+""" Contains tools for prefetching batches: an executor which runs pipelines in forked processes
+and returns batches through shared memory, and prefetch statistics """
+import io
+import time
+import pickle
+import weakref
+import threading
+import traceback
+import queue as q
+import multiprocessing as mp
+import concurrent.futures as cf
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+try:
+    from multiprocessing import shared_memory
+    from multiprocessing import resource_tracker
+except ImportError:
+    shared_memory = resource_tracker = None
+import numpy as np
+
+
+# arrays are placed in shared memory at offsets aligned to this number of bytes
+ALIGNMENT = 64
+
+
+def is_shared_memory_available():
+    """ Check whether :class:`SharedMemoryExecutor` can be used on this platform """
+    return shared_memory is not None and 'fork' in mp.get_all_start_methods()
+
+
+class _Pickler(pickle.Pickler):
+    """ Pickle objects known to both processes (e.g. a pipeline and a dataset) by reference """
+    def __init__(self, file, shared, **kwargs):
+        super().__init__(file, protocol=5, **kwargs)
+        self.shared = shared
+
+    def persistent_id(self, obj):     # pylint:disable=method-hidden
+        oid = id(obj)
+        if oid in self.shared and self.shared[oid] is obj:
+            return oid
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    """ Restore objects known to both processes """
+    def __init__(self, file, shared, **kwargs):
+        super().__init__(file, **kwargs)
+        self.shared = shared
+
+    def persistent_load(self, pid):
+        return self.shared[pid]
+
+
+def _dumps(obj, shared, buffer_callback=None):
+    file = io.BytesIO()
+    _Pickler(file, shared, buffer_callback=buffer_callback).dump(obj)
+    return file.getvalue()
+
+def _loads(data, shared, buffers=None):
+    return _Unpickler(io.BytesIO(data), shared, buffers=buffers).load()
+
+
+def _worker(tasks, results, shared):
+    """ Run tasks in a worker process
+
+    Each task is a tuple ``(task_id, data, slot)``, where `data` is a pickled ``(func, args, kwargs)``
+    and `slot` is ``(slot_id, name, size)`` of a shared memory block to place arrays from the result into
+    (or None if the result should be sent through the queue).
+    """
+    blocks = {}
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, data, slot = task
+        try:
+            func, args, kwargs = _loads(data, shared)
+            result = func(*args, **kwargs)
+        except BaseException as e:      # pylint:disable=broad-except
+            try:
+                data = _dumps(e, shared)
+            except Exception:           # pylint:disable=broad-except
+                data = _dumps(RuntimeError(traceback.format_exc()), shared)
+            results.put((task_id, False, data, None))
+            continue
+
+        try:
+            if slot is None:
+                results.put((task_id, True, _dumps(result, shared), None))
+                continue
+
+            buffers = []
+            data = _dumps(result, shared, buffer_callback=buffers.append)
+            buffers = [buffer.raw() for buffer in buffers]
+            layout, size = [], 0
+            for buffer in buffers:
+                layout.append((size, buffer.nbytes))
+                size += -(-buffer.nbytes // ALIGNMENT) * ALIGNMENT
+
+            slot_id, name, capacity = slot
+            if size > 0:
+                shm = blocks.get(slot_id)
+                if size > capacity:
+                    # the block is too small, so a new one is created and handed over to the main process
+                    capacity = max(size, 2 * capacity)
+                    new_shm = shared_memory.SharedMemory(create=True, size=capacity)
+                    name = new_shm.name
+                elif shm is None or shm.name != name:
+                    new_shm = shared_memory.SharedMemory(name=name)
+                else:
+                    new_shm = shm
+                if new_shm is not shm:
+                    if shm is not None:
+                        _close(shm)
+                    blocks[slot_id] = shm = new_shm
+
+                memory = np.frombuffer(shm.buf, dtype=np.uint8)
+                for buffer, (offset, nbytes) in zip(buffers, layout):
+                    memory[offset : offset + nbytes] = np.frombuffer(buffer, dtype=np.uint8)
+                del memory
+            del buffers
+            results.put((task_id, True, data, (name, capacity, layout)))
+        except BaseException:           # pylint:disable=broad-except
+            results.put((task_id, False, _dumps(RuntimeError(traceback.format_exc()), shared), None))
+
+    for shm in blocks.values():
+        _close(shm)
+
+
+def _close(shm, unlink=False, close=True):
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    if close:
+        shm.close()
+
+
+class SharedMemoryExecutor(cf.Executor):
+    """ Run functions in processes forked once, with results transferred through shared memory
+
+    Worker processes are forked when the executor is created, so they inherit all objects
+    (a pipeline, a dataset, loaded models, etc) without any serialization.
+    Objects from `shared` are sent to workers and back only as references,
+    so a task for a bound method of a pipeline contains just the method name and its arguments.
+
+    Results are pickled with out-of-band buffers: all contiguous numpy arrays are written into a ring of
+    shared memory blocks and reconstructed in the main process as views of that memory without copying.
+    A block becomes available for the next results when all arrays using it are garbage collected.
+    When all blocks are in use, results are sent through a queue.
+
+    Note that changes of pipeline variables, models and other objects made in workers are not visible
+    in the main process.
+
+    Parameters
+    ----------
+    max_workers : int
+        the number of worker processes.
+    shared : sequence
+        objects which exist in the main process before workers are forked and should not be copied.
+        All subclasses of :class:`~.Batch` are always shared, so locally defined batch classes can be used.
+    n_slots : int or None
+        the number of shared memory blocks. Default is ``2 * max_workers``.
+    """
+    def __init__(self, max_workers=None, shared=None, n_slots=None):
+        if not is_shared_memory_available():
+            raise RuntimeError("Shared memory executor requires Python 3.8+ and the 'fork' start method")
+
+        from .batch import Batch    # pylint:disable=import-outside-toplevel,cyclic-import
+        max_workers = max_workers or mp.cpu_count()
+        shared = [obj for obj in (shared or []) if obj is not None] + self._subclasses(Batch)
+        self._shared = {id(obj): obj for obj in shared}
+
+        n_slots = n_slots or 2 * max_workers
+        self._slots = [None] * n_slots
+        self._free_slots = q.Queue()
+        for slot in range(n_slots):
+            self._free_slots.put(slot)
+
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._task_id = 0
+        self._shutdown = False
+        self._broken = None
+
+        # workers should share the resource tracker of the main process which unlinks leaked blocks
+        resource_tracker.ensure_running()
+        context = mp.get_context('fork')
+        self._tasks = context.SimpleQueue()
+        self._results = context.Queue()
+        self._processes = [context.Process(target=_worker, args=(self._tasks, self._results, self._shared),
+                                           daemon=True)
+                           for _ in range(max_workers)]
+        for process in self._processes:
+            process.start()
+
+        self._result_thread = threading.Thread(target=self._collect_results, daemon=True)
+        self._result_thread.start()
+
+    @classmethod
+    def _subclasses(cls, klass):
+        subclasses = [klass]
+        for subclass in klass.__subclasses__():
+            subclasses.extend(cls._subclasses(subclass))
+        return subclasses
+
+    def submit(self, fn, *args, **kwargs):     # pylint:disable=arguments-differ
+        """ Schedule `fn(*args, **kwargs)` to be executed in a worker process """
+        with self._lock:
+            if self._broken:
+                raise BrokenProcessPool(self._broken)
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+
+            future = cf.Future()
+            task_id = self._task_id
+            self._task_id += 1
+
+        try:
+            data = _dumps((fn, args, kwargs), self._shared)
+        except Exception as e:      # pylint:disable=broad-except
+            future.set_exception(e)
+            return future
+
+        try:
+            slot = self._free_slots.get_nowait()
+        except q.Empty:
+            slot, slot_info = None, None
+        else:
+            shm = self._slots[slot]
+            slot_info = (slot, shm.name, shm.size) if shm is not None else (slot, '', 0)
+
+        with self._lock:
+            if self._shutdown:
+                # the executor was shut down while the task was being serialized
+                self._release(slot)
+                self._cancel(future)
+                return future
+            self._futures[task_id] = future, slot
+        self._tasks.put((task_id, data, slot_info))
+        return future
+
+    @staticmethod
+    def _cancel(future):
+        # `concurrent.futures.wait` returns for a cancelled future only after its waiters are notified
+        if not future.done() and future.cancel():
+            future.set_running_or_notify_cancel()
+
+    def _release(self, slot, shm=None):
+        _ = shm
+        if slot is not None:
+            self._free_slots.put(slot)
+
+    def _collect_results(self):
+        while True:
+            try:
+                message = self._results.get(timeout=.1)
+            except q.Empty:
+                if self._shutdown and not self._futures:
+                    break
+                if not all(process.is_alive() for process in self._processes) and not self._shutdown:
+                    self._set_broken('A worker process terminated abruptly')
+                    break
+                continue
+            if message is None:
+                break
+
+            self._set_result(*message)
+
+    def _set_result(self, task_id, success, data, shm_info):
+        # results are not kept in local variables of the collecting loop, so their memory could be released
+        with self._lock:
+            future, slot = self._futures.pop(task_id)
+        try:
+            result = self._load(data, slot, shm_info)
+        except Exception as e:      # pylint:disable=broad-except
+            future.set_exception(e)
+            return
+        if not future.cancelled():
+            if success:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def _load(self, data, slot, shm_info):
+        """ Reconstruct an object with its arrays pointing to a shared memory block """
+        if shm_info is None or not shm_info[2]:
+            self._release(slot)
+            return _loads(data, self._shared)
+
+        name, _, layout = shm_info
+        shm = self._slots[slot]
+        if shm is None or shm.name != name:
+            # a worker has allocated a larger block
+            new_shm = shared_memory.SharedMemory(name=name)
+            if shm is not None:
+                _close(shm, unlink=True)
+            self._slots[slot] = shm = new_shm
+
+        # the slot is released when all arrays using its memory are garbage collected,
+        # and until then the finalizer keeps the block from being closed and unmapped.
+        # Arrays are views of a separate memoryview, which is collected after their exports are released,
+        # so the block can be closed when the finalizer drops the last reference to it
+        view = shm.buf[:]
+        memory = np.frombuffer(view, dtype=np.uint8)
+        finalizer = weakref.finalize(view, self._release, slot, shm)
+        finalizer.atexit = False
+        del view
+        buffers = [memory[offset : offset + nbytes] for offset, nbytes in layout]
+        return _loads(data, self._shared, buffers=buffers)
+
+    def _set_broken(self, message):
+        with self._lock:
+            self._broken = message
+            futures, self._futures = self._futures, {}
+        for future, _ in futures.values():
+            future.set_exception(BrokenProcessPool(message))
+
+    def shutdown(self, wait=True):
+        """ Stop worker processes and release shared memory """
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            futures = list(self._futures.values())
+        for future, _ in futures:
+            self._cancel(future)
+
+        for _ in self._processes:
+            self._tasks.put(None)
+        if wait:
+            for process in self._processes:
+                process.join(timeout=5)
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+        self._result_thread.join()
+
+        # tasks which have not been finished by workers will never get their results
+        with self._lock:
+            futures, self._futures = list(self._futures.values()), {}
+        for future, _ in futures:
+            self._cancel(future)
+
+        # blocks are unmapped when arrays using them are garbage collected
+        for slot, shm in enumerate(self._slots):
+            if shm is not None:
+                _close(shm, unlink=True, close=False)
+                self._slots[slot] = None
+
+
+class PrefetchStats:
+    """ Live statistics of batch prefetching in :meth:`.Pipeline.gen_batch`
+
+    Counters are updated while batches are generated, so they can be inspected at any moment,
+    e.g. in `on_iter` callback. A large `producer_wait` means that batches are processed faster
+    than they are consumed (and `prefetch` can be decreased), while a large `consumer_wait` along with a high
+    `utilization` means that more workers are needed.
+
+    Attributes
+    ----------
+    prefetch : int
+        the number of batches processed in advance.
+    n_workers : int
+        the number of workers.
+    order : str
+        the order of yielded batches ('strict' or 'any').
+    submitted : int
+        the number of batches sent to workers.
+    completed : int
+        the number of batches processed by workers (including skipped and failed ones).
+    yielded : int
+        the number of batches yielded to the consumer.
+    dropped : int
+        the number of skipped or failed batches.
+    busy_time : float
+        total time in seconds workers spent on processing batches.
+    producer_wait : float
+        total time in seconds the producer waited for a free place in the prefetch window.
+    consumer_wait : float
+        total time in seconds the consumer waited for a ready batch.
+    """
+    def __init__(self, prefetch=0, n_workers=0, order='strict'):
+        self.prefetch = prefetch
+        self.n_workers = n_workers
+        self.order = order
+        self.submitted = 0
+        self.completed = 0
+        self.yielded = 0
+        self.dropped = 0
+        self.busy_time = 0.
+        self.producer_wait = 0.
+        self.consumer_wait = 0.
+        self._depth_sum = 0
+        self._depth_samples = 0
+        self._running = set()
+        self._lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.end_time = None
+
+    def add(self, name, value=1):
+        """ Increase a counter """
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def submit(self, future):
+        """ Count a batch sent to a worker """
+        with self._lock:
+            self.submitted += 1
+            self._running.add(future)
+        future.add_done_callback(self.complete)
+
+    def complete(self, future):
+        """ Count a processed batch (only once, however many times it is called for the same future) """
+        with self._lock:
+            if future in self._running:
+                self._running.remove(future)
+                self.completed += 1
+
+    @contextmanager
+    def wait(self, name):
+        """ Measure time spent in a block as a wait time of the producer or the consumer """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def sample_depth(self):
+        """ Remember the current queue depth to calculate its mean """
+        with self._lock:
+            self._depth_sum += self.queue_depth
+            self._depth_samples += 1
+
+    def finish(self):
+        """ Stop the clock """
+        self.end_time = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        """ float : time in seconds since prefetching has started """
+        return (self.end_time or time.perf_counter()) - self.start_time
+
+    @property
+    def queue_depth(self):
+        """ int : the number of batches which are being processed or wait for the consumer """
+        return self.submitted - self.yielded - self.dropped
+
+    @property
+    def in_progress(self):
+        """ int : the number of batches which are being processed """
+        return self.submitted - self.completed
+
+    @property
+    def ready(self):
+        """ int : the number of processed batches which wait for the consumer """
+        return max(self.completed - self.yielded - self.dropped, 0)
+
+    @property
+    def mean_queue_depth(self):
+        """ float : the mean queue depth at the moments the consumer takes batches """
+        return self._depth_sum / self._depth_samples if self._depth_samples else 0.
+
+    @property
+    def utilization(self):
+        """ float : a share of time workers were busy """
+        total = self.elapsed * self.n_workers
+        return self.busy_time / total if total > 0 else 0.
+
+    def as_dict(self):
+        """ Return all statistics as a dict """
+        names = ['prefetch', 'n_workers', 'order', 'submitted', 'completed', 'yielded', 'dropped',
+                 'queue_depth', 'in_progress', 'ready', 'mean_queue_depth',
+                 'busy_time', 'producer_wait', 'consumer_wait', 'elapsed', 'utilization']
+        return {name: getattr(self, name) for name in names}
+
+    def __repr__(self):
+        items = ', '.join('%s=%s' % (name, round(value, 3) if isinstance(value, float) else repr(value))
+                          for name, value in self.as_dict().items())
+        return '%s(%s)' % (type(self).__name__, items)
@@ -0,0 +1,114 @@
+""" Contains a lightweight profiler of pipeline actions """
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+
+_CURRENT = threading.local()
+
+
+def record_compilation(name, **values):
+    """ Add a record of a function compilation to a profiler which records in the current thread """
+    profiler = getattr(_CURRENT, 'profiler', None)
+    if profiler is not None:
+        profiler.record(profiler.get_action_id(('jit', name), 'jit: ' + name), **values)
+
+
+class ActionProfiler:
+    """ Record execution times of pipeline actions into preallocated ring buffers
+
+    Each record takes a few numpy scalar assignments, so profiling hardly slows a pipeline down.
+    A dataframe is created only when records are requested.
+
+    Compilations of numba functions (e.g. :func:`~.mjit` methods) which happen in a thread while the profiler
+    is :meth:`.recording` are recorded as actions named ``'jit: <function name>'``
+    (see :func:`~.jit.track_compile_time`).
+
+    Parameters
+    ----------
+    capacity : int
+        the maximum number of records to keep. When buffers are full, the oldest records are overwritten.
+
+    Examples
+    --------
+    >>> profiler = ActionProfiler()
+    >>> profiler.record(profiler.get_action_id(key, 'load #0'), iter=1, batch_id=id(batch),
+    ...                 start_time=start, total_time=.5, cpu_time=.4, eval_expr_time=.01)
+    >>> profiler.to_dataframe()
+    """
+    COLUMNS = dict(action=np.int32, iter=np.int64, batch_id=np.int64, start_time=np.float64,
+                   total_time=np.float64, cpu_time=np.float64, eval_expr_time=np.float64)
+
+    def __init__(self, capacity=2**16):
+        self.capacity = capacity
+        self.buffers = {name: np.zeros(capacity, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        self.names = []
+        self._ids = {}
+        self.n_records = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.n_records, self.capacity)
+
+    @contextmanager
+    def recording(self):
+        """ Record compilations of numba functions in the current thread into this profiler """
+        previous = getattr(_CURRENT, 'profiler', None)
+        _CURRENT.profiler = self
+        try:
+            yield self
+        finally:
+            _CURRENT.profiler = previous
+
+    def get_action_id(self, key, name):
+        """ Return an integer id of an action
+
+        Parameters
+        ----------
+        key : hashable
+            a unique key of an action (e.g. ``id(action)``).
+        name : str or callable
+            an action name or a function which returns it (called only once for each `key`).
+        """
+        action_id = self._ids.get(key)
+        if action_id is None:
+            with self._lock:
+                action_id = self._ids.get(key)
+                if action_id is None:
+                    action_id = len(self.names)
+                    self.names.append(name() if callable(name) else name)
+                    self._ids[key] = action_id
+        return action_id
+
+    def record(self, action, **values):
+        """ Add a record
+
+        Parameters
+        ----------
+        action : int
+            an action id (see :meth:`.get_action_id`).
+        values
+            values of other columns: `iter`, `batch_id`, `start_time`, `total_time`, `cpu_time`, `eval_expr_time`.
+        """
+        buffers = self.buffers
+        with self._lock:
+            pos = self.n_records % self.capacity
+            self.n_records += 1
+            buffers['action'][pos] = action
+            for name, value in values.items():
+                buffers[name][pos] = value
+
+    def reset(self):
+        """ Remove all records """
+        with self._lock:
+            self.n_records = 0
+
+    def to_dataframe(self):
+        """ Return records in chronological order as a dataframe indexed by action names """
+        with self._lock:
+            size = len(self)
+            positions = (np.arange(size) + self.n_records) % self.capacity if self.n_records > size else slice(size)
+            data = {name: buffer[positions] for name, buffer in self.buffers.items() if name != 'action'}
+            actions = np.array(self.names, dtype=object)[self.buffers['action'][positions]]
+        return pd.DataFrame(data, index=pd.Index(actions, name='action'))
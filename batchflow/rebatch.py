@@ -0,0 +1,112 @@
+""" Contains a buffer which collects items of incoming batches into batches of a given size """
+from collections import deque
+
+import numpy as np
+
+from .dsindex import DatasetIndex
+
+
+class RebatchBuffer:
+    """ Collect items of incoming batches into batches of a given size
+
+    Unlike :meth:`.Batch.merge`, which concatenates all pending batches and then concatenates the rest again,
+    the buffer keeps incoming component arrays as they are and copies each item exactly once:
+
+    - if all items of an output batch come from one incoming batch, its components are just views
+      of the incoming arrays, so nothing is copied at all;
+    - otherwise, output arrays are preallocated and each item is copied into its place.
+
+    Items left over after an output batch are kept as views into incoming arrays.
+
+    Parameters
+    ----------
+    batch_size : int
+        the size of output batches.
+    components : str, tuple or None
+        components to put into output batches (default is the components of the first incoming batch).
+    batch_class : type or None
+        a class of output batches (default is the class of the first incoming batch).
+
+    Examples
+    --------
+    >>> buffer = RebatchBuffer(64)
+    >>> for batch in batches:
+    ...     buffer.put(batch)
+    ...     while len(buffer) >= 64:
+    ...         yield buffer.get()
+    >>> if len(buffer) > 0:
+    ...     yield buffer.get()
+    """
+    def __init__(self, batch_size, components=None, batch_class=None):
+        self.batch_size = batch_size
+        self.components = (components,) if isinstance(components, str) else components
+        self.batch_class = batch_class
+        self._parts = deque()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def put(self, batch):
+        """ Add items of a batch """
+        if self.components is None:
+            self.components = batch.components or (None,)
+        if self.batch_class is None:
+            self.batch_class = type(batch)
+
+        data = [batch.get(component=comp) for comp in self.components]
+        for comp, value in zip(self.components, data):
+            if value is not None and not isinstance(value, np.ndarray):
+                raise TypeError("Unknown data type of component %s" % comp, type(value))
+        if len(batch) > 0:
+            self._parts.append((len(batch), data))
+            self._len += len(batch)
+
+    def get(self):
+        """ Return a batch of `batch_size` items (or all buffered items if there are fewer of them) """
+        size = min(self.batch_size, self._len)
+        if size == 0:
+            return None
+
+        # slices of incoming arrays which make up the batch
+        parts = []
+        n_items = 0
+        while n_items < size:
+            part_len, data = self._parts[0]
+            n_taken = min(part_len, size - n_items)
+            if n_taken == part_len:
+                self._parts.popleft()
+                parts.append(data)
+            else:
+                parts.append([value[:n_taken] if value is not None else None for value in data])
+                rest = [value[n_taken:] if value is not None else None for value in data]
+                self._parts[0] = part_len - n_taken, rest
+            n_items += n_taken
+        self._len -= size
+
+        new_data = [self._assemble(comp, [data[i] for data in parts], size)
+                    for i, comp in enumerate(self.components)]
+        batch = self.batch_class.from_data(DatasetIndex(size), tuple(new_data))
+        batch.components = tuple(self.components)
+        _ = batch.data
+        return batch
+
+    @staticmethod
+    def _assemble(component, values, size):
+        is_none = [value is None for value in values]
+        if all(is_none):
+            return None
+        if any(is_none):
+            raise ValueError('Component {} is None in some batches'.format(component))
+        if len(values) == 1:
+            return values[0]
+
+        item_shape = values[0].shape[1:]
+        if any(value.shape[1:] != item_shape for value in values):
+            raise ValueError('Component {} has different item shapes in different batches'.format(component))
+        result = np.empty((size, *item_shape), dtype=np.result_type(*values))
+        pos = 0
+        for value in values:
+            result[pos:pos + len(value)] = value
+            pos += len(value)
+        return result
@@ -5,7 +5,8 @@ from collections import OrderedDict
 from copy import copy, deepcopy
 import numpy as np
 
-from .. import Config, Sampler
+from ..config import Config
+from ..sampler import Sampler
 from ..named_expr import eval_expr
 
 class KV:
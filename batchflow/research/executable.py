@@ -4,8 +4,9 @@ import os
 import time
 from copy import copy, deepcopy
 import dill
-from ..named_expr import eval_expr
-from .. import Config, Pipeline, V, L
+from ..named_expr import eval_expr, V, L
+from ..config import Config
+from ..pipeline import Pipeline
 
 class PipelineStopIteration(StopIteration):
     """ Special pipeline StopIteration exception """
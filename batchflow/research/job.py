@@ -5,7 +5,7 @@ from collections import OrderedDict
 import random
 
 from ..named_expr import eval_expr
-from .. import inbatch_parallel
+from ..decorators import inbatch_parallel
 
 class Job:
     """ Contains one job. """
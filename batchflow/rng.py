@@ -0,0 +1,154 @@
+""" Contains a manager of independent random streams """
+import os
+import threading
+import itertools
+from contextlib import contextmanager
+import numpy as np
+
+
+# a first spawn key entry of thread streams, so they never coincide with streams requested by keys
+_LOCAL_KEY = 2**32 - 1
+
+# names of RandomState methods which are called differently in Generator
+GENERATOR_ALIASES = {
+    'randint': 'integers',
+    'random_sample': 'random',
+    'ranf': 'random',
+    'sample': 'random',
+}
+
+
+def _legacy_shape(shape, size):
+    # `size` is prepended to dimensions given as positional args, so a batch of such arrays can be drawn at once
+    if size is not None:
+        shape = (*np.atleast_1d(size), *shape)
+    return shape or None
+
+def _rand(rng):
+    def rand(*shape, size=None):
+        return rng.random(_legacy_shape(shape, size))
+    return rand
+
+def _randn(rng):
+    def randn(*shape, size=None):
+        return rng.standard_normal(_legacy_shape(shape, size))
+    return randn
+
+def _random_integers(rng):
+    def random_integers(low, high=None, size=None):
+        if high is None:
+            low, high = 1, low
+        return rng.integers(low, high, size=size, endpoint=True)
+    return random_integers
+
+def _tomaxint(rng):
+    def tomaxint(size=None):
+        return rng.integers(0, np.iinfo(np.int_).max, size=size, endpoint=True)
+    return tomaxint
+
+# RandomState methods which have no Generator counterparts with the same signature
+LEGACY_METHODS = {
+    'rand': _rand,
+    'randn': _randn,
+    'random_integers': _random_integers,
+    'tomaxint': _tomaxint,
+}
+
+
+def get_method(rng, name):
+    """ Return a distribution method of a generator or a random state
+
+    Legacy :class:`numpy.random.RandomState` names (e.g. ``randint`` or ``rand``) are accepted for generators too.
+    Returns None if there is no such method.
+    """
+    if not hasattr(rng, name) and isinstance(rng, np.random.Generator):
+        if name in LEGACY_METHODS:
+            return LEGACY_METHODS[name](rng)
+        name = GENERATOR_ALIASES.get(name, name)
+    return getattr(rng, name, None)
+
+
+_current = threading.local()
+
+@contextmanager
+def batch_random_streams(batch):
+    """ Make `batch` the source of random streams in the current thread (see :func:`get_current_stream`) """
+    previous = getattr(_current, 'batch', None)
+    _current.batch = batch
+    try:
+        yield
+    finally:
+        _current.batch = previous
+
+def get_current_stream(streams):
+    """ Return a stream of `streams` for a batch which is processed in the current thread
+
+    The stream depends on the batch :attr:`~.Batch.random_key` only, so it is the same no matter which thread
+    or process processes the batch. Outside of a pipeline a stream of the current thread is returned.
+    """
+    batch = getattr(_current, 'batch', None)
+    if batch is None or getattr(batch, 'random_key', None) is None:
+        return streams.local
+    return batch.get_random_stream(streams)
+
+
+class RandomStreams:
+    """ Independent random streams spawned from one root :class:`numpy.random.SeedSequence`
+
+    Streams are :class:`numpy.random.Generator` instances with :class:`numpy.random.PCG64` bit generators,
+    which are faster than :class:`numpy.random.RandomState` and statistically independent from each other.
+
+    - :meth:`.get` returns a stream for a key (e.g. a batch number). The same seed and key always give
+      the same stream no matter which thread or process draws from it, which makes parallel runs reproducible.
+    - :attr:`.local` is a stream of the current thread, so threads do not share one generator.
+      A forked process gets new streams instead of copies of the parent's ones.
+
+    Parameters
+    ----------
+    seed : None, int, sequence of int or np.random.SeedSequence
+        a root seed. If None, fresh entropy is taken from the OS.
+
+    Examples
+    --------
+    >>> streams = RandomStreams(42)
+    >>> streams.get(3).normal(size=10)      # the same values in any thread and in any run
+    >>> streams.local.uniform()
+    """
+    def __init__(self, seed=None):
+        self.root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._counter = itertools.count()
+
+    def seed_sequence(self, *key):
+        """ Return a seed sequence for a key of non-negative ints """
+        root = self.root
+        return np.random.SeedSequence(root.entropy, spawn_key=(*root.spawn_key, *key), pool_size=root.pool_size)
+
+    def get(self, *key):
+        """ Return a new stream for a key of non-negative ints """
+        return np.random.Generator(np.random.PCG64(self.seed_sequence(*key)))
+
+    @property
+    def local(self):
+        """ np.random.Generator : a stream of the current thread """
+        pid = os.getpid()
+        rng = getattr(self._local, 'rng', None)
+        if rng is None or self._local.pid != pid:
+            key = (_LOCAL_KEY, next(self._counter))
+            if pid != self._pid:
+                # counters are copied into forked processes, so pids are needed to tell their streams apart
+                key = (_LOCAL_KEY, pid) + key[1:]
+            rng = self.get(*key)
+            self._local.rng, self._local.pid = rng, pid
+        return rng
+
+    def __getstate__(self):
+        return dict(root=self.root, pid=self._pid)
+
+    def __setstate__(self, state):
+        self.__init__(state['root'])
+        self._pid = state['pid']
+
+
+random_streams = RandomStreams()
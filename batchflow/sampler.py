@@ -5,6 +5,8 @@ from copy import copy
 import numpy as np
 import scipy.stats as ss
 
+from .rng import RandomStreams, get_method, get_current_stream
+
 # if empirical probability of truncation region is less than
 # this number, truncation throws a ValueError
 SMALL_SHARE = 1e-2
@@ -107,10 +109,13 @@ class Sampler():
     ----------
     weight : float
         weight of Sampler self in mixtures.
+    streams : RandomStreams
+        random streams of the sampler, so that each batch, thread and process draws from its own stream.
     """
     def __init__(self, *args, **kwargs):
         self.__array_priority__ = 100
         self.weight = 1.0
+        self.streams = RandomStreams()
 
         # if dim is supplied, redefine sampling method
         if 'dim' in kwargs:
@@ -123,6 +128,12 @@ class Sampler():
             # redefine sample of self
             self.sample = stacked.sample
 
+    @property
+    def state(self):
+        """ np.random.Generator : sampler's random stream of a batch which is processed in the current thread,
+        or of the current thread outside of a pipeline """
+        return get_current_stream(self.streams)
+
     def sample(self, size):
         """ Sampling method of a sampler.
 
@@ -166,13 +177,13 @@ class Sampler():
         def concat_sample(size):
             """ Sampling procedure of a mixture of two samplers.
             """
-            _up_size = np.random.binomial(size, _normed[0])
+            _up_size = result.state.binomial(size, _normed[0])
             _low_size = size - _up_size
 
             _up = self.sample(size=_up_size)
             _low = other.sample(size=_low_size)
             _sample = np.concatenate([_up, _low])
-            sample = _sample[np.random.permutation(size)]
+            sample = _sample[result.state.permutation(size)]
 
             return sample
 
@@ -386,8 +397,7 @@ class NumpySampler(Sampler):
         name = _get_method_by_alias(name, 'np')
         self.name = name
         self._params = copy(kwargs)
-        self.state = np.random.RandomState(seed=seed)
-
+        self.streams = RandomStreams(seed)
 
     def sample(self, size):
         """ Sampling method of ``NumpySampler``.
@@ -404,7 +414,7 @@ class NumpySampler(Sampler):
         np.ndarray
             array of shape (size, Sampler's dimension).
         """
-        sampler = getattr(self.state, self.name)
+        sampler = get_method(self.state, self.name)
         sample = sampler(size=size, **self._params)
         if len(sample.shape) == 1:
             sample = sample.reshape(-1, 1)
@@ -427,14 +437,14 @@ class ScipySampler(Sampler):
     ----------
     name : str
         name of a distribution (class from `scipy.stats`).
-    state : int
+    state : np.random.Generator
         sampler's random state.
     """
     def __init__(self, name, seed=None, **kwargs):
         super().__init__(name, seed, **kwargs)
         name = _get_method_by_alias(name, 'ss')
         self.name = name
-        self.state = np.random.RandomState(seed=seed)
+        self.streams = RandomStreams(seed)
         self.distr = getattr(ss, self.name)(**kwargs)
 
     def sample(self, size):
@@ -503,8 +513,7 @@ class HistoSampler(Sampler):
         self.nonzero_probs_idx = np.asarray(self.probs != 0.0).nonzero()[0]
         self.nonzero_probs = self.probs[self.nonzero_probs_idx]
 
-        self.state = np.random.RandomState(seed=seed)
-        self.state_sampler = self.state.uniform
+        self.streams = RandomStreams(seed)
 
     def sample(self, size):
         """ Sampling method of ``HistoSampler``.
@@ -523,11 +532,12 @@ class HistoSampler(Sampler):
             array of shape (size, histo dimension).
         """
         # Choose bins to use according to non-zero probabilities
-        bin_nums = np.random.choice(self.nonzero_probs_idx, p=self.nonzero_probs, size=size)
+        state = self.state
+        bin_nums = state.choice(self.nonzero_probs_idx, p=self.nonzero_probs, size=size)
 
         # uniformly generate samples from selected boxes
         low, high = self.l_all[bin_nums], self.h_all[bin_nums]
-        return self.state_sampler(low=low, high=high)
+        return state.uniform(low=low, high=high)
 
     def update(self, points):
         """ Update bins of sampler's histogram by throwing in additional points.
@@ -0,0 +1,392 @@
+""" Contains a chunked columnar store of batch components """
+import os
+import json
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import numpy as np
+try:
+    import blosc
+except ImportError:
+    pass
+
+from .dsindex import DatasetIndex, ItemPositions
+
+
+META_FILE = 'meta.json'
+KEYS_FILE = 'keys.txt'
+LOCK_FILE = '.lock'
+CHUNK_NBYTES = 2**20
+
+# stores are appended to under a lock of their path, so batches can be dumped from several threads
+_LOCKS = defaultdict(threading.Lock)
+
+
+@contextmanager
+def _store_lock(path):
+    """ Lock a store directory for threads of this process and, where `fcntl` is available, for other processes """
+    with _LOCKS[os.path.abspath(path)]:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, LOCK_FILE), 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_atomic(path, data):
+    """ Write a file so that readers see either its old or its new content """
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ColumnStore:
+    """ A chunked columnar store of batch components
+
+    A store is a directory with one array for each component:
+
+    - compressed components are split into chunks of `chunk_size` items, each compressed with blosc
+      and saved into its own file,
+    - uncompressed components are kept in raw binary files which are memory mapped when read.
+
+    Item keys (e.g. batch indices) are kept in a separate file and are mapped to item positions in arrays,
+    so a position of an item within a chunk is found without reading other chunks.
+    Items with consecutive positions (e.g. batches of a dataset which was dumped in order) are read
+    with a single read of each file they are stored in.
+
+    A store can be passed as `preloaded` to :class:`~.Dataset`, since components are read only for
+    requested items::
+
+        store = ColumnStore('/path/to/store')
+        dataset = Dataset(store.index, batch_class=MyBatch, preloaded=store)
+
+    Parameters
+    ----------
+    path : str
+        a path to the store directory.
+    mode : 'r' or 'a'
+        whether to open the store for reading or to create it if needed and append items to it.
+
+    Examples
+    --------
+    Dump batches into a store and load them back::
+
+        pipeline.dump(fmt='store', dst='/path/to/store', components=('images', 'labels'))
+        pipeline.load(fmt='store', src='/path/to/store', dst=('images', 'labels'))
+    """
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.mode = mode
+        self.meta = None
+        self._keys = None
+        self._positions = None
+        self._mmaps = {}
+
+        if mode == 'r':
+            if not self._load_meta():
+                raise FileNotFoundError("Store not found: %s" % path)
+        else:
+            with _store_lock(path):
+                if not self._load_meta():
+                    self.meta = dict(n_items=0, key_dtype=None, keys_nbytes=0, components={})
+
+    def _load_meta(self):
+        """ Read meta of a store, which is replaced atomically on each append, so it is never seen half-written """
+        try:
+            with open(os.path.join(self.path, META_FILE), 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def __len__(self):
+        return self.meta['n_items']
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mmaps'] = {}
+        return state
+
+    def __contains__(self, component):
+        return component in self.meta['components']
+
+    def __getitem__(self, component):
+        if component not in self:
+            raise KeyError(component)
+        return StoreColumn(self, component)
+
+    def get(self, component, default=None):
+        """ Return a column of a component """
+        return self[component] if component in self else default
+
+    @property
+    def components(self):
+        """ tuple of str : names of stored components """
+        return tuple(self.meta['components'])
+
+    @property
+    def keys(self):
+        """ np.ndarray : keys of stored items """
+        if self._keys is None:
+            # keys of items which are being appended are beyond the size recorded in meta
+            with open(os.path.join(self.path, KEYS_FILE), 'rb') as f:
+                keys = f.read(self.meta.get('keys_nbytes', -1)).decode('utf-8').splitlines()
+            keys = np.array(keys[:len(self)])
+            if self.meta['key_dtype'] is not None:
+                keys = keys.astype(self.meta['key_dtype'])
+            self._keys = keys
+        return self._keys
+
+    @property
+    def index(self):
+        """ DatasetIndex : an index of stored items """
+        return DatasetIndex(self.keys)
+
+    def find(self, keys):
+        """ Return positions of items with given keys """
+        if self._positions is None:
+            self._positions = ItemPositions(self.keys)
+        return self._positions.get(keys)
+
+    def read(self, component, keys=None, positions=None):
+        """ Read items of a component
+
+        Parameters
+        ----------
+        component : str
+            a component name.
+        keys : sequence
+            item keys. If None, `positions` are used.
+        positions : sequence of int, slice or None
+            positions of items. If both `keys` and `positions` are None, all items are read.
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if keys is not None:
+            positions = self.find(np.asarray(keys).reshape(-1))
+        elif positions is None:
+            positions = slice(0, len(self))
+        if isinstance(positions, slice):
+            positions = np.arange(*positions.indices(len(self)))
+        positions = np.asarray(positions, dtype=np.int64)
+
+        meta = self.meta['components'][component]
+        if meta['compression'] is None:
+            return self._read_raw(component, positions)
+        return self._read_chunks(component, meta, positions)
+
+    def mmap(self, component):
+        """ Return a read-only memory map of an uncompressed component """
+        meta = self.meta['components'][component]
+        if meta['compression'] is not None:
+            raise ValueError("Component %s is compressed and cannot be memory mapped" % component)
+        if component not in self._mmaps:
+            shape = (len(self), *meta['shape'])
+            if len(self) == 0:
+                return np.empty(shape, dtype=meta['dtype'])
+            self._mmaps[component] = np.memmap(self._raw_file(component), dtype=meta['dtype'], mode='r', shape=shape)
+        return self._mmaps[component]
+
+    def _read_raw(self, component, positions):
+        data = self.mmap(component)
+        if len(positions) > 0 and _is_range(positions):
+            return np.array(data[positions[0]:positions[-1] + 1])
+        return data[positions].view(np.ndarray)
+
+    def _read_chunks(self, component, meta, positions):
+        chunk_size = meta['chunk_size']
+        result = np.empty((len(positions), *meta['shape']), dtype=meta['dtype'])
+        if len(positions) == 0:
+            return result
+
+        if _is_range(positions):
+            start, stop = positions[0], positions[-1] + 1
+            for chunk in range(start // chunk_size, (stop - 1) // chunk_size + 1):
+                chunk_start = chunk * chunk_size
+                chunk_stop = min(chunk_start + chunk_size, len(self))
+                begin, end = max(start, chunk_start), min(stop, chunk_stop)
+                out = result[begin - start:end - start]
+                if begin == chunk_start and end == chunk_stop:
+                    # a whole chunk is decompressed right into the result
+                    blosc.decompress_ptr(self._read_chunk_file(component, chunk), out.__array_interface__['data'][0])
+                else:
+                    out[:] = self._load_chunk(component, meta, chunk)[begin - chunk_start:end - chunk_start]
+            return result
+
+        chunks = positions // chunk_size
+        for chunk in np.unique(chunks):
+            mask = chunks == chunk
+            result[mask] = self._load_chunk(component, meta, chunk)[positions[mask] - chunk * chunk_size]
+        return result
+
+    def _read_chunk_file(self, component, chunk):
+        with open(self._chunk_file(component, chunk), 'rb') as f:
+            return f.read()
+
+    def _load_chunk(self, component, meta, chunk):
+        data = blosc.decompress(self._read_chunk_file(component, chunk))
+        return np.frombuffer(data, dtype=meta['dtype']).reshape(-1, *meta['shape'])
+
+    def _chunk_file(self, component, chunk):
+        return os.path.join(self.path, component, '%08d.blosc' % chunk)
+
+    def _raw_file(self, component):
+        return os.path.join(self.path, component + '.raw')
+
+    def append(self, keys, data, compression='blosc', chunk_size=None, clevel=5):
+        """ Append items to the store
+
+        Parameters
+        ----------
+        keys : sequence
+            keys of items.
+        data : dict
+            arrays of items for each component. All components of the store should be given.
+        compression : 'blosc' or None
+            how to store new components.
+        chunk_size : int or None
+            the number of items in a chunk of new compressed components (default is about 1Mb of data per chunk).
+        clevel : int
+            a compression level of new components.
+        """
+        if self.mode == 'r':
+            raise ValueError("The store is opened for reading only")
+        keys = np.asarray(keys).reshape(-1)
+        data = {comp: np.asarray(value) for comp, value in data.items()}
+
+        with _store_lock(self.path):
+            # the store might have been changed by another instance or process
+            self._load_meta()
+            self._check(keys, data)
+            os.makedirs(self.path, exist_ok=True)
+
+            for comp, value in data.items():
+                if comp not in self.meta['components']:
+                    self.meta['components'][comp] = _create_meta(value, compression, chunk_size, clevel)
+                meta = self.meta['components'][comp]
+                value = np.ascontiguousarray(value, dtype=meta['dtype'])
+                if meta['compression'] is None:
+                    with open(self._raw_file(comp), 'ab') as f:
+                        # bytes left by a failed append are overwritten
+                        f.truncate(len(self) * value.dtype.itemsize * int(np.prod(value.shape[1:])))
+                        f.write(value.tobytes())
+                else:
+                    self._append_chunks(comp, meta, value)
+
+            keys_path = os.path.join(self.path, KEYS_FILE)
+            keys_nbytes = self.meta.get('keys_nbytes')
+            if keys_nbytes is None:
+                keys_nbytes = os.path.getsize(keys_path) if os.path.exists(keys_path) else 0
+            new_keys = ''.join(str(key) + '\n' for key in keys).encode('utf-8')
+            with open(keys_path, 'ab') as f:
+                f.truncate(keys_nbytes)
+                f.write(new_keys)
+            self.meta['keys_nbytes'] = keys_nbytes + len(new_keys)
+            if self.meta['key_dtype'] is None:
+                self.meta['key_dtype'] = 'int64' if keys.dtype.kind in 'iu' else None
+            self.meta['n_items'] += len(keys)
+
+            # new items become visible to readers only when meta is replaced
+            _write_atomic(os.path.join(self.path, META_FILE), json.dumps(self.meta).encode('utf-8'))
+
+        self._keys, self._positions, self._mmaps = None, None, {}
+        return self
+
+    def _check(self, keys, data):
+        if len(self) > 0 and set(data) != set(self.components):
+            raise ValueError("Components %s should be given, not %s" % (self.components, tuple(data)))
+        for comp, value in data.items():
+            if value.dtype.kind == 'O':
+                raise TypeError("Component %s has an object dtype which cannot be stored" % comp)
+            if len(value) != len(keys):
+                raise ValueError("Component %s has %d items, while there are %d keys" % (comp, len(value), len(keys)))
+            meta = self.meta['components'].get(comp)
+            if meta is not None and tuple(meta['shape']) != value.shape[1:]:
+                raise ValueError("Component %s items should have shape %s, not %s" %
+                                 (comp, tuple(meta['shape']), value.shape[1:]))
+
+    def _append_chunks(self, component, meta, value):
+        os.makedirs(os.path.join(self.path, component), exist_ok=True)
+        chunk_size = meta['chunk_size']
+        chunk, tail_len = divmod(len(self), chunk_size)
+        if tail_len > 0:
+            # the last chunk is not full, so it is rewritten with new items
+            value = np.concatenate([self._load_chunk(component, meta, chunk), value])
+        for start in range(0, len(value), chunk_size):
+            part = value[start:start + chunk_size]
+            packed = blosc.compress(part.tobytes(), typesize=part.dtype.itemsize, clevel=meta['clevel'])
+            _write_atomic(self._chunk_file(component, chunk), packed)
+            chunk += 1
+
+
+class StoreColumn:
+    """ A component of a :class:`.ColumnStore` which reads items by keys on indexing
+
+    Examples
+    --------
+    >>> store['images'][batch.indices]
+    """
+    def __init__(self, store, component):
+        self.store = store
+        self.component = component
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, keys):
+        if isinstance(keys, slice):
+            return self.store.read(self.component, positions=keys)
+        return self.store.read(self.component, keys=keys)
+
+    @property
+    def dtype(self):
+        """ np.dtype : a type of items """
+        return np.dtype(self.store.meta['components'][self.component]['dtype'])
+
+    @property
+    def shape(self):
+        """ tuple of int : a shape of the whole component """
+        return (len(self), *self.store.meta['components'][self.component]['shape'])
+
+
+_STORES = {}
+
+def open_store(path):
+    """ Return a store opened for reading
+
+    Stores are cached until they are changed, so that item keys are not read again for each batch.
+    """
+    if isinstance(path, ColumnStore):
+        return path
+    stat = os.stat(os.path.join(path, META_FILE))
+    key = os.path.abspath(path)
+    version = stat.st_mtime_ns, stat.st_size
+    cached = _STORES.get(key)
+    if cached is None or cached[0] != version:
+        cached = _STORES[key] = version, ColumnStore(path)
+    return cached[1]
+
+
+def _create_meta(value, compression, chunk_size, clevel):
+    if compression not in (None, 'blosc'):
+        raise ValueError("Unknown compression %s" % compression)
+    item_nbytes = max(value[0].nbytes if len(value) > 0 else value.dtype.itemsize, 1)
+    return dict(dtype=value.dtype.str, shape=value.shape[1:], compression=compression,
+                chunk_size=chunk_size or max(CHUNK_NBYTES // item_nbytes, 1), clevel=clevel)
+
+
+def _is_range(positions):
+    return len(positions) == 1 or (np.diff(positions) == 1).all()
@@ -0,0 +1,353 @@
+""" Contains table sources which read only rows needed for batches and writers which append rows """
+import os
+import weakref
+import threading
+import queue as q
+from collections import OrderedDict
+
+import numpy as np
+try:
+    import pandas as pd
+except ImportError:
+    import _fake as pd
+try:
+    import pyarrow as pa
+    import pyarrow.feather as pa_feather
+    import pyarrow.parquet as pq
+    import pyarrow.ipc as pa_ipc
+except ImportError:
+    pass
+
+from .dsindex import ItemPositions
+
+
+class TableSource:
+    """ A table file which serves rows by their keys
+
+    A file is opened once, and item keys (values of `index_col` or row numbers) are mapped to row positions,
+    so rows for a batch are found with one vectorized lookup and taken by positions:
+
+    - 'csv' files are parsed once,
+    - 'feather' files are memory mapped as Arrow tables, so only pages with needed rows are read,
+    - 'parquet' files read only row groups which contain needed rows,
+    - 'hdf5' files in a table format read only needed rows, while those in a fixed format are read once.
+
+    Parameters
+    ----------
+    path : str
+        a file name.
+    fmt : 'csv', 'feather', 'parquet' or 'hdf5'
+        a file format.
+    index_col : str, int or None
+        a column with item keys. If None, keys are row numbers (or the index stored with a dataframe).
+    args, kwargs
+        parameters of a format reader (e.g. `key` for hdf5 or `columns`).
+
+    Examples
+    --------
+    >>> source = TableSource('/path/to/file.feather', 'feather', index_col='id')
+    >>> source.loc[batch.indices]
+    """
+    def __init__(self, path, fmt, *args, index_col=None, **kwargs):
+        self.path = path
+        self.fmt = fmt
+        self.index_col = index_col
+        self.args = args
+        self.kwargs = kwargs
+        self._frame = None
+        self._table = None
+        self._hdf_key = None
+        self._row_groups = None
+        self._stored_index = None
+        self._keys = None
+        self._positions = None
+
+        if fmt == 'csv':
+            self._frame = pd.read_csv(path, *args, index_col=index_col, **kwargs)
+        elif fmt == 'feather':
+            self._table = pa_feather.read_table(path, *args, memory_map=True, **kwargs)
+            if isinstance(index_col, int):
+                self.index_col = self._table.column_names[index_col]
+        elif fmt == 'parquet':
+            self._open_parquet()
+        elif fmt == 'hdf5':
+            self._open_hdf()
+        else:
+            raise ValueError('Unknown format %s' % fmt)
+
+    def _open_parquet(self):
+        parquet = pq.ParquetFile(self.path)
+        metadata = parquet.metadata
+        sizes = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+        self._row_groups = parquet, np.cumsum([0] + sizes)
+
+        if isinstance(self.index_col, int):
+            self.index_col = parquet.schema_arrow.names[self.index_col]
+        index_col = self.index_col
+        if index_col is None:
+            # an index saved with a dataframe
+            pandas_metadata = parquet.schema_arrow.pandas_metadata or {}
+            index_columns = [col for col in pandas_metadata.get('index_columns', []) if isinstance(col, str)]
+            index_col = self._stored_index = index_columns[0] if index_columns else None
+        if index_col is not None:
+            self._keys = parquet.read(columns=[index_col]).column(0).to_numpy()
+
+    def _open_hdf(self):
+        kwargs = self.kwargs.copy()
+        key = self.args[0] if self.args else kwargs.pop('key', None)
+        with pd.HDFStore(self.path, mode='r') as store:
+            key = key or store.keys()[0]
+            is_table = store.get_storer(key).is_table
+            if is_table:
+                self._keys = store.select_column(key, 'index').values
+        self._hdf_key = key
+        self.kwargs = kwargs
+        if not is_table:
+            self._frame = pd.read_hdf(self.path, key, **kwargs)
+
+    def __len__(self):
+        if self._frame is not None:
+            return len(self._frame)
+        if self._table is not None:
+            return self._table.num_rows
+        if self._row_groups is not None:
+            return int(self._row_groups[1][-1])
+        return len(self._keys)
+
+    @property
+    def keys(self):
+        """ np.ndarray : keys of rows """
+        if self._keys is None:
+            if self._frame is not None:
+                self._keys = self._frame.index.values
+            elif self._table is not None and self.index_col is not None:
+                self._keys = self._table.column(self.index_col).to_numpy()
+            else:
+                self._keys = np.arange(len(self))
+        return self._keys
+
+    def find(self, keys):
+        """ Return positions of rows with given keys """
+        if self._positions is None:
+            self._positions = ItemPositions(self.keys)
+        return self._positions.get(keys)
+
+    @property
+    def loc(self):
+        """ An indexer which returns a dataframe with rows for given keys (as `DataFrame.loc` does) """
+        return _LocIndexer(self)
+
+    def take(self, positions):
+        """ Return a dataframe with rows at given positions """
+        positions = np.asarray(positions, dtype=np.int64)
+        if self._frame is not None:
+            return self._frame.take(positions)
+        if self._table is not None:
+            frame = self._table.take(pa.array(positions)).to_pandas()
+            if self.index_col is not None:
+                frame = frame.set_index(self.index_col)
+            else:
+                frame.index = positions
+            return frame
+        if self._row_groups is not None:
+            return self._take_row_groups(positions)
+        # rows are selected in the order they are stored
+        order = np.argsort(positions, kind='stable')
+        frame = pd.read_hdf(self.path, self._hdf_key, where=positions[order], **self.kwargs)
+        return frame.take(np.argsort(order, kind='stable'))
+
+    def _take_row_groups(self, positions):
+        parquet, offsets = self._row_groups
+        groups = np.searchsorted(offsets, positions, side='right') - 1
+        used_groups = np.unique(groups)
+        columns = self.kwargs.get('columns')
+        if columns is not None and self.index_col is not None and self.index_col not in columns:
+            columns = [*columns, self.index_col]
+        table = parquet.read_row_groups(used_groups.tolist(), columns=columns, use_pandas_metadata=True)
+
+        # positions of rows within read groups
+        sizes = np.diff(offsets)[used_groups]
+        starts = np.cumsum(sizes) - sizes
+        local = positions - offsets[groups] + starts[np.searchsorted(used_groups, groups)]
+        frame = table.take(pa.array(local)).to_pandas()
+        if self.index_col is not None:
+            frame = frame.set_index(self.index_col)
+        elif self._stored_index is None:
+            frame.index = positions
+        return frame
+
+
+class _LocIndexer:
+    def __init__(self, source):
+        self.source = source
+
+    def __getitem__(self, keys):
+        return self.source.take(self.source.find(np.asarray(keys).reshape(-1)))
+
+
+# the maximum number of table sources kept open in a process
+MAX_OPEN_TABLES = 8
+
+_SOURCES = OrderedDict()
+_SOURCES_PID = [os.getpid()]
+_SOURCES_LOCK = threading.Lock()
+
+def open_table(path, fmt, *args, **kwargs):
+    """ Return a table source, which is opened once per process and reopened only if the file changes
+
+    At most :data:`MAX_OPEN_TABLES` sources are kept, and the least recently used ones are closed first
+    (see :func:`clear_tables`).
+    """
+    stat = os.stat(path)
+    key = os.path.abspath(path), fmt, repr(args), repr(sorted(kwargs.items()))
+    version = stat.st_mtime_ns, stat.st_size
+    with _SOURCES_LOCK:
+        if _SOURCES_PID[0] != os.getpid():
+            # sources inherited from a parent process are not reused
+            _SOURCES.clear()
+            _SOURCES_PID[0] = os.getpid()
+        cached = _SOURCES.get(key)
+        if cached is not None and cached[0] == version:
+            _SOURCES.move_to_end(key)
+            return cached[1]
+
+    source = TableSource(path, fmt, *args, **kwargs)
+    with _SOURCES_LOCK:
+        cached = _SOURCES.get(key)
+        if cached is not None and cached[0] == version:
+            # another thread has opened the same table
+            return cached[1]
+        _SOURCES[key] = version, source
+        _SOURCES.move_to_end(key)
+        while len(_SOURCES) > MAX_OPEN_TABLES:
+            _SOURCES.popitem(last=False)
+    return source
+
+def clear_tables():
+    """ Drop all table sources opened with :func:`open_table` """
+    with _SOURCES_LOCK:
+        _SOURCES.clear()
+
+
+class TableWriter:
+    """ Append dataframes to a table file in a background thread
+
+    Dataframes are put into a bounded queue and written by a separate thread,
+    so writing does not hold back threads which compute batches:
+
+    - 'feather' - record batches are appended to an Arrow IPC file (readable as feather v2),
+    - 'parquet' - each dataframe becomes a row group,
+    - 'hdf5' - rows are appended to a table,
+    - 'csv' - rows are appended to a text file with a header written once.
+
+    A file is created anew when the first dataframe is written.
+    A writer which is not closed explicitly is closed when it is garbage collected or at interpreter exit,
+    so the file is always finalized.
+
+    Parameters
+    ----------
+    path : str
+        a file name.
+    fmt : 'feather', 'parquet', 'hdf5' or 'csv'
+        a file format.
+    queue_size : int
+        the maximum number of dataframes waiting to be written. :meth:`.write` blocks when the queue is full.
+    key : str
+        a key of a table in an hdf5 file.
+    index : bool
+        whether to write a dataframe index.
+    kwargs
+        parameters of a format writer (e.g. `compression`).
+
+    Examples
+    --------
+    >>> writer = TableWriter('/path/to/file.parquet', 'parquet')
+    >>> for batch in batches:
+    ...     writer.write(batch.data)
+    >>> writer.close()
+    """
+    def __init__(self, path, fmt, queue_size=16, key='data', index=False, **kwargs):
+        if fmt not in ('feather', 'parquet', 'hdf5', 'csv'):
+            raise ValueError('Unknown format %s' % fmt)
+        self.path = path
+        self.fmt = fmt
+        self.key = key
+        self.index = index
+        self.kwargs = kwargs
+        self.n_rows = 0
+        self._writer = None
+        self._schema = None
+        self._error = None
+        self._queue = q.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._finalizer = weakref.finalize(self, self._stop_thread, self._queue, self._thread)
+
+    def write(self, frame):
+        """ Queue a dataframe to be appended to the file """
+        self._check_error()
+        if self._thread is None:
+            raise ValueError("The writer is closed")
+        self._queue.put(frame)
+
+    def flush(self):
+        """ Wait until all queued dataframes are written """
+        self._queue.join()
+        self._check_error()
+
+    def close(self):
+        """ Write all queued dataframes and close the file """
+        if self._thread is not None:
+            self._finalizer()
+            self._thread = None
+        self._check_error()
+
+    @staticmethod
+    def _stop_thread(queue, thread):
+        queue.put(None)
+        thread.join()
+
+    def _check_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            try:
+                if frame is None:
+                    self._close_file()
+                    return
+                if self._error is None:
+                    self._write(frame)
+            except Exception as e:  # pylint: disable=broad-except
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, frame):
+        if self.fmt in ('feather', 'parquet'):
+            if self._writer is None:
+                self._schema = pa.Schema.from_pandas(frame, preserve_index=self.index)
+                if self.fmt == 'feather':
+                    options = pa_ipc.IpcWriteOptions(**self.kwargs)
+                    self._writer = pa_ipc.new_file(self.path, self._schema, options=options)
+                else:
+                    self._writer = pq.ParquetWriter(self.path, self._schema, **self.kwargs)
+            table = pa.Table.from_pandas(frame, schema=self._schema, preserve_index=self.index)
+            self._writer.write_table(table)
+        elif self.fmt == 'hdf5':
+            if self._writer is None:
+                self._writer = pd.HDFStore(self.path, mode='w')
+            self._writer.append(self.key, frame, **self.kwargs)
+        else:
+            if self._writer is None:
+                self._writer = open(self.path, 'w', encoding='utf-8', newline='')  # pylint: disable=consider-using-with
+            frame.to_csv(self._writer, header=self.n_rows == 0, index=self.index, **self.kwargs)
+        self.n_rows += len(frame)
+
+    def _close_file(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,96 @@
+""" Test vectorized mode of apply_parallel """
+# pylint: disable=missing-docstring
+import numpy as np
+import pytest
+
+from batchflow import Batch, ImagesBatch, P, R
+
+
+class MyBatch(Batch):
+    components = ('images', 'labels')
+
+
+def make_batch(batch_class=MyBatch, size=8, shape=(4, 5, 3)):
+    images = np.arange(size * np.prod(shape), dtype=np.float64).reshape(size, *shape)
+    return batch_class(np.arange(size), preloaded=(images, np.arange(size)))
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_same_result(vectorized):
+    batch = make_batch()
+    expected = batch.images * 2 + 1
+    calls = []
+
+    def func(image, multiplier, term=0):
+        calls.append(image.shape)
+        return image * multiplier + term
+
+    batch.apply_parallel(func, 2, term=1, src='images', vectorized=vectorized)
+
+    assert np.allclose(batch.images, expected)
+    assert len(calls) == (1 if vectorized else len(batch))
+
+
+def test_per_item_args():
+    batch = make_batch()
+    multipliers = np.arange(len(batch))
+    expected = batch.images * multipliers[:, None, None, None]
+
+    batch.apply_parallel(lambda image, multiplier: image * multiplier, P(multipliers), src='images', vectorized=True)
+
+    assert np.allclose(batch.images, expected)
+
+
+def test_probability():
+    batch = make_batch()
+    mask = np.array([1, 0] * (len(batch) // 2))
+    expected = np.where(mask[:, None, None, None], -batch.images, batch.images)
+
+    batch.apply_parallel(np.negative, src='images', dst='negated', p=P(mask), vectorized=True)
+
+    assert np.allclose(batch.negated, expected)
+
+
+def test_no_items_selected():
+    batch = make_batch()
+    batch.apply_parallel(np.negative, src='images', dst='negated', p=P(np.zeros(len(batch))), vectorized=True)
+
+    assert np.array_equal(batch.negated, batch.images)
+    assert not np.shares_memory(batch.negated, batch.images)
+
+
+def test_ragged_fallback():
+    images = np.empty(3, dtype=object)
+    images[:] = [np.ones((2, 2)), np.ones((3, 3)), np.ones((4, 4))]
+    batch = MyBatch(np.arange(3), preloaded=(images, np.arange(3)))
+    calls = []
+
+    def func(image):
+        calls.append(image.shape)
+        return image * 2
+
+    batch.apply_parallel(func, src='images', vectorized=True)
+
+    assert len(calls) == 3
+    assert all((image == 2).all() for image in batch.images)
+
+
+@pytest.mark.parametrize('action, kwargs', [
+    ('multiply', dict(multiplier=P(R('uniform', 0.5, 1.5)))),
+    ('add', dict(term=.5)),
+    ('clip', dict(low=10, high=100)),
+    ('invert', dict(channels=[0, 2])),
+    ('flip', dict(mode=P(R(['lr', 'ud'])))),
+])
+def test_images_batch(action, kwargs):
+    batch = make_batch(ImagesBatch)
+    images = batch.images.copy()
+    kwargs = {name: P(value.get(batch=batch, parallel=True)) if isinstance(value, P) else value
+              for name, value in kwargs.items()}
+
+    getattr(batch, action)(**kwargs, src='images')
+
+    for i, image in enumerate(images):
+        item_kwargs = {name: value.name[i] if isinstance(value, P) else value for name, value in kwargs.items()}
+        expected = getattr(batch, '_' + action + '_')(image, **item_kwargs)
+        assert np.allclose(batch.images[i], expected)
@@ -0,0 +1,174 @@
+""" Test storage modes of ImagesBatch """
+# pylint: disable=missing-docstring, redefined-outer-name
+import os
+
+import numpy as np
+import pytest
+import PIL
+
+from batchflow import Dataset, FilesIndex, ImagesBatch, P, action, inbatch_parallel
+from batchflow.image_patches import extract_patches
+
+
+class ArrayImagesBatch(ImagesBatch):
+    storage = 'array'
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    for i in range(4):
+        image = rng.integers(0, 256, size=(12, 16, 3), dtype=np.uint8)
+        PIL.Image.fromarray(image).save(os.path.join(str(tmp_path), '%d.png' % i))
+    return str(tmp_path)
+
+
+def get_batch(image_dir, batch_class):
+    index = FilesIndex(path=os.path.join(image_dir, '*.png'), no_ext=True, sort=True)
+    batch = Dataset(index, batch_class=batch_class).next_batch(4, shuffle=False)
+    return batch.load(fmt='image', src=image_dir, dst='images')
+
+
+def test_load(image_dir):
+    batch = get_batch(image_dir, ArrayImagesBatch)
+    assert batch.images.shape == (4, 12, 16, 3)
+    assert batch.images.dtype == np.uint8 and batch.images.flags.c_contiguous
+    assert batch.image_shape == (12, 16, 3)
+
+    pil_batch = get_batch(image_dir, ImagesBatch)
+    assert (batch.images == np.stack([np.asarray(image) for image in pil_batch.images])).all()
+
+
+@pytest.mark.parametrize('transform', [
+    lambda batch: batch.crop(origin=(2, 3), shape=(8, 6)),
+    lambda batch: batch.crop(origin=(10, 8), shape=(8, 6)),
+    lambda batch: batch.flip(mode='ud'),
+    lambda batch: batch.rotate(angle=30),
+    lambda batch: batch.resize(size=(8, 6)),
+    lambda batch: batch.invert(),
+    lambda batch: batch.scale(factor=.5, preserve_shape=True),
+])
+def test_same_transforms(image_dir, transform):
+    pil_batch = transform(get_batch(image_dir, ImagesBatch))
+    batch = transform(get_batch(image_dir, ArrayImagesBatch))
+    assert batch.images.dtype == np.uint8 and batch.images.ndim == 4
+    assert (batch.images == np.stack([np.asarray(image) for image in pil_batch.images])).all()
+
+
+def test_ragged(image_dir):
+    batch = get_batch(image_dir, ArrayImagesBatch)
+    batch.resize(size=(8, 6), p=P([1, 0, 1, 0]))
+    assert batch.images.dtype == object
+    assert batch.images[0].shape == (6, 8, 3) and batch.images[1].shape == (12, 16, 3)
+
+    batch.crop(origin='top_left', shape=(4, 4))
+    assert batch.images.shape == (4, 4, 4, 3) and batch.images.dtype == np.uint8
+
+
+def test_to_array(image_dir):
+    batch = get_batch(image_dir, ArrayImagesBatch)
+    batch.to_array()
+    images = batch.images
+    assert images.dtype == np.float32 and images.shape == (4, 12, 16, 3)
+    batch.to_array()
+    assert batch.images is images
+
+    pil_batch = get_batch(image_dir, ImagesBatch).to_array(channels='first')
+    batch.to_array(channels='first')
+    assert batch.images.shape == (4, 3, 12, 16)
+    assert (batch.images == pil_batch.images).all()
+
+
+
+class FusedImagesBatch(ImagesBatch):
+    fuse_geometry = True
+
+
+class FusedArrayImagesBatch(ArrayImagesBatch):
+    fuse_geometry = True
+
+
+class ThreadedImagesBatch(FusedArrayImagesBatch):
+    @action
+    @inbatch_parallel(init='indices', target='threads')
+    def read_items(self, ix, items):
+        items[ix] = np.asarray(self.get(ix, 'images'))
+
+
+def to_arrays(images):
+    return np.stack([np.asarray(image) for image in images])
+
+
+@pytest.mark.parametrize('batch_class', [FusedImagesBatch, FusedArrayImagesBatch])
+@pytest.mark.parametrize('transform', [
+    lambda batch: batch.crop(origin=(2, 3), shape=(8, 6)).flip(mode='lr').shift(offset=(1, 2)),
+    lambda batch: batch.flip(mode='ud').crop(origin=(10, 8), shape=(8, 6)),
+    lambda batch: batch.rotate(angle=90, expand=True).crop(origin=(1, 1), shape=(5, 5)),
+    lambda batch: batch.scale(factor=2, preserve_shape=True),
+    lambda batch: batch.resize(size=(8, 6), resample=PIL.Image.NEAREST),
+])
+def test_fused_exact(image_dir, batch_class, transform):
+    """ transforms without interpolation give the same images as if they are applied one by one """
+    expected = to_arrays(transform(get_batch(image_dir, ImagesBatch)).images)
+    batch = transform(get_batch(image_dir, batch_class))
+    assert 'images' in batch._warps  # pylint: disable=protected-access
+    assert (to_arrays(batch.images) == expected).all()
+    assert not batch._warps  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize('batch_class', [FusedImagesBatch, FusedArrayImagesBatch])
+def test_fused_interpolation(image_dir, batch_class):
+    expected = to_arrays(get_batch(image_dir, ImagesBatch).rotate(angle=30, resample=PIL.Image.BILINEAR).images)
+    batch = get_batch(image_dir, batch_class).rotate(angle=30, resample=PIL.Image.BILINEAR)
+    assert np.abs(to_arrays(batch.images).astype(np.int64) - expected).max() <= 1
+
+
+def test_fused_masks(image_dir):
+    batch = get_batch(image_dir, FusedArrayImagesBatch)
+    batch.masks = batch.images[..., :1].copy()
+    angles = np.array([10, 20, 30, 40])
+    components = ['images', 'masks']
+    batch.rotate(angle=P(angles), src=components, dst=components, p=.5)
+    batch.crop(origin='center', shape=(8, 8), src=components, dst=components)
+    assert set(batch._warps) == {'images', 'masks'}  # pylint: disable=protected-access
+    assert batch.masks.shape == (4, 8, 8, 1)
+    assert not batch._warps  # pylint: disable=protected-access
+    assert (batch.masks == batch.images[..., :1]).all()
+    assert batch.images.shape == (4, 8, 8, 3)
+
+
+def test_fused_threads(image_dir):
+    """ threads which request items while they are resampled get resampled images """
+    expected = get_batch(image_dir, FusedArrayImagesBatch).rotate(angle=30).crop(origin='center', shape=(8, 6))
+    for _ in range(10):
+        items = {}
+        batch = get_batch(image_dir, ThreadedImagesBatch).rotate(angle=30).crop(origin='center', shape=(8, 6))
+        batch.read_items(items)
+        assert all((items[ix] == expected.get(ix, 'images')).all() for ix in batch.indices)
+
+
+def test_not_fused(image_dir):
+    batch = get_batch(image_dir, FusedImagesBatch)
+    expected = get_batch(image_dir, ImagesBatch).shift(offset=(3, 2), mode='wrap')
+    batch.shift(offset=(3, 2), mode='wrap')
+    assert not batch._warps  # pylint: disable=protected-access
+    assert (to_arrays(batch.images) == to_arrays(expected.images)).all()
+
+
+@pytest.mark.parametrize('drop_last', [False, True])
+def test_extract_patches(drop_last):
+    images = np.random.default_rng(0).random((2, 11, 16, 3))
+    patches = extract_patches(images, (4, 8), (3, 4), drop_last)
+    rows = [0, 3, 6] if drop_last else [0, 3, 6, 7]
+    expected = [image[row:row + 4, column:column + 8] for image in images for row in rows for column in [0, 4, 8]]
+    assert patches.flags.c_contiguous
+    assert (patches == np.stack(expected)).all()
+
+
+@pytest.mark.parametrize('batch_class', [ImagesBatch, ArrayImagesBatch])
+def test_patches_round_trip(image_dir, batch_class):
+    batch = get_batch(image_dir, batch_class)
+    batch.split_to_patches(patch_shape=(8, 6), stride=(3, 4), dst='patches')
+    assert len(batch.patches) == 4 * 3 * 4
+    batch.assemble_from_patches(image_shape=(12, 16), stride=(3, 4), src='patches', dst='assembled')
+    assert (batch.assembled == to_arrays(batch.images)).all()
@@ -6,6 +6,7 @@ import pandas as pd
 
 sys.path.append('../..')
 from batchflow.components import create_item_class
+from batchflow.dsindex import ItemPositions
 from batchflow.utils import is_iterable
 
 
@@ -237,3 +238,27 @@ class TestNoComponents:
         assert (full == np.arange(SIZE) + 100).all()
         assert (a12_68 == np.arange(12, 68) + 100).all()
         assert (a38 == 138).all()
+
+
+@pytest.mark.parametrize('dtype', ['int', 'str'])
+@pytest.mark.parametrize('use_pos', [False, True])
+def test_find_in_index(dtype, use_pos):
+    indices = np.random.permutation(SIZE)
+    indices = indices.astype(str) if dtype == 'str' else indices
+    pos = ItemPositions(indices) if use_pos else None
+    comps = create_item_class(('images',), (np.arange(SIZE),), indices, crop=False, pos=pos)
+
+    items = indices[[5, 0, 17, 5]]
+    assert comps.find_in_index(indices[17]) == 17
+    assert (comps.find_in_index(items) == [5, 0, 17, 5]).all()
+    assert (comps.get_pos('images', list(items)) == [5, 0, 17, 5]).all()
+    with pytest.raises(KeyError):
+        comps.find_in_index(i(SIZE + 1, dtype))
+    with pytest.raises(KeyError):
+        _ = comps[i(SIZE + 1, dtype)]
+
+
+def test_find_in_index_repeated():
+    comps = create_item_class(('images',), (np.arange(5),), np.array([3, 1, 3, 2, 1]), crop=False)
+    assert comps.find_in_index(3) == 0
+    assert (comps.find_in_index([1, 2]) == [1, 3]).all()
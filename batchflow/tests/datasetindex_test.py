@@ -8,6 +8,7 @@ import pytest
 import numpy as np
 
 from batchflow import DatasetIndex
+from batchflow.dsindex import ItemPositions
 
 @pytest.mark.parametrize('constructor', [5,
                                          range(10, 20, 2),
@@ -44,3 +45,34 @@ def test_create_batch_child():
         pass
     dsi = ChildSet(5)
     assert isinstance(dsi.create_batch(range(5)), ChildSet)
+
+@pytest.mark.parametrize('index, engine', [(np.arange(10), 'range'),
+                                           (np.arange(10)[::-1], 'sorted'),
+                                           (np.arange(10).astype(str), 'sorted'),
+                                           (np.array([0, 'a', 2.5, 3, 'b', 5, 6, 7, 8, 9], dtype=object), 'hash')])
+def test_item_positions(index, engine):
+    pos = ItemPositions(index)
+    items = index[[7, 2, 7]]
+    assert pos.engine == engine
+    assert pos[index[3]] == 3
+    assert (pos.get(items) == [7, 2, 7]).all()
+    assert (pos.get(list(items)) == [7, 2, 7]).all()
+    assert (pos.isin([index[1], 'missing']) == [True, False]).all()
+    assert 'missing' not in pos
+    with pytest.raises(KeyError):
+        pos.get([index[1], 'missing'])
+
+@pytest.mark.parametrize('index', [10, np.arange(10)[::-1], np.arange(10).astype(str)])
+def test_get_pos_iterable(index):
+    dsi = DatasetIndex(index)
+    items = dsi.indices[[7, 2, 7]]
+    assert (dsi.get_pos(items) == [7, 2, 7]).all()
+    assert (dsi.get_pos(iter(items)) == [7, 2, 7]).all()
+    with pytest.raises(KeyError):
+        dsi.get_pos([items[0], 'missing'])
+
+def test_split_subsets_positions():
+    dsi = DatasetIndex(np.arange(100, 200))
+    dsi.split([0.6, 0.3])
+    assert (dsi.get_pos(dsi.test.indices) == np.arange(10, 40)).all()
+    assert (dsi.train.get_pos(dsi.train.indices[::-1]) == np.arange(60)[::-1]).all()
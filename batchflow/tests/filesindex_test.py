@@ -3,6 +3,7 @@
 # pylint: disable=protected-access
 # pylint: disable=redefined-outer-name
 import os
+import glob
 import shutil
 
 from contextlib import ExitStack as does_not_raise
@@ -11,6 +12,8 @@ import pytest
 import numpy as np
 
 from batchflow import FilesIndex, DatasetIndex
+from batchflow import dsindex
+from batchflow.dsindex import walk_glob
 
 
 @pytest.fixture(scope='module')
@@ -78,6 +81,21 @@ def test_build_from_index(files_setup):
     dsindex = DatasetIndex(files)
     findex = FilesIndex(index=dsindex, paths=paths, dirs=False)
     assert len(dsindex) == len(findex)
+    assert dict(findex.paths) == paths
+
+def test_paths(files_setup):
+    path, _, _ = files_setup
+    findex = FilesIndex(path=os.path.join(path, '*'), sort=True)
+    assert findex.paths.array.dtype == object
+    assert findex.paths['file_1.txt'] == os.path.join(path, 'file_1.txt')
+    assert 'file_1.txt' in findex.paths and 'file_5.txt' not in findex.paths
+    assert list(findex.paths) == list(findex.indices)
+    with pytest.raises(KeyError):
+        _ = findex.paths['file_5.txt']
+
+    merged = FilesIndex.concat(findex, FilesIndex(index=['new_file.txt'], paths=['/path/to/new_file.txt']))
+    assert merged.paths['new_file.txt'] == '/path/to/new_file.txt'
+    assert merged.paths['file_2.txt'] == findex.paths['file_2.txt']
 
 def test_get_full_path(files_setup):
     path, _, _ = files_setup
@@ -98,3 +116,40 @@ def test_create_subset(files_setup, index):
     assert isinstance(new_findex.indices, np.ndarray)
     assert os.path.dirname(full_path) == path
     assert os.path.basename(full_path) == file_name
+
+@pytest.mark.parametrize('pattern', ['*', '*/*', '**', '**/*.txt', 'folder/file_[01].txt', 'folder'])
+@pytest.mark.parametrize('dirs', [False, True])
+def test_walk_glob(files_setup, pattern, dirs):
+    path, _, _ = files_setup
+    pattern = os.path.join(path, pattern)
+    check_fn = os.path.isdir if dirs else os.path.isfile
+    expected = [name for name in glob.glob(pattern, recursive=True) if check_fn(name)]
+    if pattern.endswith('**'):
+        # a root directory itself is not included
+        expected = [name for name in expected if os.path.basename(name)]
+    assert sorted(walk_glob(pattern, dirs=dirs, n_workers=2)) == sorted(expected)
+
+def test_build_with_cache(files_setup, tmp_path, monkeypatch):
+    path, folder1, _ = files_setup
+    path = os.path.join(path, folder1, '*')
+    cache = str(tmp_path / 'index.npz')
+    findex = FilesIndex(path=path, no_ext=True, cache=cache)
+    assert os.path.exists(cache)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(dsindex, 'walk_glob', None)
+        cached = FilesIndex(path=path, no_ext=True, cache=cache)
+    assert (cached.indices == findex.indices).all()
+    assert cached.get_fullpath('file_1') == findex.get_fullpath('file_1')
+
+    # another argument makes another index
+    assert len(FilesIndex(path=path, cache=cache).indices[0].split('.')) == 2
+
+    new_file = os.path.join(os.path.dirname(path), 'new_file.txt')
+    with open(new_file, 'w', encoding='utf-8'):
+        pass
+    try:
+        updated = FilesIndex(path=path, no_ext=True, cache=cache)
+    finally:
+        os.remove(new_file)
+    assert 'new_file' in updated.indices
@@ -0,0 +1,102 @@
+""" Test the cache of decoded images """
+# pylint: disable=missing-docstring, redefined-outer-name
+import os
+
+import numpy as np
+import pytest
+import PIL
+
+from batchflow import Dataset, FilesIndex, ImagesBatch
+from batchflow.image_cache import ImageCache, decode_image
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    for i in range(6):
+        image = rng.integers(0, 256, size=(8, 10, 3), dtype=np.uint8)
+        PIL.Image.fromarray(image).save(os.path.join(str(tmp_path), '%d.png' % i))
+    return str(tmp_path)
+
+
+def load_images(image_dir, cache):
+    dataset = Dataset(FilesIndex(path=os.path.join(image_dir, '*.png'), no_ext=True), batch_class=ImagesBatch)
+    pipeline = dataset.p.load(fmt='image', src=image_dir, dst='images', cache=cache)
+    images = {}
+    for batch in pipeline.gen_batch(3, n_epochs=1, shuffle=False):
+        images.update(zip(batch.indices, batch.images))
+    return images
+
+
+def test_load(image_dir):
+    cache = ImageCache()
+    first = load_images(image_dir, cache)
+    assert cache.misses == 6 and cache.hits == 0
+    second = load_images(image_dir, cache)
+    assert cache.hits == 6 and cache.hit_rate == .5
+    assert cache.nbytes == 6 * 8 * 10 * 3
+    for key, image in first.items():
+        assert isinstance(image, PIL.Image.Image)
+        assert (np.asarray(image) == np.asarray(second[key])).all()
+        assert (np.asarray(image) == np.asarray(PIL.Image.open(os.path.join(image_dir, key + '.png')))).all()
+
+
+def test_transform(image_dir):
+    cache = ImageCache(transform=lambda image: image[::2, ::2])
+    images = load_images(image_dir, cache)
+    assert all(image.size == (5, 4) for image in images.values())
+    assert cache.nbytes == 6 * 4 * 5 * 3
+
+
+def test_eviction():
+    cache = ImageCache(max_bytes=250)
+    for key in range(3):
+        image = cache.get(key, lambda: np.zeros(100, dtype=np.uint8))
+        assert not image.flags.writeable
+    assert len(cache) == 2 and 0 not in cache
+    assert cache.nbytes == 200
+
+    cache.get(1, None)
+    cache.get(3, lambda: np.zeros(100, dtype=np.uint8))
+    assert 1 in cache and 2 not in cache
+
+
+def test_spill(tmp_path):
+    cache = ImageCache(max_bytes=250, spill_dir=str(tmp_path), max_spill_bytes=150)
+    for key in range(4):
+        cache.get(key, lambda key=key: np.full(100, key, dtype=np.uint8))
+    assert 0 not in cache and 1 in cache
+    assert cache.spill_nbytes == 100 and len(os.listdir(str(tmp_path))) == 1
+
+    image = cache.get(1, None)
+    assert (image == 1).all()
+    assert cache.spill_hits == 1 and cache.misses == 4
+
+    cache.clear()
+    assert len(cache) == 0 and cache.nbytes == 0
+    assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.mark.parametrize('mode', ['P', '1', 'I;16', 'L'])
+def test_decode_modes(tmp_path, mode):
+    path = str(tmp_path / 'image.png')
+    array = (np.arange(8 * 10).reshape(8, 10) % 4).astype(np.uint8)
+    if mode == 'P':
+        image = PIL.Image.fromarray(array, mode='L').convert('P')
+        image.putpalette([0, 0, 0, 255, 0, 0, 0, 255, 0, 0, 0, 255] * 64)
+    elif mode == '1':
+        image = PIL.Image.fromarray(array > 1)
+    elif mode == 'I;16':
+        image = PIL.Image.fromarray(array.astype(np.uint16) * 1000)
+    else:
+        image = PIL.Image.fromarray(array)
+    image.save(path)
+
+    result = decode_image(path)
+    with PIL.Image.open(path) as loaded:
+        expected = np.asarray(loaded.convert('L') if mode == '1' else loaded)
+    assert result.shape == (8, 10)
+    assert result.dtype == expected.dtype
+    assert (result == expected).all()
+    if mode == 'I;16':
+        assert result.max() == 3000
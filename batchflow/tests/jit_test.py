@@ -0,0 +1,60 @@
+""" Test the persistent cache of jit-compiled methods """
+# pylint: disable=missing-docstring
+import os
+import sys
+import subprocess
+
+import pytest
+
+pytest.importorskip('numba')
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+MODULE = '''
+import numpy as np
+from batchflow import Batch, action, mjit
+
+class MyBatch(Batch):
+    @action
+    @mjit
+    def total(self, data):
+        result = 0.
+        for value in data:
+            result += value
+        return result
+'''
+
+SCRIPT = '''
+import sys
+import numpy as np
+from batchflow.jit import set_jit_cache, warm_up
+set_jit_cache(path=sys.argv[1])
+from batchflow.profiler import ActionProfiler
+from jitted import MyBatch
+
+profiler = ActionProfiler()
+with profiler.recording():
+    warm_up(MyBatch.total, (np.zeros(3),))
+    assert MyBatch(np.arange(3)).total(np.arange(4.)) == 6
+print(' '.join(profiler.names))
+'''
+
+
+def run(directory):
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([ROOT, directory, os.environ.get('PYTHONPATH', '')])}
+    return subprocess.check_output([sys.executable, os.path.join(directory, 'script.py'),
+                                    os.path.join(directory, 'cache')], env=env, universal_newlines=True).split()
+
+
+def test_cache(tmp_path):
+    directory = str(tmp_path)
+    with open(os.path.join(directory, 'jitted.py'), 'w', encoding='utf-8') as file:
+        file.write(MODULE)
+    with open(os.path.join(directory, 'script.py'), 'w', encoding='utf-8') as file:
+        file.write(SCRIPT)
+
+    assert 'MyBatch.total' in run(directory)
+    assert len(os.listdir(os.path.join(directory, 'cache'))) > 0
+    # the second process loads the method from the cache instead of compiling it
+    assert 'MyBatch.total' not in run(directory)
@@ -0,0 +1,37 @@
+""" Test that heavy dependencies are imported only when features which need them are used """
+# pylint: disable=missing-docstring
+import os
+import sys
+import subprocess
+
+import pytest
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+HEAVY_MODULES = ['numba', 'scipy', 'sklearn', 'PIL', 'matplotlib', 'dask', 'skimage']
+
+
+def imported_modules(statement):
+    """ Return heavy modules imported after a statement is executed in a fresh interpreter """
+    code = '{}; import sys; print(" ".join(m for m in {!r} if m in sys.modules))'.format(statement, HEAVY_MODULES)
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')])}
+    output = subprocess.check_output([sys.executable, '-c', code], env=env, universal_newlines=True)
+    return set(output.split())
+
+
+@pytest.mark.parametrize('statement, expected', [
+    ('import batchflow', set()),
+    ('from batchflow import Dataset, Pipeline, Batch, B, V, action, inbatch_parallel', set()),
+    ('from batchflow import ImagesBatch', {'scipy', 'PIL'}),
+])
+def test_lazy_imports(statement, expected):
+    assert imported_modules(statement) == expected
+
+
+def test_public_names():
+    import batchflow    # pylint: disable=import-outside-toplevel
+    for name in batchflow.__all__:
+        assert getattr(batchflow, name) is not None
+    assert batchflow.decorators.worker_pools is not None
+    with pytest.raises(AttributeError):
+        _ = batchflow.no_such_name
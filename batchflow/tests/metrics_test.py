@@ -12,6 +12,8 @@ Test data is pre-defined, it's shape and contents were chosen for reasons
 of balance between visual simplicity and test coverage diversity.
 """
 # pylint: disable=import-error, no-name-in-module, invalid-name, protected-access
+import pickle
+
 import numpy as np
 import pytest
 
@@ -417,3 +419,90 @@ class TestSubsampling:
         metric = SegmentationMetricsByInstances(TARGETS, LABELS, 'labels', NUM_CLASSES)
         with pytest.raises(ValueError):
             getattr(metric, 'true_negative')()
+
+class TestStreaming:
+    """Check that streaming metrics keep only aggregates and evaluate item metrics
+    the same way as metrics which keep confusion matrices of all items.
+    """
+
+    @staticmethod
+    def gather(streaming, **kwargs):
+        rng = np.random.RandomState(0)
+        metrics = None
+        for _ in range(3):
+            targets = rng.randint(0, NUM_CLASSES, size=(4, 5, 5))
+            predictions = rng.randint(0, NUM_CLASSES, size=(4, 5, 5))
+            batch_metrics = SegmentationMetricsByPixels(targets, predictions, 'labels', NUM_CLASSES,
+                                                        streaming=streaming, **kwargs)
+            if metrics is None:
+                metrics = batch_metrics
+            else:
+                metrics.update(batch_metrics)
+        return metrics
+
+    @pytest.mark.parametrize('multiclass', ['macro', 'micro', None])
+    def test_item_metrics(self, multiclass):
+        """Check that averaged item metrics coincide with those without streaming."""
+        metrics = self.gather(False)
+        streaming = self.gather(True, item_metrics={'iou': dict(multiclass=multiclass), 'accuracy': {}})
+        assert streaming._confusion_matrix.shape == (1, NUM_CLASSES, NUM_CLASSES)
+        assert streaming.targets is None
+        assert np.array_equal(streaming.confusion_matrix, metrics.confusion_matrix)
+        assert np.allclose(streaming.evaluate('jaccard', multiclass=multiclass),
+                           metrics.evaluate('jaccard', multiclass=multiclass))
+        assert np.isclose(streaming.evaluate('accuracy'), metrics.evaluate('accuracy'))
+
+    def test_pooled_metrics(self):
+        """Check that metrics without per-item sums are evaluated for all items combined."""
+        streaming = self.gather(True)
+        pooled = SegmentationMetricsByPixels(np.array([0]), np.array([0]), 'labels', NUM_CLASSES)
+        pooled._confusion_matrix = self.gather(False).confusion_matrix[np.newaxis]
+        assert np.allclose(streaming.evaluate('recall', multiclass=None), pooled.evaluate('recall', multiclass=None))
+
+    def test_merge(self):
+        """Check merging of pickled streaming metrics and of incompatible metrics."""
+        metrics = self.gather(True, item_metrics='iou')
+        copy = pickle.loads(pickle.dumps(metrics))
+        copy.update(metrics)
+        assert np.array_equal(copy.confusion_matrix, 2 * metrics.confusion_matrix)
+        assert np.isclose(copy.evaluate('iou'), metrics.evaluate('iou'))
+        with pytest.raises(ValueError):
+            metrics.update(self.gather(True))
+        with pytest.raises(ValueError):
+            metrics.update(self.gather(False))
+
+    def test_ignored_targets(self):
+        """Check that pixels with targets out of classes are not counted."""
+        targets = np.where(TARGETS == 2, 255, TARGETS)
+        metrics = SegmentationMetricsByPixels(targets, LABELS, 'labels', NUM_CLASSES)
+        assert metrics.total_population().tolist() == [2, 4]
+        assert metrics._confusion_matrix[:, :, 2].sum() == 0
+
+class TestInstanceMatching:
+    """Check that instances matched at once are counted as by matching each pair of instances."""
+
+    @staticmethod
+    def reference_confusion(metrics):
+        """Match instances one by one."""
+        confusion = np.zeros_like(metrics._confusion_matrix)
+        for k in range(1, metrics.num_classes):
+            for i, item_instances in enumerate(metrics.target_instances[k-1]):
+                for coords in item_instances:
+                    hits = np.sum(metrics.predictions[i][coords] == k)
+                    confusion[i, k-1, int(hits / len(coords[0]) >= metrics.iot), 1] += 1
+            for i, item_instances in enumerate(metrics.predicted_instances[k-1]):
+                for coords in item_instances:
+                    hits = np.sum(metrics.targets[i][coords] == k)
+                    if hits == 0 or len(coords[0]) / hits < metrics.iot:
+                        confusion[i, k-1, 1, 0] += 1
+        return confusion
+
+    @pytest.mark.parametrize('num_classes', [2, 4])
+    def test_random_masks(self, num_classes):
+        """Compare confusion matrices for random masks with many instances."""
+        rng = np.random.RandomState(0)
+        targets = rng.randint(0, num_classes, size=(3, 30, 30))
+        predictions = np.where(rng.rand(3, 30, 30) < .8, targets, rng.randint(0, num_classes, size=(3, 30, 30)))
+        metrics = SegmentationMetricsByInstances(targets, predictions, 'labels', num_classes)
+        assert metrics._confusion_matrix.sum() > 100
+        assert np.array_equal(metrics._confusion_matrix, self.reference_confusion(metrics))
@@ -2,10 +2,12 @@
 import sys
 from contextlib import ExitStack as does_not_raise
 
+import numpy as np
 import pytest
 
 sys.path.append('..')
 from batchflow import B, C, D, F, L, V, R, P, I, Dataset, Pipeline
+from batchflow.named_expr import has_named_expr, expr_level, compile_expr, STATIC, PER_RUN, PER_BATCH, PER_ITEM
 
 
 @pytest.mark.parametrize('named_expr', [
@@ -105,3 +107,79 @@ def test_d(size, n_splits):
             pipeline.run(1)
 
             assert pipeline.v('indices') == result[:start] + result[end:]
+
+
+@pytest.mark.parametrize('expr, expected', [
+    (1, False),
+    ((1, 'a', [2, {'b': 3}]), False),
+    (B('size'), True),
+    ((1, [2, {'b': V('var')}]), True),
+    ({C('option'): 1}, True),
+])
+def test_has_named_expr(expr, expected):
+    assert has_named_expr(expr) is expected
+
+
+@pytest.mark.parametrize('expr, level', [
+    ((1, [2, {'b': 3}]), STATIC),
+    (C('option'), PER_RUN),
+    ({'a': C('option') * 2 + 1}, PER_RUN),
+    (C('expr'), PER_BATCH),
+    (C('option', default=B('size')), PER_BATCH),
+    ([C('option'), B('size')], PER_BATCH),
+    (R('normal', 0, 1), PER_BATCH),
+    (P(R('normal', 0, 1)), PER_ITEM),
+])
+def test_expr_level(expr, level):
+    config = {'option': 1, 'expr': B('size')}
+    assert expr_level(expr, config) == level
+
+
+def test_compile_expr():
+    pipeline = Dataset(10).pipeline({'option': 3, 'expr': B('size')})
+    batch = pipeline.dataset.create_batch(list(range(4)))
+    batch.pipeline = pipeline
+    const = [1, {'b': 2}]
+    expr = dict(a=C('option') * B('size'), b=C('expr'), c=const, d=(C('option'), -C('option')))
+
+    cache = {}
+    evaluate = compile_expr(expr, cache=cache, config=pipeline.config)
+    result = evaluate(batch=batch, pipeline=pipeline)
+    assert result == dict(a=12, b=4, c=const, d=(3, -3))
+    assert result['c'] is const
+    assert len(cache) == 2
+
+    # cached values are used until the cache is cleared
+    pipeline.config['option'] = 5
+    assert evaluate(batch=batch, pipeline=pipeline)['a'] == 12
+    cache.clear()
+    assert evaluate(batch=batch, pipeline=pipeline)['a'] == 20
+
+
+@pytest.mark.parametrize('expr, shape', [
+    (R('normal', 0, 1), (10,)),
+    (R('normal', 0, 1, size=3), (10, 3)),
+    (R('normal', R('uniform', 0, 1), 1, size=(2, 2)), (10, 2, 2)),
+    (R(['a', 'b'], p=[.5, .5]), (10,)),
+    (R('uniform', 0, R('uniform', 1, 2) * 2), (10,)),
+    (R('permutation', 5), (10, 5)),
+    (R([1, 2, 3], size=2, replace=False), (10, 2)),
+])
+def test_p_r_items(expr, shape):
+    batch = Dataset(10).create_batch(list(range(10)))
+    values = P(expr).get(batch=batch, parallel=True)
+    assert values.shape == shape
+
+
+def test_p_r_ragged_items():
+    batch = Dataset(10).create_batch(list(range(10)))
+    values = P(R('normal', 0, 1, size=R('randint', 3, 8))).get(batch=batch, parallel=True)
+    assert values.dtype == object and len(values) == 10
+    assert all(3 <= len(item) < 8 for item in values)
+
+
+def test_p_r_same_stream():
+    # values for all items are drawn at once, but from the same random stream as one by one
+    values = R('uniform', 0, 1, seed=42).get_items(5)
+    expr = R('uniform', 0, 1, seed=42)
+    assert np.allclose(values, [expr.get() for _ in range(5)])
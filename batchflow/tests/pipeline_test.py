@@ -0,0 +1,93 @@
+""" Test execution of pipeline actions """
+# pylint: disable=missing-docstring, redefined-outer-name
+import numpy as np
+import pytest
+
+from batchflow import Dataset, Pipeline, Batch, B, C, V, action
+
+
+class MyBatch(Batch):
+    components = ('images',)
+
+    @action
+    def add(self, value, src='images'):
+        setattr(self, src, getattr(self, src) + value)
+        return self
+
+    @action
+    def store_arg(self, arg):
+        self.pipeline.get_variable('args').append(arg)
+        return self
+
+
+@pytest.fixture
+def dataset():
+    return Dataset(10, batch_class=MyBatch, preloaded=(np.zeros((10, 2)),))
+
+
+def test_constant_args(dataset):
+    arg = dict(a=[1, 2])
+    pipeline = (dataset.p
+                .init_variable('args', [])
+                .store_arg(arg)
+                .store_arg(dict(a=B('size')))
+               )
+    pipeline.run(2, n_epochs=1)
+
+    args = pipeline.v('args')
+    assert len(args) == 10
+    # constant arguments are not copied, while named expressions are evaluated for each batch
+    assert all(item is arg for item in args[::2])
+    assert all(item == dict(a=2) for item in args[1::2])
+
+
+def test_action_plan(dataset):
+    nested = Pipeline().add(10)
+    pipeline = (dataset.p
+                .init_variable('sum', 0)
+                .add(1)
+                .update(V('sum'), B.images.sum())
+                .add(V('sum'))
+               )
+    pipeline.append_pipeline(nested)
+
+    batch = pipeline.next_batch(5, shuffle=False)
+    assert (batch.images == 21).all()
+
+    # the plan is compiled once for each run
+    plan = pipeline._action_plan                            # pylint: disable=protected-access
+    assert len(plan) == 4
+    assert plan[-1]['plan'] is not None
+    assert not plan[0]['eval_args'] and plan[2]['eval_args']
+    pipeline.next_batch(5, shuffle=False)
+    assert pipeline._action_plan is plan                    # pylint: disable=protected-access
+
+
+def test_join(dataset):
+    other = Dataset(10, batch_class=MyBatch, preloaded=(np.ones((10, 2)),))
+    pipeline = (dataset.p
+                .init_variable('args', [])
+                .join(other)
+                .store_arg()
+                .merge(other.p.add(1).run(5, shuffle=False, lazy=True))
+               )
+
+    batch = pipeline.next_batch(5, shuffle=False)
+    assert isinstance(pipeline.v('args')[0], tuple)
+    assert len(batch) == 10
+    assert (batch.images[5:] == 2).all()
+
+
+def test_config_cache(dataset):
+    pipeline = (dataset.pipeline({'value': 1})
+                .init_variable('args', [])
+                .store_arg(C('value'))
+                .update(C('value'), C('value') + 1)
+                .store_arg(C('value'))
+               )
+    pipeline.run(5, n_epochs=1)
+    assert pipeline.v('args') == [1, 2, 2, 3]
+
+    pipeline.set_config({'value': 10})
+    pipeline.run(5, n_epochs=1)
+    assert pipeline.v('args')[4:] == [10, 11, 11, 12]
@@ -0,0 +1,165 @@
+""" Test prefetching batches in worker processes """
+# pylint: disable=missing-docstring, redefined-outer-name
+import gc
+import os
+import sys
+import time
+import concurrent.futures as cf
+
+import numpy as np
+import pytest
+
+from batchflow import Dataset, Batch, action
+from batchflow.exceptions import SkipBatchException
+from batchflow.prefetch import SharedMemoryExecutor, is_shared_memory_available
+
+
+requires_shm = pytest.mark.skipif(not is_shared_memory_available(), reason="shared memory is not available")
+
+SIZE = 40
+IMAGES = np.arange(SIZE * 6, dtype=np.float32).reshape(SIZE, 2, 3)
+
+
+class MyBatch(Batch):
+    components = 'images', 'labels'
+
+    @action
+    def process(self, src='images', dst='labels'):
+        setattr(self, src, getattr(self, src) * 2 + 1)
+        setattr(self, dst, np.full(len(self), os.getpid()))
+        return self
+
+    @action
+    def skip_odd(self):
+        if self.indices[0] % 2:
+            raise SkipBatchException
+        return self
+
+    @action
+    def sleep_first(self, delay):
+        if self.indices[0] == 0:
+            time.sleep(delay)
+        return self
+
+    @action
+    def fail(self):
+        raise ValueError('failed in a worker')
+
+
+@pytest.fixture
+def dataset():
+    return Dataset(SIZE, batch_class=MyBatch, preloaded=(IMAGES, np.zeros(SIZE)))
+
+
+@requires_shm
+def test_same_result(dataset):
+    pipeline = dataset.p.process()
+    batches = list(pipeline.gen_batch(4, n_epochs=1, prefetch=2, target='mpc'))
+
+    assert len(batches) == SIZE // 4
+    images = np.concatenate([batch.images for batch in batches])
+    assert (np.sort(images.ravel()) == np.arange(SIZE * 6) * 2 + 1).all()
+    assert all(batch.pipeline is pipeline for batch in batches)
+    assert all((batch.labels != os.getpid()).all() for batch in batches)
+
+@requires_shm
+def test_shared_memory_views(dataset):
+    pipeline = dataset.p.process()
+    batch = next(pipeline.gen_batch(4, n_epochs=1, prefetch=1, target='mpc'))
+    pipeline.reset('iter')
+
+    assert not batch.images.flags.owndata
+    assert batch.images.flags.writeable
+    batch.images[:] = 0
+
+@requires_shm
+def test_arrays_outlive_executor(dataset, monkeypatch):
+    errors = []
+    monkeypatch.setattr(sys, 'unraisablehook', errors.append)
+    images = [batch.images for batch in dataset.p.process().gen_batch(4, n_epochs=1, prefetch=2, target='mpc')]
+    gc.collect()
+    assert np.concatenate(images).shape == (SIZE, 2, 3)
+
+    del images
+    gc.collect()
+    assert not errors
+
+@requires_shm
+def test_skip_batch(dataset):
+    pipeline = dataset.p.skip_odd().process()
+    batches = list(pipeline.gen_batch(1, n_epochs=1, prefetch=2, target='mpc'))
+    assert sorted(batch.indices[0] for batch in batches) == list(range(0, SIZE, 2))
+
+@requires_shm
+def test_local_batch_class():
+    class LocalBatch(MyBatch):
+        pass
+
+    dataset = Dataset(SIZE, batch_class=LocalBatch, preloaded=(np.zeros((SIZE, 3)), np.zeros(SIZE)))
+    batches = list(dataset.p.process().gen_batch(8, n_epochs=1, prefetch=2, target='mpc'))
+    assert all(isinstance(batch, LocalBatch) for batch in batches)
+
+@requires_shm
+def test_executor_error(dataset):
+    pipeline = dataset.p.fail()
+    executor = SharedMemoryExecutor(max_workers=2, shared=[pipeline, dataset, dataset.data])
+    batch = dataset.create_batch(np.arange(4))
+    try:
+        with pytest.raises(ValueError, match='failed in a worker'):
+            executor.submit(pipeline.execute_for, batch).result(timeout=30)
+    finally:
+        executor.shutdown()
+
+@requires_shm
+def test_shutdown_cancels_futures(dataset):
+    pipeline = dataset.p.sleep_first(1)
+    executor = SharedMemoryExecutor(max_workers=1, shared=[pipeline, dataset, dataset.data])
+    futures = [executor.submit(pipeline.execute_for, dataset.create_batch(np.arange(i, i + 4)))
+               for i in range(0, SIZE, 4)]
+    executor.shutdown()
+
+    # waiting for unfinished tasks should not hang after shutdown
+    _, not_done = cf.wait(futures, timeout=10)
+    assert not not_done
+    assert any(future.cancelled() for future in futures)
+
+@requires_shm
+def test_slots_reuse(dataset):
+    pipeline = dataset.p.process()
+    executor = SharedMemoryExecutor(max_workers=2, shared=[pipeline, dataset, dataset.data], n_slots=2)
+    try:
+        for start in range(0, SIZE, 4):
+            batch = executor.submit(pipeline.execute_for, dataset.create_batch(np.arange(start, start + 4)))
+            batch = batch.result(timeout=30)
+            assert (batch.images == IMAGES[start:start + 4] * 2 + 1).all()
+            assert not batch.images.flags.owndata
+        # a slot is released as soon as the batch using it is deleted
+        assert executor._free_slots.qsize() == 1      # pylint:disable=protected-access
+        del batch
+        assert executor._free_slots.qsize() == 2      # pylint:disable=protected-access
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.parametrize('order', ['strict', 'any'])
+def test_prefetch_order(dataset, order):
+    pipeline = dataset.p.sleep_first(.5)
+    batches = list(pipeline.gen_batch(4, n_epochs=1, prefetch=3, prefetch_order=order))
+
+    first = [batch.indices[0] for batch in batches]
+    assert sorted(first) == list(range(0, SIZE, 4))
+    assert (first[0] == 0) == (order == 'strict')
+
+def test_prefetch_stats(dataset):
+    pipeline = dataset.p.skip_odd().sleep_first(.1)
+    for _ in pipeline.gen_batch(1, n_epochs=1, prefetch=2):
+        assert 0 <= pipeline.prefetch_stats.queue_depth <= 3
+    stats = pipeline.prefetch_stats
+
+    assert stats.n_workers == 3
+    assert stats.submitted == stats.completed == SIZE
+    assert stats.yielded == stats.dropped == SIZE // 2
+    assert stats.queue_depth == stats.ready == stats.in_progress == 0
+    assert stats.consumer_wait > 0
+    assert 0 < stats.utilization <= 1
+    assert set(stats.as_dict()) >= {'utilization', 'producer_wait', 'consumer_wait', 'mean_queue_depth'}
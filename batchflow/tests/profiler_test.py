@@ -0,0 +1,90 @@
+""" Test profiling of pipeline actions """
+# pylint: disable=missing-docstring, redefined-outer-name
+import numpy as np
+import pytest
+
+from batchflow import Dataset, Batch, action
+from batchflow.profiler import ActionProfiler, record_compilation
+
+
+class MyBatch(Batch):
+    components = ('images',)
+
+    @action
+    def add(self, value, src='images'):
+        setattr(self, src, getattr(self, src) + value)
+        return self
+
+
+@pytest.fixture
+def pipeline():
+    dataset = Dataset(20, batch_class=MyBatch, preloaded=(np.zeros((20, 2)),))
+    return dataset.p.add(1).add(2)
+
+
+def test_ring_buffer():
+    profiler = ActionProfiler(capacity=4)
+    ids = [profiler.get_action_id(key, name) for key, name in [('a', 'first'), ('b', lambda: 'second'), ('a', 'x')]]
+    assert ids == [0, 1, 0]
+
+    for i in range(6):
+        profiler.record(i % 2, iter=i, total_time=i / 10)
+
+    assert len(profiler) == 4
+    df = profiler.to_dataframe()
+    assert df['iter'].tolist() == [2, 3, 4, 5]
+    assert df.index.tolist() == ['first', 'second', 'first', 'second']
+    assert df.index.name == 'action'
+
+    profiler.reset()
+    assert len(profiler.to_dataframe()) == 0
+
+
+def test_record_compilation():
+    first, second = ActionProfiler(), ActionProfiler()
+    with first.recording():
+        record_compilation('func', total_time=1.)
+    record_compilation('other', total_time=1.)
+
+    assert first.to_dataframe().index.tolist() == ['jit: func']
+    assert len(second) == 0
+
+
+def test_profile(pipeline):
+    pipeline.run(5, n_epochs=1, profile=True)
+
+    info = pipeline.profile_info
+    assert len(info) == 8
+    assert set(info.index) == {'add #0', 'add #1'}
+    assert (info['total_time'] >= 0).all() and (info['cpu_time'] >= 0).all()
+    assert sorted(info['iter'].unique()) == [1, 2, 3, 4]
+
+    # records are accumulated across runs
+    pipeline.run(5, n_epochs=1, profile=True)
+    assert len(pipeline.profile_info) == 16
+
+    result = pipeline.show_profile_info()
+    assert set(result.index) == {'add #0', 'add #1'}
+    assert ('cpu_time', 'mean') in result.columns
+
+    per_iter = pipeline.show_profile_info(per_iter=True)
+    assert 'cpu_time' in per_iter.columns
+
+    with pytest.raises(ValueError):
+        pipeline.show_profile_info(detailed=True)
+
+
+def test_profile_detailed(pipeline):
+    pipeline.run(10, n_epochs=1, profile='detailed')
+
+    info = pipeline.profile_info
+    assert info.index.names == ['action', 'id']
+    assert set(info.index.get_level_values('action')) == {'add #0', 'add #1'}
+
+    result = pipeline.show_profile_info(detailed=True)
+    assert len(result) > 0
+
+
+def test_no_profile(pipeline):
+    pipeline.run(10, n_epochs=1)
+    assert pipeline.profile_info is None
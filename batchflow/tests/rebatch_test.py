@@ -4,6 +4,7 @@ import numpy as np
 import pytest
 
 from batchflow import Dataset, Pipeline, Batch
+from batchflow.rebatch import RebatchBuffer
 
 
 class MyBatch(Batch):
@@ -69,3 +70,46 @@ def test_merge(merge_factor):
     assert merged.dummy.shape[0] == b.dummy.shape[0] * merge_factor
     assert merged.dummy.shape[1] == b.dummy.shape[1]
     assert rest is None
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+@pytest.mark.parametrize('batch_size, rebatch_size', [(7, 10), (10, 3), (12, 12)])
+def test_rebatch_items(batch_size, rebatch_size, prefetch):
+    """ items go through rebatch exactly once and in the same order """
+    data = np.arange(DATASET_SIZE * 2).reshape(-1, 2)
+    dataset = Dataset(index=DATASET_SIZE, batch_class=MyBatch, preloaded=(data,))
+
+    items = []
+    p = (Pipeline()
+         .rebatch(rebatch_size)
+         .call(lambda batch: items.append(batch.dummy))
+         ) << dataset
+    p.run(batch_size=batch_size, n_epochs=1, shuffle=False, prefetch=prefetch)
+
+    assert [len(item) for item in items] == [rebatch_size] * (DATASET_SIZE // rebatch_size) + \
+                                            [DATASET_SIZE % rebatch_size] * (DATASET_SIZE % rebatch_size > 0)
+    result = np.concatenate(items)
+    if prefetch == 0:
+        assert (result == data).all()
+    else:
+        assert (np.sort(result[:, 0]) == data[:, 0]).all()
+
+
+def test_rebatch_buffer():
+    """ items of several batches are put into one array, items of one batch keep their array """
+    first = MyBatch(index=np.arange(5), preloaded=(np.arange(5, dtype=np.int32),))
+    second = MyBatch(index=np.arange(5), preloaded=(np.arange(5, 10, dtype=np.float32),))
+    buffer = RebatchBuffer(4)
+    buffer.put(first)
+    buffer.put(second)
+    assert len(buffer) == 10
+
+    batch = buffer.get()
+    assert batch.dummy.tolist() == [0, 1, 2, 3]
+    assert batch.dummy.dtype == np.int32
+    batch = buffer.get()
+    assert batch.dummy.tolist() == [4, 5, 6, 7]
+    assert batch.dummy.dtype == np.float64
+    assert len(buffer) == 2
+    assert buffer.get().dummy.tolist() == [8, 9]
+    assert buffer.get() is None
@@ -7,6 +7,8 @@ Verifies the correctness of evaluated metrics for the cases:
 """
 # pylint: disable=import-error, no-name-in-module
 # pylint: disable=missing-docstring
+import pickle
+
 import pytest
 import numpy as np
 np.seterr(divide='ignore', invalid='ignore')
@@ -32,8 +34,9 @@ PARAMS_DEFINED = [(None, 'mae', [1.5, 0.25]),
 
 @pytest.mark.parametrize('targets, predictions, weights', [([[1, 1], [2, 2]], [[1, 0], [4, 2]], [1, 3])])
 @pytest.mark.parametrize('output_agg, metric_name, exp_res', PARAMS_DEFINED)
-def test_defined_values(targets, predictions, weights, output_agg, metric_name, exp_res):
-    metrics = RegressionMetrics(targets, predictions, weights=weights, multi=True)
+@pytest.mark.parametrize('streaming', [False, True])
+def test_defined_values(targets, predictions, weights, output_agg, metric_name, exp_res, streaming):
+    metrics = RegressionMetrics(targets, predictions, weights=weights, multi=True, streaming=streaming)
     res = metrics.evaluate(metrics=metric_name, agg=output_agg)
     assert np.allclose(res, exp_res, atol=0.01, rtol=0)
 
@@ -46,7 +49,8 @@ PARAMS = [('eq', 'mae', 0), ('eq', 'mse', 0), ('eq', 'median_absolute_error', 0)
 
 @pytest.mark.parametrize('multi', [False, True])
 @pytest.mark.parametrize('mode, metric_name, exp_res', PARAMS)
-def test_both_zero(multi, mode, metric_name, exp_res):
+@pytest.mark.parametrize('streaming', [False, True])
+def test_both_zero(multi, mode, metric_name, exp_res, streaming):
     size = (10, 2) if multi else 10
     exp_res = [exp_res, exp_res] if multi else exp_res
 
@@ -60,7 +64,7 @@ def test_both_zero(multi, mode, metric_name, exp_res):
         targets = np.zeros(shape=size)
         predictions = np.arange(np.prod(size)).reshape(size)
 
-    metrics = RegressionMetrics(targets, predictions, multi=multi)
+    metrics = RegressionMetrics(targets, predictions, multi=multi, streaming=streaming)
     res = metrics.evaluate(metrics=metric_name, agg=None)
     res = list(res) if multi else res
 
@@ -75,12 +79,52 @@ PARAMS_SINGLE = [('mae', 1), ('mse', 1), ('median_absolute_error', 1), ('max_err
 @pytest.mark.parametrize('agg', [None, 'mean'])
 @pytest.mark.parametrize('targets, predictions', [([1, 1], [2, 2])])
 @pytest.mark.parametrize('metric_name, exp_res', PARAMS_SINGLE)
-def test_single_value(agg, targets, predictions, metric_name, exp_res):
+@pytest.mark.parametrize('streaming', [False, True])
+def test_single_value(agg, targets, predictions, metric_name, exp_res, streaming):
     exp_res = [exp_res, exp_res] if agg is None else exp_res
-    metrics = RegressionMetrics(targets, predictions, multi=True)
+    metrics = RegressionMetrics(targets, predictions, multi=True, streaming=streaming)
     res = metrics.evaluate(metrics=metric_name, agg=agg)
     res = list(res) if agg is None else res
     if np.isnan(exp_res).all():
         assert np.isnan(res).all()
     else:
         assert res == exp_res
+
+
+METRIC_NAMES = ['mae', 'mse', 'rmse', 'r2', 'explained_variance_ratio', 'median_absolute_error', 'max_error', 'acc']
+
+@pytest.mark.parametrize('shape', [(30,), (30, 3)])
+def test_streaming_updates(shape):
+    rng = np.random.RandomState(0)
+    batches = [(rng.randn(*shape), 2 * rng.randn(*shape), rng.rand(shape[0])) for _ in range(3)]
+    multi = len(shape) > 1
+    targets, predictions, weights = [np.concatenate(arrays) for arrays in zip(*batches)]
+    expected = RegressionMetrics(targets, predictions, weights=weights if multi else None, multi=multi)
+
+    metrics = RegressionMetrics(*batches[0][:2], weights=batches[0][2] if multi else None,
+                                multi=multi, streaming=True)
+    metrics.update(*batches[1][:2], weights=batches[1][2] if multi else None)
+    other = RegressionMetrics(*batches[2][:2], weights=batches[2][2] if multi else None, multi=multi, streaming=True)
+    metrics.update(pickle.loads(pickle.dumps(other)))
+
+    assert metrics.targets is None
+    for name in METRIC_NAMES:
+        assert np.allclose(metrics.evaluate(name, agg=None), expected.evaluate(name, agg=None)), name
+
+
+def test_streaming_sketch():
+    rng = np.random.RandomState(0)
+    targets = rng.randn(100000)
+    predictions = targets + rng.standard_t(3, size=100000)
+    expected = RegressionMetrics(targets, predictions)
+    metrics = RegressionMetrics(targets[:5000], predictions[:5000], streaming=True)
+    for i in range(5000, 100000, 5000):
+        metrics.update(targets[i:i + 5000], predictions[i:i + 5000])
+
+    assert len(metrics._sketches[0].means) <= 200     # pylint: disable=protected-access
+    assert np.isclose(metrics.evaluate('median_absolute_error'), expected.evaluate('median_absolute_error'),
+                      rtol=1e-3)
+    assert np.isclose(metrics.evaluate('acc', gap=1), expected.evaluate('acc', gap=1), atol=1e-3)
+    assert metrics.evaluate('max_error') == expected.evaluate('max_error')
+    with pytest.raises(ValueError):
+        metrics.update(RegressionMetrics(targets, predictions))
@@ -0,0 +1,122 @@
+""" Test random streams """
+# pylint: disable=missing-docstring
+import pickle
+import threading
+
+import numpy as np
+import pytest
+
+from batchflow import Dataset, Batch, Pipeline, action, R, P, V, F, NumpySampler, HistoSampler
+from batchflow.rng import RandomStreams, get_method
+
+
+class MyBatch(Batch):
+    components = ('images',)
+
+    @action
+    def store(self, value, values):
+        values[self.indices[0]] = value
+        return self
+
+
+def test_keys():
+    streams = RandomStreams(42)
+    assert (streams.get(3).random(5) == RandomStreams(42).get(3).random(5)).all()
+    assert not (streams.get(3).random(5) == streams.get(4).random(5)).any()
+    assert not (streams.get(3).random(5) == RandomStreams(43).get(3).random(5)).any()
+
+
+def test_local():
+    streams = RandomStreams(42)
+    assert streams.local is streams.local
+
+    values = {}
+    def _draw(name):
+        values[name] = streams.local.random(5)
+    threads = [threading.Thread(target=_draw, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not (values[0] == values[1]).any()
+
+    restored = pickle.loads(pickle.dumps(streams))
+    assert (restored.get(1).random(5) == streams.get(1).random(5)).all()
+
+
+def test_get_method():
+    rng = np.random.default_rng(1)
+    assert get_method(rng, 'randint').__name__ == 'integers'
+    assert get_method(np.random.RandomState(1), 'randint').__name__ == 'randint'
+    assert get_method(rng, 'unknown') is None
+
+
+def test_legacy_methods():
+    rng = np.random.default_rng(1)
+    assert set(get_method(rng, 'random_integers')(1, 2, size=100)) == {1, 2}
+    assert set(get_method(rng, 'random_integers')(2, size=100)) == {1, 2}
+    assert get_method(rng, 'rand')(2, 3).shape == (2, 3)
+    assert get_method(rng, 'randn')(3, size=4).shape == (4, 3)
+    assert isinstance(get_method(rng, 'rand')(), float)
+    assert (get_method(rng, 'tomaxint')(size=5) >= 0).all()
+
+    dataset = Dataset(10, batch_class=MyBatch)
+    floats, ints = {}, {}
+    pipeline = Pipeline().store(P(R('rand')), floats).store(R('random_integers', 1, 2, size=10), ints) << dataset
+    pipeline.run(2, n_epochs=1)
+    assert all(((value >= 0) & (value < 1)).all() for value in floats.values())
+    assert set(np.concatenate(list(ints.values()))) == {1, 2}
+
+
+@pytest.mark.parametrize('seed', [None, 7])
+def test_pipeline_seed(seed):
+    """ batches get the same random values with any prefetching """
+    dataset = Dataset(20, batch_class=MyBatch)
+    results = []
+    for prefetch in [0, 3, 3]:
+        values = {}
+        pipeline = (Pipeline()
+                    .store(P(R('normal', seed=seed)), values)
+                    .store(R('uniform'), values)) @ .5 << dataset
+        pipeline.run(2, n_epochs=1, shuffle=False, prefetch=prefetch, seed=42)
+        results.append(values)
+
+    assert 0 < len(results[0]) < 10
+    for values in results[1:]:
+        assert values.keys() == results[0].keys()
+        for key, value in values.items():
+            assert np.all(value == results[0][key])
+
+
+def test_pipeline_no_seed():
+    dataset = Dataset(10, batch_class=MyBatch)
+    pipeline = dataset.p.init_variable('values', []).update(V('values', mode='a'), R('uniform'))
+    first = list(pipeline.run(2, n_epochs=1, shuffle=False).v('values'))
+    second = pipeline.run(2, n_epochs=1, shuffle=False, reset=['iter', 'variables']).v('values')
+    assert len(first) == len(second) == 5
+    assert first != second
+
+
+def test_samplers():
+    assert (NumpySampler('n', seed=1).sample(5) == NumpySampler('n', seed=1).sample(5)).all()
+    assert (NumpySampler('randint', low=0, high=10, seed=1).sample(5) < 10).all()
+
+    histo = np.histogramdd(np.random.normal(size=(100, 2)), bins=4)
+    assert (HistoSampler(histo, seed=3).sample(10) == HistoSampler(histo, seed=3).sample(10)).all()
+
+
+def test_pipeline_samplers():
+    """ samplers draw the same values for a batch with any prefetching """
+    dataset = Dataset(20, batch_class=MyBatch)
+    results = []
+    for prefetch in [0, 3, 3]:
+        values = {}
+        sampler = NumpySampler('n', seed=1)
+        pipeline = Pipeline().store(F(lambda _, sampler=sampler: sampler.sample(3)), values) << dataset
+        pipeline.run(2, n_epochs=1, shuffle=False, prefetch=prefetch, seed=42)
+        results.append(values)
+
+    for values in results[1:]:
+        assert values.keys() == results[0].keys()
+        for key, value in values.items():
+            assert np.all(value == results[0][key])
@@ -0,0 +1,114 @@
+""" Test chunked columnar store """
+# pylint: disable=missing-docstring, redefined-outer-name
+import pickle
+
+import numpy as np
+import pytest
+
+from batchflow import Dataset, Batch, Pipeline
+from batchflow.prefetch import is_shared_memory_available
+from batchflow.store import ColumnStore
+
+
+pytest.importorskip('blosc')
+
+
+class MyBatch(Batch):
+    components = ('images', 'labels')
+
+
+SIZE = 50
+
+
+@pytest.fixture
+def dataset():
+    images = np.arange(SIZE * 6, dtype=np.float32).reshape(SIZE, 2, 3)
+    labels = np.arange(SIZE) % 3
+    return Dataset(SIZE, batch_class=MyBatch, preloaded=(images, labels))
+
+
+@pytest.fixture
+def store_path(dataset, tmp_path):
+    path = str(tmp_path / 'store')
+    dataset.p.dump(fmt='store', dst=path, chunk_size=8).run(7, n_epochs=1, shuffle=False)
+    return path
+
+
+def test_dump(dataset, store_path):
+    store = ColumnStore(store_path)
+    assert len(store) == SIZE
+    assert store.components == ('images', 'labels')
+    assert (store.keys == dataset.indices).all()
+    assert (store.read('images') == dataset.preloaded[0]).all()
+    assert store['images'].shape == (SIZE, 2, 3)
+    assert store['images'].dtype == np.float32
+
+
+@pytest.mark.parametrize('positions', [[3], np.arange(5, 30), np.arange(8, 16), [40, 2, 17, 3, 3], []])
+@pytest.mark.parametrize('compression', ['blosc', None])
+def test_read(dataset, tmp_path, positions, compression):
+    store = ColumnStore(str(tmp_path / 'store'), mode='a')
+    store.append(dataset.indices, dict(images=dataset.preloaded[0]), compression=compression, chunk_size=8)
+
+    result = store.read('images', positions=positions)
+    assert result.shape == (len(positions), 2, 3)
+    assert (result == dataset.preloaded[0][positions]).all()
+    result[...] = 0
+    if compression is None:
+        assert isinstance(store.mmap('images'), np.memmap)
+    else:
+        with pytest.raises(ValueError):
+            store.mmap('images')
+
+
+def test_append_checks(tmp_path):
+    store = ColumnStore(str(tmp_path / 'store'), mode='a')
+    store.append(['a', 'b'], dict(x=np.zeros((2, 3))))
+    with pytest.raises(ValueError):
+        store.append(['c'], dict(x=np.zeros((1, 4))))
+    with pytest.raises(ValueError):
+        store.append(['c'], dict(y=np.zeros(1)))
+    with pytest.raises(TypeError):
+        ColumnStore(str(tmp_path / 'other'), mode='a').append([0], dict(x=np.array([[1], 'a'], dtype=object)))
+    with pytest.raises(FileNotFoundError):
+        ColumnStore(str(tmp_path / 'missing'))
+
+    store = pickle.loads(pickle.dumps(ColumnStore(str(tmp_path / 'store'))))
+    assert store.keys.tolist() == ['a', 'b']
+    assert (store['x'][['b']] == 0).all()
+
+
+def test_load(dataset, store_path):
+    images = []
+    pipeline = (Pipeline()
+                .load(fmt='store', src=store_path, dst=('images', 'labels'))
+                .call(lambda batch: images.append(batch.images))) << Dataset(SIZE, batch_class=MyBatch)
+    pipeline.run(10, n_epochs=1, shuffle=True)
+    assert sorted(np.concatenate(images)[:, 0, 0].tolist()) == dataset.preloaded[0][:, 0, 0].tolist()
+
+
+def test_preloaded(dataset, store_path):
+    store = ColumnStore(store_path)
+    store_dataset = Dataset(store.index, batch_class=MyBatch, preloaded=store)
+    batch = store_dataset.create_batch(np.array([4, 9, 1]))
+    assert (batch.images == dataset.preloaded[0][[4, 9, 1]]).all()
+    assert (batch.labels == dataset.preloaded[1][[4, 9, 1]]).all()
+
+    sizes = []
+    store_dataset.p.call(lambda batch: sizes.append(len(batch.images))).run(16, n_epochs=1)
+    assert sizes == [16, 16, 16, 2]
+
+
+@pytest.mark.parametrize('target', ['threads', 'mpc'])
+def test_parallel_dump(tmp_path, target):
+    if target == 'mpc' and not is_shared_memory_available():
+        pytest.skip("shared memory is not available")
+    size = 1000
+    dataset = Dataset(size, batch_class=MyBatch, preloaded=(np.arange(size * 6.).reshape(size, 2, 3), np.arange(size)))
+    path = str(tmp_path / 'store')
+    dataset.p.dump(fmt='store', dst=path, chunk_size=8).run(5, n_epochs=1, prefetch=8, target=target)
+
+    store = ColumnStore(path)
+    assert len(store) == size
+    assert sorted(store.keys) == list(range(size))
+    assert (store.read('labels', keys=np.arange(size)) == np.arange(size)).all()
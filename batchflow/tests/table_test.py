@@ -0,0 +1,172 @@
+""" Test partial reads of tables """
+# pylint: disable=missing-docstring, redefined-outer-name
+import os
+import sys
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from batchflow import Dataset, DatasetIndex, Batch
+from batchflow.prefetch import is_shared_memory_available
+from batchflow import table
+from batchflow.table import TableSource, TableWriter, open_table, clear_tables
+
+
+pytest.importorskip('pyarrow')
+
+
+SIZE = 40
+
+
+class MyBatch(Batch):
+    components = ('x', 'y')
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame(dict(id=['item%d' % i for i in range(SIZE)], x=np.arange(SIZE) * 2., y=np.arange(SIZE) % 5))
+
+
+def write(frame, path, fmt):
+    if fmt == 'csv':
+        frame.to_csv(path, index=False)
+    elif fmt == 'feather':
+        frame.to_feather(path)
+    elif fmt == 'parquet':
+        frame.to_parquet(path, index=False, row_group_size=7)
+    return path
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'feather', 'parquet'])
+@pytest.mark.parametrize('index_col', [None, 'id'])
+def test_loc(frame, tmp_path, fmt, index_col):
+    path = write(frame, str(tmp_path / ('table.' + fmt)), fmt)
+    source = TableSource(path, fmt, index_col=index_col)
+    assert len(source) == SIZE
+
+    expected = frame.set_index('id') if index_col else frame
+    keys = expected.index.values[[30, 2, 3, 4, 17, 39]]
+    result = source.loc[keys]
+    pd.testing.assert_frame_equal(result[['x', 'y']], expected.loc[keys, ['x', 'y']], check_names=False)
+
+    with pytest.raises(KeyError):
+        _ = source.loc[['missing'] if index_col else [SIZE]]
+
+
+def test_parquet_index(frame, tmp_path):
+    path = str(tmp_path / 'table.parquet')
+    frame.set_index('id').to_parquet(path, row_group_size=5)
+    result = TableSource(path, 'parquet').loc[['item12', 'item3']]
+    assert result.index.tolist() == ['item12', 'item3']
+    assert result['x'].tolist() == [24., 6.]
+
+
+def test_open_once(frame, tmp_path):
+    path = write(frame, str(tmp_path / 'table.csv'), 'csv')
+    assert open_table(path, 'csv', index_col='id') is open_table(path, 'csv', index_col='id')
+    assert open_table(path, 'csv', index_col='id') is not open_table(path, 'csv')
+
+
+def test_open_tables_limit(frame, tmp_path, monkeypatch):
+    monkeypatch.setattr(table, 'MAX_OPEN_TABLES', 2)
+    path = write(frame, str(tmp_path / 'table.csv'), 'csv')
+    first = open_table(path, 'csv', usecols=['x'])
+    assert open_table(path, 'csv', usecols=['x']) is first
+    open_table(path, 'csv', usecols=['y'])
+    open_table(path, 'csv', usecols=['id'])
+    assert open_table(path, 'csv', usecols=['x']) is not first
+
+    first = open_table(path, 'csv')
+    clear_tables()
+    assert open_table(path, 'csv') is not first
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'feather'])
+def test_batch_load(frame, tmp_path, fmt):
+    path = write(frame, str(tmp_path / ('table.' + fmt)), fmt)
+    index_col = 'id' if fmt == 'csv' else None
+    index = DatasetIndex(frame['id'].values if index_col else np.arange(SIZE))
+    values = []
+    (Dataset(index, batch_class=MyBatch).p
+     .load(fmt=fmt, src=path, dst=('x', 'y'), index_col=index_col)
+     .call(lambda batch: values.append(batch.x))
+     .run(8, n_epochs=1, shuffle=True))
+    assert sorted(np.concatenate(values)) == frame['x'].tolist()
+
+
+@pytest.mark.parametrize('fmt', ['feather', 'parquet', 'csv'])
+def test_writer(frame, tmp_path, fmt):
+    path = str(tmp_path / ('table.' + fmt))
+    writer = TableWriter(path, fmt, queue_size=2)
+    for start in range(0, SIZE, 7):
+        writer.write(frame.iloc[start:start + 7])
+    writer.flush()
+    assert writer.n_rows == SIZE
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.write(frame)
+
+    result = TableSource(path, fmt).loc[np.arange(SIZE)]
+    assert result['id'].tolist() == frame['id'].tolist()
+    assert result['x'].tolist() == frame['x'].tolist()
+
+
+def test_writer_error(frame, tmp_path):
+    writer = TableWriter(str(tmp_path / 'table.feather'), 'feather')
+    writer.write(frame)
+    writer.write(frame.drop(columns='x'))
+    with pytest.raises(KeyError):
+        writer.close()
+
+
+@pytest.mark.parametrize('prefetch', [0, 4])
+def test_pipeline_dump(frame, tmp_path, prefetch):
+    path = str(tmp_path / 'table.feather')
+    dataset = Dataset(SIZE, batch_class=MyBatch, preloaded=(frame['x'].values, frame['y'].values))
+    pipeline = dataset.p.dump(fmt='feather', dst=path, components=('x', 'y'))
+    pipeline.run(6, n_epochs=1, shuffle=True, prefetch=prefetch)
+
+    result = TableSource(path, 'feather').loc[np.arange(SIZE)]
+    assert sorted(result['x']) == frame['x'].tolist()
+
+@pytest.mark.skipif(not is_shared_memory_available(), reason="shared memory is not available")
+def test_pipeline_dump_mpc(frame, tmp_path):
+    path = str(tmp_path / 'table.feather')
+    dataset = Dataset(SIZE, batch_class=MyBatch, preloaded=(frame['x'].values, frame['y'].values))
+    pipeline = dataset.p.dump(fmt='feather', dst=path, components=('x', 'y'))
+    pipeline.run(6, n_epochs=1, shuffle=True, prefetch=2, target='mpc')
+
+    result = TableSource(path, 'feather').loc[np.arange(SIZE)]
+    assert sorted(result['x']) == frame['x'].tolist()
+
+def test_pipeline_dump_closed_generator(frame, tmp_path):
+    path = str(tmp_path / 'table.feather')
+    dataset = Dataset(SIZE, batch_class=MyBatch, preloaded=(frame['x'].values, frame['y'].values))
+    pipeline = dataset.p.dump(fmt='feather', dst=path, components=('x', 'y'))
+    batches = pipeline.gen_batch(8, n_epochs=None)
+    next(batches)
+    next(batches)
+    batches.close()
+
+    assert len(TableSource(path, 'feather')) == 16
+
+def test_pipeline_dump_next_batch_at_exit(tmp_path):
+    path = str(tmp_path / 'table.feather')
+    script = """
+import numpy as np
+from batchflow import Dataset, Batch
+
+class MyBatch(Batch):
+    components = ('x',)
+
+dataset = Dataset(100, batch_class=MyBatch, preloaded=(np.arange(100.),))
+pipeline = dataset.p.dump(fmt='feather', dst=%r, components='x')
+for _ in range(3):
+    pipeline.next_batch(8, n_epochs=None)
+""" % path
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    subprocess.run([sys.executable, '-c', script], cwd=root, check=True, timeout=120)
+
+    assert len(TableSource(path, 'feather')) == 24
@@ -0,0 +1,93 @@
+""" Test shared worker pools used by parallel actions """
+# pylint: disable=missing-docstring, redefined-outer-name
+import threading
+
+import numpy as np
+import pytest
+
+from batchflow import Dataset, Batch, action, inbatch_parallel
+from batchflow.decorators import WorkerPools, worker_pools
+
+
+class MyBatch(Batch):
+    components = ('images',)
+
+    @action
+    @inbatch_parallel(init='indices', post='_assemble', target='threads', dst='images')
+    def double(self, ix, **kwargs):
+        _ = kwargs
+        return self.get(ix, 'images') * 2
+
+    @inbatch_parallel(init='indices', target='threads')
+    def nested(self, ix, **kwargs):
+        _ = ix, kwargs
+        self.double(n_workers=2)
+
+    @inbatch_parallel(init='indices', target='threads')
+    def nested_twice(self, ix, **kwargs):
+        _ = ix, kwargs
+        self.nested(n_workers=2)
+
+
+@pytest.fixture
+def pools():
+    worker_pools.shutdown()
+    worker_pools.reset_stats()
+    yield worker_pools
+    worker_pools.shutdown()
+
+
+def test_reuse(pools):
+    dataset = Dataset(10, batch_class=MyBatch, preloaded=(np.arange(10),))
+    pipeline = dataset.p.double(n_workers=2).double(n_workers=2)
+    pipeline.run(5, n_epochs=1, reset=None)
+
+    assert pools.misses == 1
+    assert pools.hits == 3
+    assert len(pools) == 1
+
+
+def test_keys():
+    pools = WorkerPools()
+    first = pools.get('threads', 2)
+    second = pools.get('threads', 3)
+    pools.release(first)
+    pools.release(second)
+
+    assert first is not second
+    assert pools.get('threads', 2) is first
+    assert pools.stats == dict(hits=1, misses=2, pools=2)
+    pools.shutdown()
+
+
+def test_shutdown_on_reset(pools):
+    dataset = Dataset(10, batch_class=MyBatch, preloaded=(np.arange(10),))
+    pipeline = dataset.p.double(n_workers=2)
+    pipeline.next_batch(5)
+    assert len(pools) == 1
+
+    pipeline.reset('iter')
+    assert len(pools) == 0
+
+
+def test_retired_pool_is_usable():
+    pools = WorkerPools()
+    with pools.use('threads', 2) as executor:
+        pools.shutdown()
+        assert executor.submit(sum, [1, 2]).result() == 3
+    assert len(pools) == 0
+
+
+def test_nested(pools):
+    batch = MyBatch(np.arange(4), preloaded=(np.arange(4),))
+    batch.nested(n_workers=2)
+    assert pools.misses == 1
+
+
+def test_nested_three_levels(pools):
+    batch = MyBatch(np.arange(4), preloaded=(np.arange(4),))
+    thread = threading.Thread(target=batch.nested_twice, kwargs=dict(n_workers=2), daemon=True)
+    thread.start()
+    thread.join(timeout=60)
+    assert not thread.is_alive()
+    assert pools.misses == 1
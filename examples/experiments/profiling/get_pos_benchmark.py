@@ -0,0 +1,51 @@
+""" Benchmark item lookups in batch components
+
+Compares per-item access (`batch[ix]`, `batch.get(ix, component)`) with a linear scan
+over the index and shows how the lookup time scales with the batch size.
+"""
+import sys
+import time
+
+import numpy as np
+
+sys.path.append("../../..")
+from batchflow import Batch  # pylint: disable=wrong-import-position
+
+
+class MyBatch(Batch):
+    components = 'images', 'labels'
+
+
+def linear_scan(indices, items):
+    """ Position lookup as it was done before (one full scan per item) """
+    return [np.where(indices == item)[0][0] for item in items]
+
+
+def bench(func, *args, repeat=3):
+    """ Return the best time of several runs """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    print('{:>8} {:>14} {:>14} {:>14} {:>14}'.format('size', 'scan, ms', 'batch[ix], ms',
+                                                     'bulk, ms', 'bulk/item, us'))
+    for size in 2 ** np.arange(5, 17):
+        indices = np.random.permutation(size * 10)[:size]
+        batch = MyBatch(indices, preloaded=(np.arange(size * 10), np.arange(size * 10)))
+        _ = batch.data
+        items = np.random.permutation(indices)
+
+        scan_time = bench(linear_scan, indices, items[:1024]) * size / min(size, 1024)
+        item_time = bench(lambda: [batch.get(ix, 'images') for ix in items])
+        bulk_time = bench(batch.data.find_in_index, items)
+        print('{:>8} {:>14.2f} {:>14.2f} {:>14.3f} {:>14.3f}'.format(size, scan_time * 1e3, item_time * 1e3,
+                                                                  bulk_time * 1e3, bulk_time / size * 1e6))
+
+
+if __name__ == '__main__':
+    main()
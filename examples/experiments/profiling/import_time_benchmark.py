@@ -0,0 +1,65 @@
+""" Benchmark `import batchflow` startup time
+
+Runs ``python -X importtime -c "import batchflow"`` (and the same for the first use of a few features)
+in fresh interpreters and shows the total import time along with the slowest imported modules.
+Pass ``--max-ms`` to fail when ``import batchflow`` takes longer, e.g. in a CI job.
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+
+STATEMENTS = [
+    'import batchflow',
+    'import batchflow; batchflow.Pipeline',
+    'import batchflow; batchflow.ImagesBatch',
+    'import batchflow; batchflow.ScipySampler',
+]
+
+
+def import_times(statement):
+    """ Return cumulative import times of top-level modules in microseconds """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..')
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([root, os.environ.get('PYTHONPATH', '')])}
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], env=env, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # only modules imported directly by the statement (nested ones are indented)
+        if not name[1:].startswith(' '):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def bench(statement, repeat=5):
+    """ Return import times of the fastest of several runs """
+    runs = [import_times(statement) for _ in range(repeat)]
+    return min(runs, key=lambda times: sum(times.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--max-ms', type=float, default=None, help='the maximum time of `import batchflow`')
+    parser.add_argument('--top', type=int, default=5, help='the number of the slowest modules to show')
+    args = parser.parse_args()
+
+    total = None
+    for statement in STATEMENTS:
+        times = bench(statement)
+        total_ms = sum(times.values()) / 1e3
+        total = total_ms if total is None else total
+        print('{:<45} {:>10.1f} ms'.format(statement, total_ms))
+        for name, value in sorted(times.items(), key=lambda item: -item[1])[:args.top]:
+            print('    {:<41} {:>10.1f} ms'.format(name, value / 1e3))
+
+    if args.max_ms is not None and total > args.max_ms:
+        print('`import batchflow` takes {:.1f} ms, which is more than {} ms'.format(total, args.max_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()